@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ A mapping bounded by both the number of entries and the total size of the entries.
+    The least recently used entries are evicted once either bound is exceeded.
+    The size of an entry is given by the caller on put(), e.g., the length of its serialization.
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.kv = OrderedDict()  # key -> (value, size)
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self.kv.get(key, None)
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.kv.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, size=0):
+        old = self.kv.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        self.kv[key] = (value, size)
+        self.total_bytes += size
+        self.__evict()
+
+    def pop(self, key, default=None):
+        item = self.kv.pop(key, None)
+        if item is None:
+            return default
+        self.total_bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self.kv.clear()
+        self.total_bytes = 0
+
+    def __evict(self):
+        while len(self.kv) > self.max_entries or (
+            self.max_bytes is not None
+            and self.total_bytes > self.max_bytes
+            and len(self.kv) > 1
+        ):
+            _, (_, size) = self.kv.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.kv
+
+    def __len__(self):
+        return len(self.kv)
+
+    def stats(self):
+        return {
+            "entries": len(self.kv),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlightCache:
+    """ Runs concurrent calls with the same key only once and caches the result for ttl seconds.
+    A result is only returned for the same version it was computed at, e.g., the chain tips, so it
+    is dropped as soon as the version changes. Exceptions are passed to all the merged callers
+    and are not cached. If the caller running the computation is cancelled, so are the merged
+    callers.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.cache = LRUCache(max_entries)
+        self.inflight = dict()  # (key, version) -> future
+        self.merged = 0
+
+    async def get(self, key, version, func):
+        """ func is a coroutine function computing the result """
+        entry = self.cache.get(key)
+        if entry is not None:
+            entry_version, expire_time, result = entry
+            if entry_version == version and time.monotonic() < expire_time:
+                return result
+
+        flight_key = (key, version)
+        future = self.inflight.get(flight_key)
+        if future is not None:
+            self.merged += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_event_loop().create_future()
+        self.inflight[flight_key] = future
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved even if no caller is waiting
+            raise
+        except BaseException:
+            # e.g., this caller is cancelled, the merged callers must not wait forever
+            future.cancel()
+            raise
+        finally:
+            del self.inflight[flight_key]
+
+        future.set_result(result)
+        self.cache.put(key, (version, time.monotonic() + self.ttl, result))
+        return result
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["merged"] = self.merged
+        return stats
@@ -0,0 +1,33 @@
+def is_same_chain(
+    longer_block_header,
+    shorter_block_header,
+    get_hash_by_height,
+    get_header_by_hash,
+    get_prev_hash,
+):
+    """ Whether shorter_block_header is an ancestor of (or the same as) longer_block_header.
+    get_hash_by_height reads the height index of a chain, which must link each block to the one
+    indexed at the height below it. Heights not indexed (None) fall back to walking the headers.
+    The headers of longer_block_header are only walked back until the indexed chain is reached,
+    so the check takes O(1) if longer_block_header is in the indexed chain and
+    O(length of its fork) otherwise, instead of O(height difference).
+    """
+    if shorter_block_header.height > longer_block_header.height:
+        return False
+
+    shorter_hash = shorter_block_header.get_hash()
+    header = longer_block_header
+    header_hash = header.get_hash()
+    indexed = False
+    while header.height > shorter_block_header.height:
+        if not indexed and get_hash_by_height(header.height) == header_hash:
+            # the ancestors of header are the indexed blocks
+            indexed = True
+            indexed_hash = get_hash_by_height(shorter_block_header.height)
+            if indexed_hash is not None:
+                return indexed_hash == shorter_hash
+        header_hash = get_prev_hash(header)
+        header = get_header_by_hash(header_hash)
+        if header is None:
+            return False
+    return header_hash == shorter_hash
@@ -121,9 +121,29 @@ class ClusterConfig(BaseConfig):
     P2P_PORT = 38291
     JSON_RPC_PORT = 38391
     PRIVATE_JSON_RPC_PORT = 38491
+    # Calls of a JSON-RPC batch request running at the same time
+    JSON_RPC_BATCH_CONCURRENCY = 16
+    # Events waiting to be sent to a websocket subscriber before it is disconnected
+    JSON_RPC_WEBSOCKET_QUEUE_SIZE = 1024
+    # Fraction of the JSON-RPC request bodies written to the log, 0 to log none
+    JSON_RPC_LOG_SAMPLE_RATE = 0
     ENABLE_TRANSACTION_HISTORY = False
 
     DB_PATH_ROOT = "./db"
+    # Bounds of the LRU caches of deserialized blocks and headers in front of the db
+    BLOCK_CACHE_MAX_ENTRIES = 256
+    BLOCK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    HEADER_CACHE_MAX_ENTRIES = 20000
+    HEADER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    RECEIPT_CACHE_MAX_ENTRIES = 256
+    RECEIPT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    # Decoded state trie nodes cached per shard db
+    TRIE_NODE_CACHE_SIZE = 100000
+    # The flat state diffs of the blocks deeper than this below the shard tip are deleted
+    FLAT_STATE_DIFF_DEPTH = 1024
+    # Workers recovering tx senders off the event loop of a slave, 0 to recover them inline
+    SENDER_RECOVERY_WORKERS = 0
+    SENDER_RECOVERY_USE_PROCESSES = False
     LOG_LEVEL = "info"
 
     MINE = False
@@ -7,6 +7,28 @@ from quarkchain.evm.bloom import bloom
 from quarkchain.utils import Logger
 
 
+def create_bloom_bits(recipients: List[bytes], topics: List[List[bytes]]):
+    """ Bloom values to match a header bloom against:
+    innermost: an integer with 3 bits set
+    outer: a list of those integers are connected by OR operator
+    outermost: a list of those lists are connected by AND operator
+    """
+    bloom_bits = []  # type: List[List[int]]
+    for r in recipients:
+        bloom_bits.append([bloom(r)])
+    for tp_list in topics:
+        if not tp_list:
+            # regard as wildcard
+            continue
+        bloom_bits.append([bloom(tp) for tp in tp_list])
+    return bloom_bits
+
+
+def match_bloom_bits(header_bloom: int, bloom_bits: List[List[int]]) -> bool:
+    # same byte order as in bloom.py
+    return all(any((header_bloom & b) == b for b in bit_list) for bit_list in bloom_bits)
+
+
 class Filter:
     """
     Filter class for logs, blocks, pending tx, etc.
@@ -35,48 +57,66 @@ class Filter:
         self.start_block = start_block
         self.end_block = end_block
         self.block_hash = block_hash  # TODO: not supported yet
-        # construct bloom bits:
-        # innermost: an integer with 3 bits set
-        # outer: a list of those integers are connected by OR operator
-        # outermost: a list of those lists are connected by AND operator
-        self.bloom_bits = []  # type: List[List[int]]
-        for r in self.recipients:
-            b = bloom(r)
-            self.bloom_bits.append([b])
+        self.bloom_bits = create_bloom_bits(self.recipients, topics)
         self.topics = topics
-        for tp_list in topics:
-            if not tp_list:
-                # regard as wildcard
-                continue
-            bloom_list = []
-            for tp in tp_list:
-                bloom_list.append(bloom(tp))
-            self.bloom_bits.append(bloom_list)
         # a timestamp to control timeout. will be set upon running
         self.start_ts = None
 
     def _get_block_candidates(self) -> List[MinorBlock]:
         """Use given criteria to generate potential blocks matching the bloom."""
-        ret = []
-        for i in range(self.start_block, self.end_block + 1):
-            block = self.db.get_minor_block_by_height(i)
+        # the blocks outside of the sections indexed by the bloom bits have to be scanned
+        index_start, index_end = self.db.get_bloom_bits_indexed_range()
+        ret = self._scan_block_candidates(
+            self.start_block, min(self.end_block, index_start - 1)
+        )
+
+        start_height = max(self.start_block, index_start)
+        end_height = min(self.end_block, index_end - 1)
+        heights = []
+        if start_height <= end_height:
+            heights = self.db.get_heights_by_bloom_bits(
+                self.bloom_bits, start_height, end_height
+            )
+        for i, height in enumerate(heights):
+            block = self.db.get_minor_block_by_height(height)
             if not block:
                 Logger.error(
                     "No block found for height {} at shard {}".format(
-                        i, self.db.branch.get_shard_id()
+                        height, self.db.branch.get_shard_id()
                     )
                 )
                 continue
-            should_skip_block = False
-            # same byte order as in bloom.py
-            header_bloom = block.header.bloom
-            for bit_list in self.bloom_bits:
-                if not any((header_bloom & i) == i for i in bit_list):
-                    should_skip_block = True
-                    break
+            ret.append(block)
 
-            if not should_skip_block:
-                ret.append(block)
+            if (1 + i) % 100 == 0 and time.time() - self.start_ts > Filter.TIMEOUT:
+                raise Exception("Filter timeout")
+
+        ret.extend(
+            self._scan_block_candidates(
+                max(self.start_block, index_end), self.end_block
+            )
+        )
+        return ret
+
+    def _scan_block_candidates(self, start_block, end_block) -> List[MinorBlock]:
+        """Read the headers one by one to check the bloom, and the blocks that match."""
+        ret = []
+        for i in range(start_block, end_block + 1):
+            block_hash = self.db.get_minor_block_hash_by_height(i)
+            header = (
+                self.db.get_minor_block_header_by_hash(block_hash, False)
+                if block_hash
+                else None
+            )
+            if not header:
+                Logger.error(
+                    "No block found for height {} at shard {}".format(
+                        i, self.db.branch.get_shard_id()
+                    )
+                )
+                continue
+            if match_bloom_bits(header.bloom, self.bloom_bits):
+                ret.append(self.db.get_minor_block_by_hash(block_hash, False))
 
             if (1 + i) % 100 == 0 and time.time() - self.start_ts > Filter.TIMEOUT:
                 raise Exception("Filter timeout")
@@ -87,8 +127,7 @@ class Filter:
         """Given potential blocks, re-run tx to find exact matches."""
         ret = []
         for b_i, block in enumerate(blocks):
-            for i in range(len(block.tx_list or [])):
-                r = block.get_receipt(self.db.db, i)
+            for r in self.db.get_receipt_list(block):
                 for log in r.logs:
                     # empty recipient means no filtering
                     if self.recipients and log.recipient not in self.recipients:
@@ -1,18 +1,25 @@
 import asyncio
+import functools
 import inspect
 import json
+import random
+import time
 from typing import List, Callable, Optional
 
 import aiohttp_cors
 import rlp
-from aiohttp import web
+from aiohttp import web, WSMsgType
 from async_armor import armor
 from decorator import decorator
 from jsonrpcserver import config
 from jsonrpcserver.async_methods import AsyncMethods
 from jsonrpcserver.exceptions import InvalidParams
 
+from quarkchain.cache import SingleFlightCache
+from quarkchain.cluster.filter import create_bloom_bits, match_bloom_bits
 from quarkchain.cluster.master import MasterServer
+from quarkchain.cluster.rpc_metrics import RpcMetrics
+from quarkchain.cluster.subscription import Subscriber, SubscriptionManager
 from quarkchain.core import Address, Branch, Code, Transaction, Log
 from quarkchain.core import RootBlock, TransactionReceipt, MinorBlock
 from quarkchain.evm.transactions import Transaction as EvmTransaction
@@ -29,6 +36,32 @@ DEFAULT_GASPRICE = 10 * denoms.gwei
 JSON_RPC_CLIENT_REQUEST_MAX_SIZE = 16 * 1024 * 1024
 
 
+# Reads whose results only change with the chain tips. Concurrent identical calls are merged
+# into one and the responses are cached until the root tip changes or a minor block is added.
+CACHED_METHODS = {
+    "getTransactionCount",
+    "getBalance",
+    "getAccountData",
+    "getRootBlockById",
+    "getRootBlockByHeight",
+    "getMinorBlockById",
+    "getMinorBlockByHeight",
+    "getTransactionReceipt",
+    "getStorageAt",
+    "getCode",
+    "gasPrice",
+    "eth_gasPrice",
+    "eth_getBlockByNumber",
+    "eth_getBalance",
+    "eth_getTransactionCount",
+    "eth_getCode",
+    "eth_getTransactionReceipt",
+    "eth_getStorageAt",
+}
+RESPONSE_CACHE_TTL = 1  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 4096
+
+
 # Disable jsonrpcserver logging
 config.log_requests = False
 config.log_responses = False
@@ -159,25 +192,28 @@ def root_block_encoder(block):
     }
 
     for header in block.minor_block_header_list:
-        h = {
-            "id": id_encoder(header.get_hash(), header.branch.get_shard_id()),
-            "height": quantity_encoder(header.height),
-            "hash": data_encoder(header.get_hash()),
-            "branch": quantity_encoder(header.branch.value),
-            "shard": quantity_encoder(header.branch.get_shard_id()),
-            "hashPrevMinorBlock": data_encoder(header.hash_prev_minor_block),
-            "idPrevMinorBlock": id_encoder(
-                header.hash_prev_minor_block, header.branch.get_shard_id()
-            ),
-            "hashPrevRootBlock": data_encoder(header.hash_prev_root_block),
-            "nonce": quantity_encoder(header.nonce),
-            "difficulty": quantity_encoder(header.difficulty),
-            "timestamp": quantity_encoder(header.create_time),
-        }
-        d["minorBlockHeaders"].append(h)
+        d["minorBlockHeaders"].append(minor_block_header_encoder(header))
     return d
 
 
+def minor_block_header_encoder(header):
+    return {
+        "id": id_encoder(header.get_hash(), header.branch.get_shard_id()),
+        "height": quantity_encoder(header.height),
+        "hash": data_encoder(header.get_hash()),
+        "branch": quantity_encoder(header.branch.value),
+        "shard": quantity_encoder(header.branch.get_shard_id()),
+        "hashPrevMinorBlock": data_encoder(header.hash_prev_minor_block),
+        "idPrevMinorBlock": id_encoder(
+            header.hash_prev_minor_block, header.branch.get_shard_id()
+        ),
+        "hashPrevRootBlock": data_encoder(header.hash_prev_root_block),
+        "nonce": quantity_encoder(header.nonce),
+        "difficulty": quantity_encoder(header.difficulty),
+        "timestamp": quantity_encoder(header.create_time),
+    }
+
+
 def minor_block_encoder(block, include_transactions=False):
     """Encode a block as JSON object.
 
@@ -351,6 +387,15 @@ def shard_id_decoder(data):
         return None
 
 
+def optional_shard_id_decoder(data):
+    """ None if the shard is omitted; unlike shard_id_decoder an invalid shard is an error """
+    if data is None:
+        return None
+    if not isinstance(data, str):
+        raise InvalidParams("Invalid shard")
+    return quantity_decoder(data)
+
+
 def eth_address_to_quarkchain_address_decoder(hex_str):
     eth_hex = hex_str[2:]
     if len(eth_hex) != 40:
@@ -369,20 +414,27 @@ private_methods = AsyncMethods()
 # noinspection PyPep8Naming
 class JSONRPCServer:
     @classmethod
-    def start_public_server(cls, env, master_server):
+    def start_public_server(cls, env, master_server, metrics=None):
         server = cls(
-            env, master_server, env.cluster_config.JSON_RPC_PORT, public_methods
+            env,
+            master_server,
+            env.cluster_config.JSON_RPC_PORT,
+            public_methods,
+            metrics=metrics,
         )
         server.start()
         return server
 
     @classmethod
-    def start_private_server(cls, env, master_server):
+    def start_private_server(cls, env, master_server, metrics=None):
+        """ metrics: pass the RpcMetrics of the public server to report its calls here """
         server = cls(
             env,
             master_server,
             env.cluster_config.PRIVATE_JSON_RPC_PORT,
             private_methods,
+            metrics=metrics,
+            serve_metrics=True,
         )
         server.start()
         return server
@@ -394,46 +446,285 @@ class JSONRPCServer:
             methods.add(method)
         for method in private_methods.values():
             methods.add(method)
-        server = cls(env, master_server, env.cluster_config.JSON_RPC_PORT, methods)
+        server = cls(
+            env,
+            master_server,
+            env.cluster_config.JSON_RPC_PORT,
+            methods,
+            serve_metrics=True,
+        )
         server.start()
         return server
 
-    def __init__(self, env, master_server: MasterServer, port, methods: AsyncMethods):
+    def __init__(
+        self,
+        env,
+        master_server: MasterServer,
+        port,
+        methods: AsyncMethods,
+        metrics: RpcMetrics = None,
+        serve_metrics=False,
+    ):
+        """ metrics may be shared by several servers to record all their calls together.
+        serve_metrics: whether to expose the metrics to Prometheus at /metrics
+        """
         self.loop = asyncio.get_event_loop()
         self.port = port
         self.env = env
         self.master = master_server
-        self.counters = dict()
+        self.metrics = metrics if metrics is not None else RpcMetrics("qkc_jsonrpc")
+        self.serve_metrics = serve_metrics
+        self.response_cache = SingleFlightCache(
+            RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+        )
+        self.websockets = set()
 
         # Bind RPC handler functions to this instance
         self.handlers = AsyncMethods()
         for rpc_name in methods:
-            func = methods[rpc_name]
-            self.handlers[rpc_name] = func.__get__(self, self.__class__)
+            func = methods[rpc_name].__get__(self, self.__class__)
+            if rpc_name in CACHED_METHODS:
+                func = self.__cache_response(rpc_name, func)
+            self.handlers[rpc_name] = func
+
+    def __cache_response(self, rpc_name, func):
+        """ Serve the calls of func from the response cache keyed by the method and params """
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (rpc_name, json.dumps([args, kwargs], sort_keys=True))
+            return await self.response_cache.get(
+                key,
+                self.master.get_tip_version(),
+                lambda: func(*args, **kwargs),
+            )
+
+        return wrapper
+
+    @property
+    def counters(self):
+        return self.metrics.get_counts()
+
+    async def __dispatch(self, method, request):
+        """ Dispatch a single call and record its metrics.
+        Returns the response and its serialization, which is empty for a notification.
+        """
+        if not isinstance(method, str) or method not in self.handlers:
+            method = "unknown"
+        self.metrics.start(method, len(request))
+        start_time = time.monotonic()
+        response, body = None, ""
+        try:
+            # Use armor to prevent the handler from being cancelled when
+            # aiohttp server loses connection to client
+            response = await armor(self.handlers.dispatch(request))
+            if not response.is_notification:
+                body = json.dumps(response)
+        finally:
+            self.metrics.finish(
+                method,
+                time.monotonic() - start_time,
+                len(body),
+                error=response is None
+                or (not response.is_notification and "error" in response),
+            )
+        return response, body
 
     async def __handle(self, request):
         request = await request.text()
-        Logger.info(request)
+        sample_rate = self.env.cluster_config.JSON_RPC_LOG_SAMPLE_RATE
+        if sample_rate > 0 and random.random() < sample_rate:
+            Logger.info(request)
 
         d = dict()
         try:
             d = json.loads(request)
         except Exception:
             pass
-        method = d.get("method", "null")
-        if method in self.counters:
-            self.counters[method] += 1
-        else:
-            self.counters[method] = 1
-        # Use armor to prevent the handler from being cancelled when
-        # aiohttp server loses connection to client
-        response = await armor(self.handlers.dispatch(request))
+        if isinstance(d, list) and d:
+            return await self.__handle_batch(d)
+        response, body = await self.__dispatch(
+            d.get("method", None) if isinstance(d, dict) else None, request
+        )
         if response.is_notification:
             return web.Response()
-        return web.json_response(response, status=response.http_status)
+        return web.Response(
+            text=body, content_type="application/json", status=response.http_status
+        )
+
+    async def __handle_batch(self, request_list):
+        """ Dispatch the calls of a batch concurrently, at most JSON_RPC_BATCH_CONCURRENCY at a time.
+        The responses are in the order of the calls without the notifications.
+        """
+        semaphore = asyncio.Semaphore(
+            self.env.cluster_config.JSON_RPC_BATCH_CONCURRENCY
+        )
+
+        async def dispatch(d):
+            async with semaphore:
+                return await self.__dispatch(
+                    d.get("method", None) if isinstance(d, dict) else None,
+                    json.dumps(d),
+                )
+
+        result_list = await asyncio.gather(*[dispatch(d) for d in request_list])
+        body_list = [body for response, body in result_list if body]
+        if not body_list:
+            return web.Response()
+        return web.Response(
+            text="[" + ",".join(body_list) + "]", content_type="application/json"
+        )
+
+    async def __handle_metrics(self, request):
+        return web.Response(text=self.metrics.to_prometheus(), content_type="text/plain")
+
+    async def __handle_websocket(self, request):
+        """ Subscriptions to new blocks, logs and pending txs.
+        The client calls "subscribe" with the event type and an optional filter, and "unsubscribe"
+        with the subscription id. The events are pushed as
+        {"jsonrpc": "2.0", "method": "subscription", "params": {"subscription": id, "result": ...}}
+        A client is disconnected if JSON_RPC_WEBSOCKET_QUEUE_SIZE events are waiting to be sent.
+        """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscriber = Subscriber(self.env.cluster_config.JSON_RPC_WEBSOCKET_QUEUE_SIZE)
+        self.master.subscription_manager.add_subscriber(subscriber)
+        self.websockets.add(ws)
+        send_lock = asyncio.Lock()
+        sender = asyncio.ensure_future(self.__send_events(ws, subscriber, send_lock))
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                response = self.__handle_subscription_request(subscriber, msg.data)
+                async with send_lock:
+                    await ws.send_json(response)
+        finally:
+            self.master.subscription_manager.remove_subscriber(subscriber)
+            self.websockets.discard(ws)
+            sender.cancel()
+        return ws
+
+    def __handle_subscription_request(self, subscriber, data):
+        try:
+            d = json.loads(data)
+            request_id = d.get("id", None)
+            method = d.get("method", None)
+            params = d.get("params", [])
+        except Exception:
+            return {
+                "jsonrpc": "2.0",
+                "id": None,
+                "error": {"code": -32700, "message": "Parse error"},
+            }
+
+        manager = self.master.subscription_manager
+        try:
+            if method == "subscribe":
+                result = quantity_encoder(self.__subscribe(subscriber, *params))
+            elif method == "unsubscribe":
+                result = manager.unsubscribe(subscriber, quantity_decoder(*params))
+            else:
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "error": {"code": -32601, "message": "Method not found"},
+                }
+        except (InvalidParams, TypeError, AttributeError):
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": -32602, "message": "Invalid params"},
+            }
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def __subscribe(self, subscriber, event_type, data=None):
+        """ data may have "shard" for the minor block headers and logs of one shard, and
+        "address" / "topics" for logs as in getLogs
+        """
+        if event_type not in SubscriptionManager.EVENT_TYPES:
+            raise InvalidParams("Unknown subscription type")
+        if data is None:
+            data = dict()
+        if not isinstance(data, dict):
+            raise InvalidParams("Filter must be an object")
+        shard = optional_shard_id_decoder(data.get("shard", None))
+        if shard is not None and shard >= self.master.get_shard_size():
+            raise InvalidParams("Invalid shard")
+
+        def match_shard(header):
+            return shard is None or header.branch.get_shard_id() == shard
+
+        manager = self.master.subscription_manager
+        if event_type == SubscriptionManager.NEW_MINOR_BLOCK_HEADERS:
+            return manager.subscribe(subscriber, event_type, match_shard)
+        if event_type == SubscriptionManager.LOGS:
+            addresses, topics = self._decode_log_filter(data, shard, address_decoder)
+            bloom_bits = create_bloom_bits([a.recipient for a in addresses], topics)
+            return manager.subscribe(
+                subscriber,
+                event_type,
+                lambda header: match_shard(header)
+                and match_bloom_bits(header.bloom, bloom_bits),
+                (addresses, topics),
+            )
+        return manager.subscribe(subscriber, event_type)
+
+    async def __send_events(self, ws, subscriber, send_lock):
+        while True:
+            item = await subscriber.queue.get()
+            if item is None:
+                # the client does not read the events as fast as they arrive
+                await ws.close()
+                return
+            subscription, event = item
+            if subscription.sub_id not in subscriber.subscriptions:
+                continue  # unsubscribed
+            try:
+                result = await self.__encode_event(subscription, event)
+                if result is None:
+                    continue
+                async with send_lock:
+                    await ws.send_json(
+                        {
+                            "jsonrpc": "2.0",
+                            "method": "subscription",
+                            "params": {
+                                "subscription": quantity_encoder(subscription.sub_id),
+                                "result": result,
+                            },
+                        }
+                    )
+            except Exception:
+                Logger.log_exception()
+                await ws.close()
+                return
+
+    async def __encode_event(self, subscription, event):
+        event_type = subscription.event_type
+        if event_type == SubscriptionManager.NEW_ROOT_BLOCKS:
+            return root_block_encoder(event)
+        if event_type == SubscriptionManager.NEW_MINOR_BLOCK_HEADERS:
+            return minor_block_header_encoder(event)
+        if event_type == SubscriptionManager.PENDING_TRANSACTIONS:
+            evm_tx = event.code.get_evm_transaction()
+            return id_encoder(event.get_hash(), evm_tx.from_full_shard_id)
+
+        # the event of a log subscription is a minor block header whose bloom matches the filter
+        addresses, topics = subscription.params
+        logs = await self.master.get_logs(
+            addresses, topics, event.height, event.height, event.branch
+        )
+        # the block at the height may have been replaced by a fork
+        block_hash = event.get_hash()
+        logs = [log for log in logs or [] if log.block_hash == block_hash]
+        return loglist_encoder(logs) if logs else None
 
     def start(self):
         app = web.Application(client_max_size=JSON_RPC_CLIENT_REQUEST_MAX_SIZE)
+        app.router.add_get("/ws", self.__handle_websocket)
+        if self.serve_metrics:
+            app.router.add_get("/metrics", self.__handle_metrics)
         cors = aiohttp_cors.setup(app)
         route = app.router.add_post("/", self.__handle)
         cors.add(
@@ -453,6 +744,8 @@ class JSONRPCServer:
         self.loop.run_until_complete(site.start())
 
     def shutdown(self):
+        for ws in list(self.websockets):
+            self.loop.run_until_complete(ws.close())
         self.loop.run_until_complete(self.runner.cleanup())
 
     # JSON RPC handlers
@@ -767,8 +1060,8 @@ class JSONRPCServer:
         return receipt_encoder(minor_block, i, receipt)
 
     @public_methods.add
-    @decode_arg("shard", shard_id_decoder)
-    async def getLogs(self, data, shard):
+    @decode_arg("shard", optional_shard_id_decoder)
+    async def getLogs(self, data, shard=None):
         return await self._get_logs(data, shard, decoder=address_decoder)
 
     @public_methods.add
@@ -936,10 +1229,13 @@ class JSONRPCServer:
         return await self.estimateGas(**data)
 
     @public_methods.add
-    @decode_arg("shard", shard_id_decoder)
-    async def eth_getLogs(self, data, shard):
+    @decode_arg("shard", optional_shard_id_decoder)
+    async def eth_getLogs(self, data, shard=None):
         return await self._get_logs(
-            data, shard, decoder=eth_address_to_quarkchain_address_decoder
+            data,
+            shard,
+            decoder=eth_address_to_quarkchain_address_decoder,
+            is_eth_address=True,
         )
 
     @public_methods.add
@@ -1052,6 +1348,13 @@ class JSONRPCServer:
     async def getJrpcCalls(self):
         return self.counters
 
+    @private_methods.add
+    async def getJrpcMetrics(self):
+        """ Count, errors, in-flight calls, latency histogram and sizes of each method,
+        including the calls to the public server
+        """
+        return self.metrics.to_dict()
+
     @staticmethod
     def _convert_eth_call_data(data, shard):
         to_address = Address.create_from(
@@ -1069,15 +1372,9 @@ class JSONRPCServer:
             data["from"] = "0x" + from_address.serialize().hex()
         return data
 
-    async def _get_logs(self, data, shard, decoder: Callable[[str], bytes]):
-        start_block = data.get("fromBlock", "latest")
-        end_block = data.get("toBlock", "latest")
-        # TODO: not supported yet for "earliest" or "pending" block
-        if (isinstance(start_block, str) and start_block != "latest") or (
-            isinstance(end_block, str) and end_block != "latest"
-        ):
-            return None
-        # parse addresses / topics
+    @staticmethod
+    def _decode_log_filter(data, shard, decoder: Callable[[str], bytes]):
+        """ Parse the addresses and topics of a log filter """
         addresses, topics = [], []
         if "address" in data:
             if isinstance(data["address"], str):
@@ -1092,10 +1389,36 @@ class JSONRPCServer:
                     topics.append([data_decoder(topic_item)])
                 elif isinstance(topic_item, list):
                     topics.append([data_decoder(tp) for tp in topic_item])
-        branch = Branch.create(self.master.get_shard_size(), shard)
-        logs = await self.master.get_logs(
-            addresses, topics, start_block, end_block, branch
-        )
+        return addresses, topics
+
+    async def _get_logs(
+        self, data, shard, decoder: Callable[[str], bytes], is_eth_address=False
+    ):
+        """ Query the logs of the given shard, or of all the shards if shard is not specified """
+        start_block = data.get("fromBlock", "latest")
+        end_block = data.get("toBlock", "latest")
+        # TODO: not supported yet for "earliest" or "pending" block
+        if (isinstance(start_block, str) and start_block != "latest") or (
+            isinstance(end_block, str) and end_block != "latest"
+        ):
+            return None
+        addresses, topics = self._decode_log_filter(data, shard, decoder)
+        if shard is None:
+            if is_eth_address:
+                # eth addresses do not carry the shard so look them up in every shard
+                addresses = [
+                    Address(a.recipient, shard_id)
+                    for a in addresses
+                    for shard_id in range(self.master.get_shard_size())
+                ]
+            logs = await self.master.get_logs_from_all_shards(
+                addresses, topics, start_block, end_block
+            )
+        else:
+            branch = Branch.create(self.master.get_shard_size(), shard)
+            logs = await self.master.get_logs(
+                addresses, topics, start_block, end_block, branch
+            )
         if logs is None:
             return None
         return loglist_encoder(logs)
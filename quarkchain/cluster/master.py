@@ -65,6 +65,7 @@ from quarkchain.cluster.rpc import (
     GetTransactionListByAddressRequest,
 )
 from quarkchain.cluster.simple_network import SimpleNetwork
+from quarkchain.cluster.subscription import SubscriptionManager
 from quarkchain.env import DEFAULT_ENV
 from quarkchain.core import Branch, ShardMask, Log, Address
 from quarkchain.core import Transaction
@@ -79,8 +80,15 @@ FLAGS = flags.FLAGS
 class SyncTask:
     """ Given a header and a peer, the task will synchronize the local state
     including root chain and shards with the peer up to the height of the header.
+    The next batch of root blocks is downloaded while the current one is added, and the minor blocks
+    of up to MINOR_BLOCK_SYNC_WINDOW root blocks are requested from the slaves concurrently.
+    The slaves download them right away and add them once the root blocks and minor blocks
+    they depend on are added.
     """
 
+    BLOCK_BATCH_SIZE = 100
+    MINOR_BLOCK_SYNC_WINDOW = 8
+
     def __init__(self, header, peer):
         self.header = header
         self.peer = peer
@@ -136,22 +144,51 @@ class SyncTask:
                 block_header_chain.append(header)
 
         block_header_chain.reverse()
-
-        while len(block_header_chain) > 0:
-            Logger.info(
-                "[R] syncing from {} {}".format(
-                    block_header_chain[0].height, block_header_chain[0].get_hash().hex()
+        batch_list = [
+            block_header_chain[i : i + self.BLOCK_BATCH_SIZE]
+            for i in range(0, len(block_header_chain), self.BLOCK_BATCH_SIZE)
+        ]
+
+        # (root block, future of syncing its minor blocks) in ascending height
+        pending = deque()
+        download = asyncio.ensure_future(self.__download_blocks(batch_list[0]))
+        try:
+            for i, header_list in enumerate(batch_list):
+                Logger.info(
+                    "[R] syncing from {} {}".format(
+                        header_list[0].height, header_list[0].get_hash().hex()
+                    )
                 )
-            )
-            block_chain = await self.__download_blocks(block_header_chain[:100])
-            Logger.info("[R] downloaded {} blocks from peer".format(len(block_chain)))
-            if len(block_chain) != len(block_header_chain[:100]):
-                # TODO: tag bad peer
-                raise RuntimeError("Bad peer missing blocks for headers they have")
+                block_chain = await download
+                Logger.info(
+                    "[R] downloaded {} blocks from peer".format(len(block_chain))
+                )
+                if len(block_chain) != len(header_list):
+                    # TODO: tag bad peer
+                    raise RuntimeError("Bad peer missing blocks for headers they have")
+                if i + 1 < len(batch_list):
+                    download = asyncio.ensure_future(
+                        self.__download_blocks(batch_list[i + 1])
+                    )
 
-            for block in block_chain:
-                await self.__add_block(block)
-                block_header_chain.pop(0)
+                for block in block_chain:
+                    pending.append(
+                        (
+                            block,
+                            asyncio.ensure_future(
+                                self.__sync_minor_blocks(block.minor_block_header_list)
+                            ),
+                        )
+                    )
+                    if len(pending) >= self.MINOR_BLOCK_SYNC_WINDOW:
+                        await self.__add_block(*pending.popleft())
+
+            while pending:
+                await self.__add_block(*pending.popleft())
+        finally:
+            download.cancel()
+            for _, future in pending:
+                future.cancel()
 
     def __has_block_hash(self, block_hash):
         return self.root_state.contain_root_block_by_hash(block_hash)
@@ -183,9 +220,9 @@ class SyncTask:
         )
         return resp.root_block_list
 
-    async def __add_block(self, root_block):
+    async def __add_block(self, root_block, sync_minor_blocks_future):
         start = time.time()
-        await self.__sync_minor_blocks(root_block.minor_block_header_list)
+        await sync_minor_blocks_future
         await self.master_server.add_root_block(root_block)
         elapse = time.time() - start
         Logger.info(
@@ -252,8 +289,6 @@ class Synchronizer:
 
 
 class SlaveConnection(ClusterConnection):
-    OP_NONRPC_MAP = {}
-
     def __init__(
         self, env, reader, writer, master_server, slave_id, shard_mask_list, name=None
     ):
@@ -262,7 +297,7 @@ class SlaveConnection(ClusterConnection):
             reader,
             writer,
             CLUSTER_OP_SERIALIZER_MAP,
-            self.OP_NONRPC_MAP,
+            OP_NONRPC_MAP,
             OP_RPC_MAP,
             name=name,
         )
@@ -456,6 +491,10 @@ class SlaveConnection(ClusterConnection):
             req.minor_block_header.get_hash()
         )
         self.master_server.update_shard_stats(req.shard_stats)
+        self.master_server.last_minor_block_hash = req.minor_block_header.get_hash()
+        self.master_server.subscription_manager.notify_minor_block_header(
+            req.minor_block_header
+        )
         self.master_server.update_tx_count_history(
             req.tx_count, req.x_shard_tx_count, req.minor_block_header.create_time
         )
@@ -464,6 +503,15 @@ class SlaveConnection(ClusterConnection):
             artificial_tx_config=self.master_server.get_artificial_tx_config(),
         )
 
+    async def handle_add_pending_transaction_list_command(self, op, cmd, rpc_id):
+        for tx in cmd.tx_list:
+            self.master_server.subscription_manager.notify_pending_transaction(tx)
+
+
+OP_NONRPC_MAP = {
+    ClusterOp.ADD_PENDING_TRANSACTION_LIST_COMMAND: SlaveConnection.handle_add_pending_transaction_list_command
+}
+
 
 OP_RPC_MAP = {
     ClusterOp.ADD_MINOR_BLOCK_HEADER_REQUEST: (
@@ -505,6 +553,10 @@ class MasterServer:
         self.synchronizer = Synchronizer()
 
         self.branch_to_shard_stats = dict()  # type: Dict[int, ShardStats]
+        # hash of the minor block most recently added to any shard
+        self.last_minor_block_hash = None
+        # websocket subscribers of the JSON-RPC servers
+        self.subscription_manager = SubscriptionManager()
         # (epoch in minute, tx_count in the minute)
         self.tx_count_history = deque()
 
@@ -932,6 +984,7 @@ class MasterServer:
         if not success:
             return False
 
+        self.subscription_manager.notify_pending_transaction(tx)
         if self.network is not None:
             for peer in self.network.iterate_peers():
                 if peer == from_peer:
@@ -987,6 +1040,9 @@ class MasterServer:
         except Exception:
             pass
 
+        if update_tip:
+            self.subscription_manager.notify_root_block(r_block)
+
         if success:
             future_list = self.broadcast_rpc(
                 op=ClusterOp.ADD_ROOT_BLOCK_REQUEST,
@@ -1099,6 +1155,10 @@ class MasterServer:
     def update_shard_stats(self, shard_state):
         self.branch_to_shard_stats[shard_state.branch.value] = shard_state
 
+    def get_tip_version(self):
+        """ Changes whenever the root tip changes or a minor block is added to any shard """
+        return self.root_state.tip.get_hash(), self.last_minor_block_hash
+
     def update_tx_count_history(self, tx_count, xshard_tx_count, timestamp):
         """ maintain a list of tuples of (epoch minute, tx count, xshard tx count) of 12 hours window
         Note that this is also counting transactions on forks and thus larger than if only couting the best chains. """
@@ -1129,6 +1189,15 @@ class MasterServer:
             shards[shard_id]["blockCount60s"] = shard_stats.block_count60s
             shards[shard_id]["staleBlockCount60s"] = shard_stats.stale_block_count60s
             shards[shard_id]["lastBlockTime"] = shard_stats.last_block_time
+            shards[shard_id]["pendingSenderCount"] = shard_stats.pending_sender_count
+            shards[shard_id]["txPoolReplacedCount"] = shard_stats.tx_pool_replaced_count
+            shards[shard_id]["txPoolEvictedCount"] = shard_stats.tx_pool_evicted_count
+            shards[shard_id][
+                "flatStateRegeneratedCount"
+            ] = shard_stats.flat_state_regenerated_count
+            shards[shard_id]["cacheHitCount"] = shard_stats.cache_hit_count
+            shards[shard_id]["cacheMissCount"] = shard_stats.cache_miss_count
+            shards[shard_id]["cacheEvictionCount"] = shard_stats.cache_eviction_count
 
         tx_count60s = sum(
             [
@@ -1170,6 +1239,8 @@ class MasterServer:
                 self.root_state.tip.create_time - prev.header.create_time
             )
 
+        root_cache_stats = self.root_state.db.get_cache_stats().values()
+
         tx_count_history = []
         for item in self.tx_count_history:
             tx_count_history.append(
@@ -1182,6 +1253,11 @@ class MasterServer:
             "rootHeight": self.root_state.tip.height,
             "rootTimestamp": self.root_state.tip.create_time,
             "rootLastBlockTime": root_last_block_time,
+            "rootCacheHitCount": sum(stats["hits"] for stats in root_cache_stats),
+            "rootCacheMissCount": sum(stats["misses"] for stats in root_cache_stats),
+            "rootCacheEvictionCount": sum(
+                stats["evictions"] for stats in root_cache_stats
+            ),
             "txCount60s": tx_count60s,
             "blockCount60s": block_count60s,
             "staleBlockCount60s": stale_block_count60s,
@@ -1261,6 +1337,57 @@ class MasterServer:
         slave = self.branch_to_slaves[branch.value][0]
         return await slave.get_logs(branch, addresses, topics, start_block, end_block)
 
+    async def get_logs_from_all_shards(
+        self,
+        addresses: List[Address],
+        topics: List[List[bytes]],
+        start_block: Union[int, str],
+        end_block: Union[int, str],
+    ) -> Optional[List[Log]]:
+        """ Query the logs of all the relevant shards concurrently.
+        If addresses are given only the shards of the addresses are queried, otherwise all of them.
+        The result is ordered by (shard, height, tx index, log index).
+        Each shard runs its own Filter so Filter.TIMEOUT applies per shard.
+        Returns None if any of the shards fails.
+        """
+        shard_size = self.__get_shard_size()
+        shard_to_addresses = dict()  # type: Dict[int, List[Address]]
+        if addresses:
+            for addr in addresses:
+                shard_id = addr.get_shard_id(shard_size)
+                shard_to_addresses.setdefault(shard_id, []).append(
+                    Address(addr.recipient, shard_id)
+                )
+        else:
+            shard_to_addresses = {shard_id: [] for shard_id in range(shard_size)}
+
+        async def get_shard_logs(shard_id):
+            branch = Branch.create(shard_size, shard_id)
+            logs = await self.get_logs(
+                shard_to_addresses[shard_id], topics, start_block, end_block, branch
+            )
+            return branch, logs
+
+        shard_logs = dict()  # type: Dict[int, List[Log]]
+        tasks = [
+            asyncio.ensure_future(get_shard_logs(shard_id))
+            for shard_id in shard_to_addresses
+        ]
+        try:
+            for future in asyncio.as_completed(tasks):
+                branch, logs = await future
+                if logs is None:
+                    return None
+                shard_logs[branch.get_shard_id()] = logs
+        finally:
+            # stop the queries of the other shards once one fails and retrieve their results
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # logs of a shard are already ordered by (height, tx index, log index)
+        return [log for shard_id in sorted(shard_logs) for log in shard_logs[shard_id]]
+
     async def estimate_gas(
         self, tx: Transaction, from_address: Address
     ) -> Optional[int]:
@@ -1328,6 +1455,7 @@ def parse_args():
 def main():
 
     from quarkchain.cluster.jsonrpc import JSONRPCServer
+    from quarkchain.cluster.rpc_metrics import RpcMetrics
 
     env, unknown_flags = parse_args()
     FLAGS(sys.argv[:1] + unknown_flags)
@@ -1355,8 +1483,14 @@ def main():
         thread = Thread(target=devp2p_app, args=[env, network], daemon=True)
         thread.start()
 
-    public_json_rpc_server = JSONRPCServer.start_public_server(env, master)
-    private_json_rpc_server = JSONRPCServer.start_private_server(env, master)
+    # the calls to both servers are reported by the private one
+    json_rpc_metrics = RpcMetrics("qkc_jsonrpc")
+    public_json_rpc_server = JSONRPCServer.start_public_server(
+        env, master, json_rpc_metrics
+    )
+    private_json_rpc_server = JSONRPCServer.start_private_server(
+        env, master, json_rpc_metrics
+    )
 
     loop = asyncio.get_event_loop()
     try:
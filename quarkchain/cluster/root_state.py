@@ -1,9 +1,12 @@
 import time
 import json
 import asyncio
+import functools
 
+from quarkchain.cache import LRUCache
+from quarkchain.cluster.chain_index import is_same_chain
 from quarkchain.config import NetworkId
-from quarkchain.core import RootBlock, MinorBlockHeader
+from quarkchain.core import Constant, RootBlock, MinorBlockHeader
 from quarkchain.core import (
     calculate_merkle_root,
     Serializable,
@@ -30,15 +33,35 @@ class RootDb:
     we don't save "tipHash"s for the forks and thus their consistency state is hard to reason about.
     For example, a root block might not be received by all the shards when the cluster is down.
     Forks can always be downloaded again from peers if they ever became the best chain.
+
+    The blocks and headers returned by the getters are shared with the caches and must be treated
+    as read-only. Copy them before any modification.
     """
 
-    def __init__(self, db, max_num_blocks_to_recover):
-        # TODO: evict old blocks from memory
+    def __init__(self, db, max_num_blocks_to_recover, cluster_config):
         self.db = db
         self.max_num_blocks_to_recover = max_num_blocks_to_recover
-        # TODO: May store locally to save memory space (e.g., with LRU cache)
+        # Hashes of the validated minor block headers and root blocks. Headers and blocks are
+        # kept in bounded caches and loaded from db on a miss.
+        # The hash sets are not bounded as they tell the blocks validated in this process or
+        # recovered on start from the blocks only in db, e.g., the forks not recovered, which
+        # must be validated again. Each entry takes about 100 bytes.
         self.m_hash_set = set()
-        self.r_header_pool = dict()
+        self.r_hash_set = set()
+        self.r_header_cache = LRUCache(
+            cluster_config.HEADER_CACHE_MAX_ENTRIES,
+            cluster_config.HEADER_CACHE_MAX_BYTES,
+        )
+        self.r_block_cache = LRUCache(
+            cluster_config.BLOCK_CACHE_MAX_ENTRIES,
+            cluster_config.BLOCK_CACHE_MAX_BYTES,
+        )
+        self.last_list_cache = LRUCache(
+            cluster_config.BLOCK_CACHE_MAX_ENTRIES,
+            cluster_config.BLOCK_CACHE_MAX_BYTES,
+        )
+        # height -> hash of the best chain, backed by the "ri_" keys in db
+        self.r_height_index_cache = LRUCache(cluster_config.HEADER_CACHE_MAX_ENTRIES)
         self.tip_header = None
 
         self.__recover_from_db()
@@ -52,11 +75,12 @@ class RootDb:
             return None
 
         r_hash = self.db.get(b"tipHash")
-        r_block = RootBlock.deserialize(self.db.get(b"rblock_" + r_hash))
+        r_block = self.__load_root_block(r_hash)
         self.tip_header = r_block.header
 
-        while len(self.r_header_pool) < self.max_num_blocks_to_recover:
-            self.r_header_pool[r_hash] = r_block.header
+        while len(self.r_hash_set) < self.max_num_blocks_to_recover:
+            self.r_hash_set.add(r_hash)
+            self.r_height_index_cache.put(r_block.header.height, r_hash)
             for m_header in r_block.minor_block_header_list:
                 self.m_hash_set.add(m_header.get_hash())
 
@@ -64,12 +88,40 @@ class RootDb:
                 break
 
             r_hash = r_block.header.hash_prev_block
-            r_block = RootBlock.deserialize(self.db.get(b"rblock_" + r_hash))
+            r_block = self.__load_root_block(r_hash)
 
     def get_tip_header(self):
         return self.tip_header
 
+    def get_cache_stats(self):
+        return {
+            "r_header": self.r_header_cache.stats(),
+            "r_block": self.r_block_cache.stats(),
+            "last_list": self.last_list_cache.stats(),
+            "r_height_index": self.r_height_index_cache.stats(),
+        }
+
     # ------------------------- Root block db operations --------------------------------
+    def __load_root_block(self, h):
+        """ Read the root block from the block cache or db, and fill the header cache.
+        The block returned may be shared with other callers and should not be modified.
+        """
+        block = self.r_block_cache.get(h)
+        if block is not None:
+            return block
+        raw_block = self.db.get(b"rblock_" + h, None)
+        if not raw_block:
+            return None
+        block = RootBlock.deserialize(raw_block)
+        self.r_block_cache.put(h, block, len(raw_block))
+        if h not in self.r_header_cache:
+            self.r_header_cache.put(
+                h,
+                block.header,
+                Constant.ROOT_BLOCK_HEADER_SIZE + len(block.header.extra_data),
+            )
+        return block
+
     def put_root_block(
         self, root_block, last_minor_block_header_list, root_block_hash=None
     ):
@@ -77,48 +129,76 @@ class RootDb:
             root_block_hash = root_block.header.get_hash()
 
         last_list = LastMinorBlockHeaderList(header_list=last_minor_block_header_list)
-        self.db.put(b"rblock_" + root_block_hash, root_block.serialize())
-        self.db.put(b"lastlist_" + root_block_hash, last_list.serialize())
-        self.r_header_pool[root_block_hash] = root_block.header
+        with self.db.write_batch():
+            self.db.put(b"rblock_" + root_block_hash, root_block.serialize())
+            self.db.put(b"lastlist_" + root_block_hash, last_list.serialize())
+        if root_block_hash not in self.r_hash_set:
+            self.db.on_discard(lambda: self.__forget_root_block(root_block_hash))
+        self.r_hash_set.add(root_block_hash)
+        self.r_header_cache.put(
+            root_block_hash,
+            root_block.header,
+            Constant.ROOT_BLOCK_HEADER_SIZE + len(root_block.header.extra_data),
+        )
+
+    def __forget_root_block(self, h):
+        """ Undo the in-memory updates of put_root_block when its writes are discarded """
+        self.r_hash_set.discard(h)
+        self.r_header_cache.pop(h)
+        self.r_block_cache.pop(h)
+        self.last_list_cache.pop(h)
 
     def update_tip_hash(self, block_hash):
         self.db.put(b"tipHash", block_hash)
 
     def get_root_block_by_hash(self, h, consistency_check=True):
-        if consistency_check and h not in self.r_header_pool:
+        if consistency_check and h not in self.r_hash_set:
             return None
-
-        raw_block = self.db.get(b"rblock_" + h, None)
-        if not raw_block:
-            return None
-        return RootBlock.deserialize(raw_block)
+        return self.__load_root_block(h)
 
     def get_root_block_header_by_hash(self, h, consistency_check=True):
-        header = self.r_header_pool.get(h, None)
-        if not header and not consistency_check:
-            block = self.get_root_block_by_hash(h, False)
+        if consistency_check and h not in self.r_hash_set:
+            return None
+        header = self.r_header_cache.get(h)
+        if header is None:
+            block = self.__load_root_block(h)
             if block:
                 header = block.header
         return header
 
     def get_root_block_last_minor_block_header_list(self, h):
-        if h not in self.r_header_pool:
+        if h not in self.r_hash_set:
             return None
-        return LastMinorBlockHeaderList.deserialize(
-            self.db.get(b"lastlist_" + h)
-        ).header_list
+        header_list = self.last_list_cache.get(h)
+        if header_list is None:
+            data = self.db.get(b"lastlist_" + h)
+            header_list = LastMinorBlockHeaderList.deserialize(data).header_list
+            self.last_list_cache.put(h, header_list, len(data))
+        return header_list
 
     def contain_root_block_by_hash(self, h):
-        return h in self.r_header_pool
+        return h in self.r_hash_set
 
-    def put_root_block_index(self, block):
-        self.db.put(b"ri_%d" % block.header.height, block.header.get_hash())
+    def put_root_block_index(self, header, block_hash=None):
+        if block_hash is None:
+            block_hash = header.get_hash()
+        self.db.put(b"ri_%d" % header.height, block_hash)
+        self.db.on_discard(lambda: self.r_height_index_cache.pop(header.height))
+        self.r_height_index_cache.put(header.height, block_hash)
+
+    def get_root_block_hash_by_height(self, height):
+        """ Hash of the block at height in the best chain or None """
+        block_hash = self.r_height_index_cache.get(height)
+        if block_hash is None:
+            block_hash = self.db.get(b"ri_%d" % height, None)
+            if block_hash is not None:
+                self.r_height_index_cache.put(height, block_hash)
+        return block_hash
 
     def get_root_block_by_height(self, height):
-        key = b"ri_%d" % height
-        if key not in self.db:
+        block_hash = self.get_root_block_hash_by_height(height)
+        if block_hash is None:
             return None
-        block_hash = self.db.get(key)
         return self.get_root_block_by_hash(block_hash, False)
 
     # ------------------------- Minor block db operations --------------------------------
@@ -127,9 +207,17 @@ class RootDb:
 
     def put_minor_block_hash(self, m_hash):
         self.db.put(b"mheader_" + m_hash, b"")
+        if m_hash not in self.m_hash_set:
+            self.db.on_discard(lambda: self.m_hash_set.discard(m_hash))
         self.m_hash_set.add(m_hash)
 
     # ------------------------- Common operations -----------------------------------------
+    def write_batch(self):
+        return self.db.write_batch()
+
+    def on_discard(self, callback):
+        self.db.on_discard(callback)
+
     def put(self, key, value):
         self.db.put(key, value)
 
@@ -155,7 +243,9 @@ class RootState:
         )
         self.raw_db = env.db
         self.db = RootDb(
-            self.raw_db, env.quark_chain_config.ROOT.max_root_blocks_in_memory
+            self.raw_db,
+            env.quark_chain_config.ROOT.max_root_blocks_in_memory,
+            env.cluster_config,
         )
 
         persisted_tip = self.db.get_tip_header()
@@ -171,8 +261,9 @@ class RootState:
     def __create_genesis_block(self):
         genesis_manager = GenesisManager(self.env.quark_chain_config)
         genesis_block = genesis_manager.create_root_block()
-        self.db.put_root_block(genesis_block, [])
-        self.db.put_root_block_index(genesis_block)
+        with self.db.write_batch():
+            self.db.put_root_block(genesis_block, [])
+            self.db.put_root_block_index(genesis_block.header)
         self.tip = genesis_block.header
 
     def get_tip_block(self):
@@ -261,13 +352,13 @@ class RootState:
         return block_hash
 
     def __is_same_chain(self, longer_block_header, shorter_block_header):
-        if shorter_block_header.height > longer_block_header.height:
-            return False
-
-        header = longer_block_header
-        for i in range(longer_block_header.height - shorter_block_header.height):
-            header = self.db.get_root_block_header_by_hash(header.hash_prev_block)
-        return header == shorter_block_header
+        return is_same_chain(
+            longer_block_header,
+            shorter_block_header,
+            self.db.get_root_block_hash_by_height,
+            self.db.get_root_block_header_by_hash,
+            lambda header: header.hash_prev_block,
+        )
 
     def validate_block(self, block, block_hash=None):
         if not self.db.contain_root_block_by_hash(block.header.hash_prev_block):
@@ -282,6 +373,11 @@ class RootState:
 
         # Check whether all minor blocks are ordered, validated (and linked to previous block)
         headers_map = dict()  # shard_id -> List[MinorBlockHeader]
+        prev_block_header = self.db.get_root_block_header_by_hash(
+            block.header.hash_prev_block
+        )
+        # hash_prev_root_block of the minor blocks -> whether it is in the same chain
+        same_chain_map = dict()
         shard_id = (
             block.minor_block_header_list[0].branch.get_shard_id()
             if block.minor_block_header_list
@@ -300,10 +396,12 @@ class RootState:
                         m_header.create_time, block.header.create_time
                     )
                 )
-            if not self.__is_same_chain(
-                self.db.get_root_block_header_by_hash(block.header.hash_prev_block),
-                self.db.get_root_block_header_by_hash(m_header.hash_prev_root_block),
-            ):
+            if m_header.hash_prev_root_block not in same_chain_map:
+                same_chain_map[m_header.hash_prev_root_block] = self.__is_same_chain(
+                    prev_block_header,
+                    self.db.get_root_block_header_by_hash(m_header.hash_prev_root_block),
+                )
+            if not same_chain_map[m_header.hash_prev_root_block]:
                 raise ValueError(
                     "minor block's prev root block must be in the same chain"
                 )
@@ -369,14 +467,19 @@ class RootState:
 
         return block_hash, last_minor_block_header_list
 
-    def __rewrite_block_index_to(self, block):
-        """ Find the common ancestor in the current chain and rewrite index till block """
-        while block.header.height >= 0:
-            orig_block = self.db.get_root_block_by_height(block.header.height)
-            if orig_block and orig_block.header == block.header:
+    def __rewrite_block_index_to(self, block, block_hash):
+        """ Find the common ancestor in the current chain and rewrite index till block.
+        Only the height index and the headers are read.
+        """
+        header = block.header
+        while header.height >= 0:
+            if self.db.get_root_block_hash_by_height(header.height) == block_hash:
                 break
-            self.db.put_root_block_index(block)
-            block = self.db.get_root_block_by_hash(block.header.hash_prev_block)
+            self.db.put_root_block_index(header, block_hash)
+            if header.height == 0:
+                break
+            block_hash = header.hash_prev_block
+            header = self.db.get_root_block_header_by_hash(block_hash)
 
     def add_block(self, block, block_hash=None):
         """ Add new block.
@@ -384,8 +487,20 @@ class RootState:
         There are a couple of optimizations can be done here:
         - the root block could only contain minor block header hashes as long as the shards fully validate the headers
         - the header (or hashes) are un-ordered as long as they contains valid sub-chains from previous root block
+        All the db writes of the block are committed atomically in a single batch.
+        The tip is restored if the batch is discarded.
         """
         start_ms = time_ms()
+        with self.db.write_batch():
+            self.db.on_discard(functools.partial(self.__restore_tip, self.tip))
+            updated = self.__add_block(block, block_hash)
+        self.__log_block_propagation(block, start_ms)
+        return updated
+
+    def __restore_tip(self, tip):
+        self.tip = tip
+
+    def __add_block(self, block, block_hash):
         block_hash, last_minor_block_header_list = self.validate_block(
             block, block_hash
         )
@@ -394,9 +509,21 @@ class RootState:
             block, last_minor_block_header_list, root_block_hash=block_hash
         )
 
-        decoded_extra_data = block.header.extra_data.decode("utf-8")
-        if decoded_extra_data != "":
-            extra_data = json.loads(decoded_extra_data)
+        if self.tip.height < block.header.height:
+            self.tip = block.header
+            self.db.update_tip_hash(block_hash)
+            self.__rewrite_block_index_to(block, block_hash)
+            return True
+        return False
+
+    def __log_block_propagation(self, block, start_ms):
+        """ Send the propagation latency of a block carrying monitoring info in its extra data.
+        The extra data comes from peers, so it is not trusted to be well-formed.
+        """
+        if not block.header.extra_data:
+            return
+        try:
+            extra_data = json.loads(block.header.extra_data.decode("utf-8"))
             sample = {
                 "time": time_ms() // 1000,
                 "shard": "R",
@@ -412,18 +539,16 @@ class RootState:
                 "propagation_latency_ms": start_ms - extra_data.get("mined", 0),
                 "num_tx": len(block.minor_block_header_list),
             }
-            asyncio.ensure_future(
-                self.env.cluster_config.kafka_logger.log_kafka_sample_async(
-                    self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
-                )
+        except Exception as e:
+            Logger.warning_every_sec(
+                "Invalid monitoring extra data in root block: {}".format(e), 10
             )
-
-        if self.tip.height < block.header.height:
-            self.tip = block.header
-            self.db.update_tip_hash(block_hash)
-            self.__rewrite_block_index_to(block)
-            return True
-        return False
+            return
+        asyncio.ensure_future(
+            self.env.cluster_config.kafka_logger.log_kafka_sample_async(
+                self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
+            )
+        )
 
     # -------------------------------- Root block db related operations ------------------------------
     def get_root_block_by_hash(self, h):
@@ -528,6 +528,14 @@ class ShardStats(Serializable):
         ("block_count60s", uint32),
         ("stale_block_count60s", uint32),
         ("last_block_time", uint32),
+        ("pending_sender_count", uint32),
+        ("tx_pool_replaced_count", uint32),
+        ("tx_pool_evicted_count", uint32),
+        ("flat_state_regenerated_count", uint32),
+        # totals of the block, header and receipt caches, see ShardDbOperator.get_cache_stats()
+        ("cache_hit_count", uint64),
+        ("cache_miss_count", uint64),
+        ("cache_eviction_count", uint64),
     ]
 
     def __init__(
@@ -541,6 +549,13 @@ class ShardStats(Serializable):
         block_count60s: int,
         stale_block_count60s: int,
         last_block_time: int,
+        pending_sender_count: int = 0,
+        tx_pool_replaced_count: int = 0,
+        tx_pool_evicted_count: int = 0,
+        flat_state_regenerated_count: int = 0,
+        cache_hit_count: int = 0,
+        cache_miss_count: int = 0,
+        cache_eviction_count: int = 0,
     ):
         self.branch = branch
         self.height = height
@@ -551,6 +566,13 @@ class ShardStats(Serializable):
         self.block_count60s = block_count60s
         self.stale_block_count60s = stale_block_count60s
         self.last_block_time = last_block_time
+        self.pending_sender_count = pending_sender_count
+        self.tx_pool_replaced_count = tx_pool_replaced_count
+        self.tx_pool_evicted_count = tx_pool_evicted_count
+        self.flat_state_regenerated_count = flat_state_regenerated_count
+        self.cache_hit_count = cache_hit_count
+        self.cache_miss_count = cache_miss_count
+        self.cache_eviction_count = cache_eviction_count
 
 
 class AddMinorBlockHeaderRequest(Serializable):
@@ -572,6 +594,17 @@ class AddMinorBlockHeaderRequest(Serializable):
         self.shard_stats = shard_stats
 
 
+class AddPendingTransactionListCommand(Serializable):
+    """ Notify master about the txs from peers added to the tx pool of a shard,
+    which do not go through master.add_transaction()
+    """
+
+    FIELDS = [("tx_list", PrependedSizeListSerializer(4, Transaction))]
+
+    def __init__(self, tx_list):
+        self.tx_list = tx_list
+
+
 class AddMinorBlockHeaderResponse(Serializable):
     FIELDS = [("error_code", uint32), ("artificial_tx_config", ArtificialTxConfig)]
 
@@ -788,6 +821,7 @@ class ClusterOp:
     GET_CODE_RESPONSE = 52 + CLUSTER_OP_BASE
     GAS_PRICE_REQUEST = 53 + CLUSTER_OP_BASE
     GAS_PRICE_RESPONSE = 54 + CLUSTER_OP_BASE
+    ADD_PENDING_TRANSACTION_LIST_COMMAND = 55 + CLUSTER_OP_BASE
 
 
 CLUSTER_OP_SERIALIZER_MAP = {
@@ -844,4 +878,5 @@ CLUSTER_OP_SERIALIZER_MAP = {
     ClusterOp.GET_CODE_RESPONSE: GetCodeResponse,
     ClusterOp.GAS_PRICE_REQUEST: GasPriceRequest,
     ClusterOp.GAS_PRICE_RESPONSE: GasPriceResponse,
+    ClusterOp.ADD_PENDING_TRANSACTION_LIST_COMMAND: AddPendingTransactionListCommand,
 }
@@ -0,0 +1,109 @@
+import bisect
+from collections import OrderedDict
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class MethodMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+        # number of calls in each latency bucket, not cumulative
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "inFlight": self.in_flight,
+            "latencyBuckets": OrderedDict(
+                zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.latency_buckets)
+            ),
+            "latencySum": self.latency_sum,
+            "requestBytes": self.request_bytes,
+            "responseBytes": self.response_bytes,
+        }
+
+
+class RpcMetrics:
+    """ Per-method counts, errors, in-flight calls, latencies and sizes of the calls of a server.
+    Call start() when a call is received and finish() when its response is ready.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.methods = dict()  # method -> MethodMetrics
+
+    def __get(self, method):
+        metrics = self.methods.get(method, None)
+        if metrics is None:
+            metrics = self.methods[method] = MethodMetrics()
+        return metrics
+
+    def start(self, method, request_bytes):
+        metrics = self.__get(method)
+        metrics.count += 1
+        metrics.in_flight += 1
+        metrics.request_bytes += request_bytes
+
+    def finish(self, method, latency, response_bytes, error=False):
+        metrics = self.__get(method)
+        metrics.in_flight -= 1
+        metrics.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        metrics.latency_sum += latency
+        metrics.response_bytes += response_bytes
+        if error:
+            metrics.errors += 1
+
+    def get_counts(self):
+        return {method: metrics.count for method, metrics in self.methods.items()}
+
+    def to_dict(self):
+        return {method: metrics.to_dict() for method, metrics in self.methods.items()}
+
+    def to_prometheus(self):
+        """ Metrics in the Prometheus text exposition format """
+        lines = []
+
+        def add_metric(name, metric_type, get_value):
+            name = self.prefix + name
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for method in sorted(self.methods):
+                lines.append(
+                    '{}{{method="{}"}} {}'.format(
+                        name, method, get_value(self.methods[method])
+                    )
+                )
+
+        add_metric("_requests_total", "counter", lambda m: m.count)
+        add_metric("_errors_total", "counter", lambda m: m.errors)
+        add_metric("_in_flight", "gauge", lambda m: m.in_flight)
+        add_metric("_request_bytes_total", "counter", lambda m: m.request_bytes)
+        add_metric("_response_bytes_total", "counter", lambda m: m.response_bytes)
+
+        name = self.prefix + "_request_duration_seconds"
+        lines.append("# TYPE {} histogram".format(name))
+        for method in sorted(self.methods):
+            metrics = self.methods[method]
+            cumulative = 0
+            for bound, count in zip(
+                [str(b) for b in LATENCY_BUCKETS] + ["+Inf"], metrics.latency_buckets
+            ):
+                cumulative += count
+                lines.append(
+                    '{}_bucket{{method="{}",le="{}"}} {}'.format(
+                        name, method, bound, cumulative
+                    )
+                )
+            lines.append(
+                '{}_sum{{method="{}"}} {}'.format(name, method, metrics.latency_sum)
+            )
+            lines.append(
+                '{}_count{{method="{}"}} {}'.format(name, method, cumulative)
+            )
+        return "\n".join(lines) + "\n"
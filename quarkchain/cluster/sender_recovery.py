@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+import rlp
+
+from quarkchain.core import Transaction
+from quarkchain.evm.transactions import Transaction as EvmTransaction
+
+
+def recover_evm_senders(evm_tx_bytes_list: List[bytes]) -> List[Optional[bytes]]:
+    """ Recover the senders of rlp-encoded evm txs, None for the invalid ones.
+    Runs in the workers so it only takes and returns bytes.
+    """
+    senders = []
+    for evm_tx_bytes in evm_tx_bytes_list:
+        try:
+            senders.append(rlp.decode(evm_tx_bytes, EvmTransaction).sender)
+        except Exception:
+            senders.append(None)
+    return senders
+
+
+class SenderRecoveryPool:
+    """ Recovers the senders of evm txs (ecrecover) in worker threads or processes.
+    The senders are cached in the Code of the txs so that the following
+    get_evm_transaction() calls return txs with the senders set.
+    coincurve releases the GIL so threads scale unless the slow python ecrecover is used.
+    With num_workers being 0 the senders are recovered lazily on the caller's thread as before.
+    """
+
+    def __init__(self, num_workers=0, use_processes=False):
+        self.num_workers = num_workers
+        self.executor = None
+        if num_workers > 0:
+            executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            self.executor = executor_cls(max_workers=num_workers)
+
+    def __get_pending_codes(self, tx_list: List[Transaction]):
+        return [
+            tx.code
+            for tx in tx_list
+            if tx.code.is_evm() and tx.code.get_evm_sender() is None
+        ]
+
+    def __split(self, codes):
+        size = (len(codes) + self.num_workers - 1) // self.num_workers
+        return [
+            [code.code[1:] for code in codes[i : i + size]]
+            for i in range(0, len(codes), size)
+        ]
+
+    @staticmethod
+    def __set_senders(codes, sender_lists):
+        senders = [sender for sender_list in sender_lists for sender in sender_list]
+        for code, sender in zip(codes, senders):
+            if sender is not None:
+                code.set_evm_sender(sender)
+
+    async def recover_senders(self, tx_list: List[Transaction]):
+        """ Recover the senders without blocking the event loop """
+        codes = self.__get_pending_codes(tx_list)
+        if not codes or self.executor is None:
+            return
+        loop = asyncio.get_event_loop()
+        sender_lists = await asyncio.gather(
+            *[
+                loop.run_in_executor(self.executor, recover_evm_senders, chunk)
+                for chunk in self.__split(codes)
+            ]
+        )
+        self.__set_senders(codes, sender_lists)
+
+    def recover_senders_sync(self, tx_list: List[Transaction]):
+        """ Recover the senders in parallel and wait for the results """
+        codes = self.__get_pending_codes(tx_list)
+        if not codes or self.executor is None:
+            return
+        futures = [
+            self.executor.submit(recover_evm_senders, chunk)
+            for chunk in self.__split(codes)
+        ]
+        self.__set_senders(codes, [f.result() for f in futures])
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from collections import deque
 
 from quarkchain.cluster.p2p_commands import (
@@ -181,6 +182,9 @@ class PeerShardConnection(VirtualConnection):
         self.shard.synchronizer.add_task(m_header, self)
 
     async def handle_new_transaction_list_command(self, op_code, cmd, rpc_id):
+        await self.shard.slave.sender_recovery_pool.recover_senders(
+            cmd.transaction_list
+        )
         self.shard.add_tx_list(cmd.transaction_list, self)
 
 
@@ -207,8 +211,18 @@ OP_RPC_MAP = {
 class SyncTask:
     """ Given a header and a shard connection, the synchronizer will synchronize
     the shard state with the peer shard up to the height of the header.
+    The headers are downloaded from the peer first. Then the blocks are downloaded in batches from
+    up to MAX_DOWNLOAD_PEERS peers having the shard in parallel and added as soon as the lower batches
+    are added, with at most MAX_BATCHES_AHEAD batches downloaded ahead of the added ones.
+    Only the block download and execution stages overlap. The header download is a serial stage
+    that completes first, as the headers are downloaded from the tip back to the fork point and the
+    blocks can only be added from the fork point up.
     """
 
+    BLOCK_BATCH_SIZE = 100
+    MAX_DOWNLOAD_PEERS = 4
+    MAX_BATCHES_AHEAD = 8
+
     def __init__(self, header: MinorBlockHeader, shard_conn: PeerShardConnection):
         self.header = header
         self.shard_conn = shard_conn
@@ -219,12 +233,46 @@ class SyncTask:
         shard_config = self.shard_state.env.quark_chain_config.SHARD_LIST[shard_id]
         self.max_staleness = shard_config.max_stale_minor_block_height_diff
 
+        # stage -> [number of headers or blocks, seconds spent]
+        self.stage_stats = {
+            "headers": [0, 0.0],
+            "bodies": [0, 0.0],
+            "execution": [0, 0.0],
+        }
+
     async def sync(self):
+        start_time = time.time()
         try:
             await self.__run_sync()
         except Exception as e:
             Logger.log_exception()
             self.shard_conn.close_with_error(str(e))
+        finally:
+            self.__log_stats(time.time() - start_time)
+
+    def __record_stage(self, stage, count, start_time):
+        stats = self.stage_stats[stage]
+        stats[0] += count
+        stats[1] += time.time() - start_time
+
+    def __log_stats(self, duration):
+        num_blocks = self.stage_stats["execution"][0]
+        if num_blocks == 0:
+            return
+        Logger.info(
+            "[{}] synced {} blocks in {:.2f}s ({:.2f} blocks/s), {}".format(
+                self.shard_state.branch.get_shard_id(),
+                num_blocks,
+                duration,
+                num_blocks / duration if duration > 0 else 0,
+                ", ".join(
+                    "{} {} in {:.2f}s ({:.2f}/s)".format(
+                        stage, count, seconds, count / seconds if seconds > 0 else 0
+                    )
+                    for stage, (count, seconds) in self.stage_stats.items()
+                ),
+            )
+        )
 
     async def __run_sync(self):
         if self.__has_block_hash(self.header.get_hash()):
@@ -257,7 +305,9 @@ class SyncTask:
                     self.shard_state.branch.get_shard_id(), height, block_hash.hex()
                 )
             )
+            start_time = time.time()
             block_header_list = await self.__download_block_headers(block_hash)
+            self.__record_stage("headers", len(block_header_list), start_time)
             Logger.info(
                 "[{}] downloaded {} headers from peer".format(
                     self.shard_state.branch.get_shard_id(), len(block_header_list)
@@ -275,24 +325,101 @@ class SyncTask:
 
         # ascending height
         block_header_chain.reverse()
-        while len(block_header_chain) > 0:
-            block_chain = await self.__download_blocks(block_header_chain[:100])
+        batch_list = [
+            block_header_chain[i : i + self.BLOCK_BATCH_SIZE]
+            for i in range(0, len(block_header_chain), self.BLOCK_BATCH_SIZE)
+        ]
+        loop = asyncio.get_event_loop()
+        future_list = [loop.create_future() for _ in batch_list]
+        pending_batch_indices = deque(range(len(batch_list)))
+        ahead = asyncio.Semaphore(self.MAX_BATCHES_AHEAD)
+        workers = [
+            asyncio.ensure_future(
+                self.__run_download_worker(
+                    peer, batch_list, future_list, pending_batch_indices, ahead
+                )
+            )
+            for peer in self.__get_download_peers()
+        ]
+        try:
+            for future in future_list:
+                block_chain = await future
+                start_time = time.time()
+                for block in block_chain:
+                    # Stop if the block depends on an unknown root block
+                    # TODO: move this check to early stage to avoid downloading unnecessary headers
+                    if not self.shard_state.db.contain_root_block_by_hash(
+                        block.header.hash_prev_root_block
+                    ):
+                        return
+                    await self.shard.add_block(block)
+                self.__record_stage("execution", len(block_chain), start_time)
+                ahead.release()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # retrieve the results of the batches left behind on early return
+            for future in future_list:
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+
+    def __get_download_peers(self):
+        """ The peer of the task and the other peers that have seen the shard at the height """
+        peers = [self.shard_conn]
+        for peer in self.shard.peers.values():
+            if len(peers) >= self.MAX_DOWNLOAD_PEERS:
+                break
+            if peer is self.shard_conn or peer.is_closed():
+                continue
+            observed = peer.best_minor_block_header_observed
+            if observed and observed.height >= self.header.height:
+                peers.append(peer)
+        return peers
+
+    async def __run_download_worker(
+        self, peer, batch_list, future_list, pending_batch_indices, ahead
+    ):
+        """ Download the pending batches in ascending order with the peer.
+        If another peer fails to return a batch, the batch is downloaded from the peer of the task
+        and the other peer is no longer used.
+        """
+        while True:
+            await ahead.acquire()
+            if not pending_batch_indices:
+                ahead.release()
+                return
+            index = pending_batch_indices.popleft()
+            header_list = batch_list[index]
+            start_time = time.time()
+            try:
+                block_list = await self.__download_blocks(peer, header_list)
+                if not self.__validate_blocks(header_list, block_list):
+                    raise RuntimeError("Bad peer sending unrequested blocks")
+            except Exception as e:
+                if peer is self.shard_conn:
+                    future_list[index].set_exception(e)
+                    return
+                Logger.warning(
+                    "[{}] failed to download blocks from peer {}: {}".format(
+                        self.shard_state.branch.get_shard_id(),
+                        peer.cluster_peer_id,
+                        e,
+                    )
+                )
+                peer = self.shard_conn
+                pending_batch_indices.appendleft(index)
+                ahead.release()
+                continue
+            self.__record_stage("bodies", len(block_list), start_time)
             Logger.info(
                 "[{}] downloaded {} blocks from peer".format(
-                    self.shard_state.branch.get_shard_id(), len(block_chain)
+                    self.shard_state.branch.get_shard_id(), len(block_list)
                 )
             )
-            check(len(block_chain) == len(block_header_chain[:100]))
-
-            for block in block_chain:
-                # Stop if the block depends on an unknown root block
-                # TODO: move this check to early stage to avoid downloading unnecessary headers
-                if not self.shard_state.db.contain_root_block_by_hash(
-                    block.header.hash_prev_root_block
-                ):
-                    return
-                await self.shard.add_block(block)
-                block_header_chain.pop(0)
+            future_list[index].set_result(block_list)
 
     def __has_block_hash(self, block_hash):
         return self.shard_state.db.contain_minor_block_by_hash(block_hash)
@@ -307,6 +434,14 @@ class SyncTask:
                 return False
         return True
 
+    def __validate_blocks(self, block_header_list, block_list):
+        if len(block_list) != len(block_header_list):
+            return False
+        return all(
+            block.header.get_hash() == header.get_hash()
+            for block, header in zip(block_list, block_header_list)
+        )
+
     async def __download_block_headers(self, block_hash):
         request = GetMinorBlockHeaderListRequest(
             block_hash=block_hash,
@@ -319,9 +454,9 @@ class SyncTask:
         )
         return resp.block_header_list
 
-    async def __download_blocks(self, block_header_list):
+    async def __download_blocks(self, peer, block_header_list):
         block_hash_list = [b.get_hash() for b in block_header_list]
-        op, resp, rpc_id = await self.shard_conn.write_rpc_request(
+        op, resp, rpc_id = await peer.write_rpc_request(
             CommandOp.GET_MINOR_BLOCK_LIST_REQUEST,
             GetMinorBlockListRequest(block_hash_list),
         )
@@ -355,7 +490,12 @@ class Shard:
         self.shard_id = shard_id
         self.slave = slave
 
-        self.state = ShardState(env, shard_id, self.__init_shard_db())
+        self.state = ShardState(
+            env,
+            shard_id,
+            self.__init_shard_db(),
+            sender_recovery_pool=slave.sender_recovery_pool,
+        )
 
         self.loop = asyncio.get_event_loop()
         self.synchronizer = Synchronizer()
@@ -366,6 +506,10 @@ class Shard:
         # the block that has been added locally but not have been fully propagated will have an entry here
         self.add_block_futures = dict()
 
+        # futures resolved on the next block or root block added to the shard,
+        # see wait_for_sync_dependencies()
+        self.chain_update_futures = []
+
         self.tx_generator = TransactionGenerator(self.env.quark_chain_config, self)
 
         self.__init_miner()
@@ -449,11 +593,20 @@ class Shard:
         check(root_block.header.height >= self.genesis_root_height)
 
         if root_block.header.height > self.genesis_root_height:
-            return self.state.add_root_block(root_block)
+            switched = self.state.add_root_block(root_block)
+            self.__notify_chain_update()
+            return switched
 
         # this happens when there is a root chain fork
         if root_block.header.height == self.genesis_root_height:
             await self.__init_genesis_state(root_block)
+            self.__notify_chain_update()
+
+    def __notify_chain_update(self):
+        futures, self.chain_update_futures = self.chain_update_futures, []
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
 
     def broadcast_new_block(self, block):
         for cluster_peer_id, peer in self.peers.items():
@@ -510,11 +663,13 @@ class Shard:
         called by 1. local miner (will not run if syncing) 2. SyncTask
         """
         old_tip = self.state.header_tip
+        await self.slave.sender_recovery_pool.recover_senders(block.tx_list)
         try:
             xshard_list = self.state.add_block(block)
         except Exception as e:
             Logger.error_exception()
             return False
+        self.__notify_chain_update()
 
         # only remove from pool if the block successfully added to state,
         #   this may cache failed blocks but prevents them being broadcasted more than needed
@@ -561,6 +716,37 @@ class Shard:
         del self.add_block_futures[block.header.get_hash()]
         return True
 
+    async def wait_for_sync_dependencies(self, block_list, peer_conn):
+        """ Wait until the parent of block_list and the root blocks the blocks point to are added
+        to the shard, which may happen later than the blocks are downloaded when the master syncs
+        the minor blocks of multiple root blocks concurrently.
+        Returns False if peer_conn is closed before that, e.g., when the master aborts the sync.
+        """
+
+        def is_ready():
+            if not self.state.db.contain_minor_block_by_hash(
+                block_list[0].header.hash_prev_minor_block
+            ):
+                return False
+            return all(
+                self.state.db.contain_root_block_by_hash(
+                    block.header.hash_prev_root_block
+                )
+                for block in block_list
+            )
+
+        while not is_ready():
+            if peer_conn.is_closed():
+                return False
+            # wake up on the next block or root block added, or when peer_conn is closed
+            future = self.loop.create_future()
+            self.chain_update_futures.append(future)
+            await asyncio.wait(
+                [future, peer_conn.close_future], return_when=asyncio.FIRST_COMPLETED
+            )
+            future.cancel()
+        return True
+
     async def add_block_list_for_sync(self, block_list):
         """ Add blocks in batch to reduce RPCs. Will NOT broadcast to peers.
 
@@ -572,6 +758,9 @@ class Shard:
         if not block_list:
             return True
 
+        await self.slave.sender_recovery_pool.recover_senders(
+            [tx for block in block_list for tx in block.tx_list]
+        )
         existing_add_block_futures = []
         block_hash_to_x_shard_list = dict()
         for block in block_list:
@@ -583,6 +772,7 @@ class Shard:
             except Exception as e:
                 Logger.error_exception()
                 return False
+            self.__notify_chain_update()
 
             # block already existed in local shard state
             # but might not have been propagated to other shards and master
@@ -613,12 +803,14 @@ class Shard:
     def add_tx_list(self, tx_list, source_peer=None):
         if not tx_list:
             return
-        valid_tx_list = []
-        for tx in tx_list:
-            if self.add_tx(tx):
-                valid_tx_list.append(tx)
+        valid_tx_list = [
+            tx
+            for tx, success in zip(tx_list, self.state.add_tx_list(tx_list))
+            if success
+        ]
         if not valid_tx_list:
             return
+        self.slave.send_pending_tx_list_to_master(valid_tx_list)
         self.broadcast_tx_list(valid_tx_list, source_peer)
 
     def add_tx(self, tx: Transaction):
@@ -1,5 +1,6 @@
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
+from quarkchain.cache import LRUCache
 from quarkchain.cluster.rpc import TransactionDetail
 from quarkchain.core import (
     RootBlock,
@@ -7,11 +8,159 @@ from quarkchain.core import (
     CrossShardTransactionList,
     Branch,
     Address,
+    Constant,
+    TransactionReceipt,
+    TransactionReceiptList,
 )
 from quarkchain.utils import check, Logger
 
 
+def _iterate_bits(value):
+    """ Yield the indexes of the bits set in an int in ascending order """
+    while value:
+        low = value & -value
+        yield low.bit_length() - 1
+        value ^= low
+
+
+class BloomBitsIndexMixin:
+    """ Sectioned index of the header blooms of the canonical chain, similar to geth's bloombits.
+    For each section of BLOOM_BITS_SECTION_SIZE heights and each of the 2048 bloom bits, a bitset
+    records which blocks in the section have that bit set in the header bloom. Log filters can then
+    find the candidate heights by ANDing / ORing a few bitsets without reading any block.
+    Like in geth, only completed sections are indexed: a section is built from the canonical headers
+    once the chain is BLOOM_BITS_CONFIRMATIONS blocks past its end, writing each bitset once. The
+    heights after the last indexed section are scanned by their headers.
+    """
+
+    BLOOM_BITS_SECTION_SIZE = 4096
+    BLOOM_BITS_CONFIRMATIONS = 256
+
+    def __encode_bloom_bits_key(self, section, bit):
+        return b"bloombits_" + section.to_bytes(4, "big") + bit.to_bytes(2, "big")
+
+    def __get_bloom_bits(self, section, bit):
+        data = self.db.get(self.__encode_bloom_bits_key(section, bit), None)
+        if not data:
+            return 0
+        return int.from_bytes(data, "big")
+
+    def __get_bloom_bits_start_section(self):
+        return self.get_bloom_bits_start_height() // self.BLOOM_BITS_SECTION_SIZE
+
+    def __get_bloom_bits_end_section(self):
+        """ The sections from the start section up to but excluding this one are indexed """
+        data = self.db.get(b"bloombits_end", None)
+        if not data:
+            return self.__get_bloom_bits_start_section()
+        return int.from_bytes(data, "big")
+
+    def __set_bloom_bits_end_section(self, section):
+        self.db.put(b"bloombits_end", section.to_bytes(4, "big"))
+
+    def __index_bloom_bits_section(self, section):
+        """ Build the bitsets of a section from the canonical headers """
+        size = self.BLOOM_BITS_SECTION_SIZE
+        # clear the bitsets left by an earlier index of the section that has been reorged since
+        prefix = b"bloombits_" + section.to_bytes(4, "big")
+        for key, _ in list(self.db.range_iter(prefix, prefix + b"\xff\xff")):
+            self.db.remove(key)
+
+        bitsets = dict()  # bit -> bitset of the section
+        for offset in range(size):
+            block_hash = self.get_minor_block_hash_by_height(section * size + offset)
+            if block_hash is None:
+                # below genesis
+                continue
+            header = self.get_minor_block_header_by_hash(block_hash, False)
+            for bit in _iterate_bits(header.bloom):
+                bitsets[bit] = bitsets.get(bit, 0) | (1 << offset)
+        for bit, bits in bitsets.items():
+            self.db.put(
+                self.__encode_bloom_bits_key(section, bit),
+                bits.to_bytes(size // 8, "big"),
+            )
+
+    def update_bloom_bits_index(self, tip_height):
+        """ Index the next section if the canonical chain ending at tip_height is far enough past it.
+        At most one section is indexed per call to bound the work done when adding a block.
+        """
+        section = self.__get_bloom_bits_end_section()
+        section_end = (section + 1) * self.BLOOM_BITS_SECTION_SIZE - 1
+        if tip_height < section_end + self.BLOOM_BITS_CONFIRMATIONS:
+            return
+        self.__index_bloom_bits_section(section)
+        self.__set_bloom_bits_end_section(section + 1)
+
+    def invalidate_bloom_bits_index(self, height):
+        """ The canonical block at height is being replaced, so its section has to be indexed again """
+        section = height // self.BLOOM_BITS_SECTION_SIZE
+        if section < self.__get_bloom_bits_end_section():
+            self.__set_bloom_bits_end_section(
+                max(section, self.__get_bloom_bits_start_section())
+            )
+
+    def init_bloom_bits_index(self, height):
+        """ Record the height from which the canonical blocks are indexed, starting from its section.
+        This is only set once so that a db created before the index does not have to index all its
+        blocks.
+        """
+        if self.db.get(b"bloombits_start", None) is None:
+            self.db.put(b"bloombits_start", height.to_bytes(8, "big"))
+
+    def get_bloom_bits_start_height(self):
+        data = self.db.get(b"bloombits_start", None)
+        if not data:
+            return 0
+        return int.from_bytes(data, "big")
+
+    def get_bloom_bits_indexed_range(self):
+        """ The heights [start, end) covered by the indexed sections """
+        size = self.BLOOM_BITS_SECTION_SIZE
+        return (
+            self.__get_bloom_bits_start_section() * size,
+            self.__get_bloom_bits_end_section() * size,
+        )
+
+    def get_heights_by_bloom_bits(self, bloom_bits, start_height, end_height):
+        """ Return the heights in [start_height, end_height] whose header blooms match bloom_bits
+        in ascending order. The heights should be in the indexed sections, see
+        get_bloom_bits_indexed_range.
+        bloom_bits is a list of lists of bloom values where the inner lists are connected by OR
+        and the outer list by AND (see Filter).
+        """
+        heights = []
+        size = self.BLOOM_BITS_SECTION_SIZE
+        for section in range(start_height // size, end_height // size + 1):
+            cache = dict()  # bit -> bitset of the section
+            matched = (1 << size) - 1
+            for bloom_list in bloom_bits:
+                any_matched = 0
+                for bloom_value in bloom_list:
+                    all_matched = matched
+                    for bit in _iterate_bits(bloom_value):
+                        if bit not in cache:
+                            cache[bit] = self.__get_bloom_bits(section, bit)
+                        all_matched &= cache[bit]
+                    any_matched |= all_matched
+                matched &= any_matched
+                if not matched:
+                    break
+
+            for offset in _iterate_bits(matched):
+                height = section * size + offset
+                if start_height <= height <= end_height:
+                    heights.append(height)
+        return heights
+
+
 class TransactionHistoryMixin:
+    """ Index of the txs sent or received by each address in the canonical chain.
+    The value of each row is the serialized TransactionDetail of the tx, so that a page of history
+    is read with a single range scan. Rows with an empty value were written before the details
+    were stored and are filled from the block.
+    """
+
     def __encode_address_transaction_key(self, address, height, index, cross_shard):
         cross_shard_byte = b"\x00" if cross_shard else b"\x01"
         return (
@@ -38,31 +187,58 @@ class TransactionHistoryMixin:
             return []
         return CrossShardTransactionList.deserialize(data).tx_list
 
+    def __create_transaction_detail(self, minor_block, index):
+        receipt = self.get_receipt(minor_block, index)
+        tx = minor_block.tx_list[index]  # tx is Transaction
+        evm_tx = tx.code.get_evm_transaction()
+        return TransactionDetail(
+            tx.get_hash(),
+            Address(evm_tx.sender, evm_tx.from_full_shard_id),
+            Address(evm_tx.to, evm_tx.to_full_shard_id) if evm_tx.to else None,
+            evm_tx.value,
+            minor_block.header.height,
+            minor_block.header.create_time,
+            receipt.success == b"\x01",
+        )
+
+    def __create_cross_shard_transaction_detail(self, minor_block, tx):
+        """ tx is CrossShardTransactionDeposit """
+        return TransactionDetail(
+            tx.tx_hash,
+            tx.from_address,
+            tx.to_address,
+            tx.value,
+            minor_block.header.height,
+            minor_block.header.create_time,
+            True,
+        )
+
     def __update_transaction_history_index(self, tx, block_height, index, func):
         evm_tx = tx.code.get_evm_transaction()
         addr = Address(evm_tx.sender, evm_tx.from_full_shard_id)
         key = self.__encode_address_transaction_key(addr, block_height, index, False)
-        func(key, b"")
+        func(key)
         # "to" can be empty for smart contract deployment
         if evm_tx.to and self.branch.is_in_shard(evm_tx.to_full_shard_id):
             addr = Address(evm_tx.to, evm_tx.to_full_shard_id)
             key = self.__encode_address_transaction_key(
                 addr, block_height, index, False
             )
-            func(key, b"")
+            func(key)
 
-    def put_transaction_history_index(self, tx, block_height, index):
+    def put_transaction_history_index(self, tx, minor_block, index):
         if not self.env.cluster_config.ENABLE_TRANSACTION_HISTORY:
             return
+        value = self.__create_transaction_detail(minor_block, index).serialize()
         self.__update_transaction_history_index(
-            tx, block_height, index, lambda k, v: self.db.put(k, v)
+            tx, minor_block.header.height, index, lambda k: self.db.put(k, value)
         )
 
     def remove_transaction_history_index(self, tx, block_height, index):
         if not self.env.cluster_config.ENABLE_TRANSACTION_HISTORY:
             return
         self.__update_transaction_history_index(
-            tx, block_height, index, lambda k, v: self.db.remove(k)
+            tx, block_height, index, lambda k: self.db.remove(k)
         )
 
     def __update_transaction_history_index_from_block(self, minor_block, func):
@@ -75,20 +251,26 @@ class TransactionHistoryMixin:
             key = self.__encode_address_transaction_key(
                 tx.to_address, minor_block.header.height, i, True
             )
-            func(key, b"")
+            func(key, tx)
 
     def put_transaction_history_index_from_block(self, minor_block):
         if not self.env.cluster_config.ENABLE_TRANSACTION_HISTORY:
             return
         self.__update_transaction_history_index_from_block(
-            minor_block, lambda k, v: self.db.put(k, v)
+            minor_block,
+            lambda k, tx: self.db.put(
+                k,
+                self.__create_cross_shard_transaction_detail(
+                    minor_block, tx
+                ).serialize(),
+            ),
         )
 
     def remove_transaction_history_index_from_block(self, minor_block):
         if not self.env.cluster_config.ENABLE_TRANSACTION_HISTORY:
             return
         self.__update_transaction_history_index_from_block(
-            minor_block, lambda k, v: self.db.remove(k)
+            minor_block, lambda k, tx: self.db.remove(k)
         )
 
     def get_transactions_by_address(self, address, start=b"", limit=10):
@@ -110,46 +292,21 @@ class TransactionHistoryMixin:
             limit -= 1
             if limit < 0:
                 break
-            height = int.from_bytes(k[5 + 24 : 5 + 24 + 4], "big")
-            cross_shard = int(k[5 + 24 + 4]) == 0
-            index = int.from_bytes(k[5 + 24 + 4 + 1 :], "big")
-            if cross_shard:  # cross shard receive
-                m_block = self.get_minor_block_by_height(height)
-                x_shard_receive_tx_list = self.__get_confirmed_cross_shard_transaction_deposit_list(
-                    m_block.header.get_hash()
-                )
-                tx = x_shard_receive_tx_list[
-                    index
-                ]  # tx is CrossShardTransactionDeposit
-                tx_list.append(
-                    TransactionDetail(
-                        tx.tx_hash,
-                        tx.from_address,
-                        tx.to_address,
-                        tx.value,
-                        height,
-                        m_block.header.create_time,
-                        True,
-                    )
-                )
+            if v:
+                tx_list.append(TransactionDetail.deserialize(v))
             else:
+                height = int.from_bytes(k[5 + 24 : 5 + 24 + 4], "big")
+                cross_shard = int(k[5 + 24 + 4]) == 0
+                index = int.from_bytes(k[5 + 24 + 4 + 1 :], "big")
                 m_block = self.get_minor_block_by_height(height)
-                receipt = m_block.get_receipt(self.db, index)
-                tx = m_block.tx_list[index]  # tx is Transaction
-                evm_tx = tx.code.get_evm_transaction()
-                tx_list.append(
-                    TransactionDetail(
-                        tx.get_hash(),
-                        Address(evm_tx.sender, evm_tx.from_full_shard_id),
-                        Address(evm_tx.to, evm_tx.to_full_shard_id)
-                        if evm_tx.to
-                        else None,
-                        evm_tx.value,
-                        height,
-                        m_block.header.create_time,
-                        receipt.success == b"\x01",
-                    )
-                )
+                if cross_shard:  # cross shard receive
+                    tx = self.__get_confirmed_cross_shard_transaction_deposit_list(
+                        m_block.header.get_hash()
+                    )[index]
+                    detail = self.__create_cross_shard_transaction_detail(m_block, tx)
+                else:
+                    detail = self.__create_transaction_detail(m_block, index)
+                tx_list.append(detail)
             next = (int.from_bytes(k, byteorder="big") - 1).to_bytes(
                 len(k), byteorder="big"
             )
@@ -157,17 +314,56 @@ class TransactionHistoryMixin:
         return tx_list, next
 
 
-class ShardDbOperator(TransactionHistoryMixin):
+class ShardDbOperator(TransactionHistoryMixin, BloomBitsIndexMixin):
+    """ Storage of the blocks of a shard and the root blocks it has seen
+
+    The blocks, headers, metas and receipts returned by the getters are shared with the caches
+    and must be treated as read-only. Copy them before any modification.
+    """
+
     def __init__(self, db, env, branch: Branch):
         self.env = env
         self.db = db
         self.branch = branch
         # TODO:  iterate db to recover pools and set
-        self.m_header_pool = dict()
-        self.m_meta_pool = dict()
+        # Hashes of the validated blocks. Headers, metas and blocks are kept in bounded caches
+        # and loaded from db on a miss.
+        # The hash sets are not bounded as they tell the blocks validated in this process or
+        # recovered on start from the blocks only in db, e.g., the forks not recovered, which
+        # must be validated again. Each entry takes about 100 bytes.
+        self.m_hash_set = set()
+        self.r_hash_set = set()
         self.x_shard_set = set()
-        self.r_header_pool = dict()
-        self.r_minor_header_pool = dict()
+
+        cluster_config = env.cluster_config
+        self.m_header_cache = LRUCache(
+            cluster_config.HEADER_CACHE_MAX_ENTRIES,
+            cluster_config.HEADER_CACHE_MAX_BYTES,
+        )
+        self.m_meta_cache = LRUCache(
+            cluster_config.HEADER_CACHE_MAX_ENTRIES,
+            cluster_config.HEADER_CACHE_MAX_BYTES,
+        )
+        self.m_block_cache = LRUCache(
+            cluster_config.BLOCK_CACHE_MAX_ENTRIES,
+            cluster_config.BLOCK_CACHE_MAX_BYTES,
+        )
+        self.r_header_cache = LRUCache(
+            cluster_config.HEADER_CACHE_MAX_ENTRIES,
+            cluster_config.HEADER_CACHE_MAX_BYTES,
+        )
+        self.r_minor_header_cache = LRUCache(
+            cluster_config.HEADER_CACHE_MAX_ENTRIES,
+            cluster_config.HEADER_CACHE_MAX_BYTES,
+        )
+        self.r_block_cache = LRUCache(
+            cluster_config.BLOCK_CACHE_MAX_ENTRIES,
+            cluster_config.BLOCK_CACHE_MAX_BYTES,
+        )
+        self.m_receipt_cache = LRUCache(
+            cluster_config.RECEIPT_CACHE_MAX_ENTRIES,
+            cluster_config.RECEIPT_CACHE_MAX_BYTES,
+        )
 
         # height -> set(minor block hash) for counting wasted blocks
         self.height_to_minor_block_hashes = dict()
@@ -200,14 +396,11 @@ class ShardDbOperator(TransactionHistoryMixin):
         """
         r_hash = r_header.get_hash()
         while (
-            len(self.r_header_pool)
+            len(self.r_hash_set)
             < self.env.quark_chain_config.ROOT.max_root_blocks_in_memory
         ):
-            block = RootBlock.deserialize(self.db.get(b"rblock_" + r_hash))
-            self.r_minor_header_pool[
-                r_hash
-            ] = self.__get_last_minor_block_in_root_block(block)
-            self.r_header_pool[r_hash] = block.header
+            block = self.__load_root_block(r_hash)
+            self.r_hash_set.add(r_hash)
             if (
                 block.header.height
                 <= self.env.quark_chain_config.get_genesis_root_height(
@@ -221,23 +414,55 @@ class ShardDbOperator(TransactionHistoryMixin):
         shard_config = self.env.quark_chain_config.SHARD_LIST[
             self.branch.get_shard_id()
         ]
-        while len(self.m_header_pool) < shard_config.max_minor_blocks_in_memory:
-            block = MinorBlock.deserialize(self.db.get(b"mblock_" + m_hash))
-            self.m_header_pool[m_hash] = block.header
-            self.m_meta_pool[m_hash] = block.meta
+        while len(self.m_hash_set) < shard_config.max_minor_blocks_in_memory:
+            block = self.__load_minor_block(m_hash)
+            self.m_hash_set.add(m_hash)
             if block.header.height <= 0:
                 break
             m_hash = block.header.hash_prev_minor_block
 
         Logger.info(
             "[{}] recovered {} minor blocks and {} root blocks".format(
-                self.branch.get_shard_id(),
-                len(self.m_header_pool),
-                len(self.r_header_pool),
+                self.branch.get_shard_id(), len(self.m_hash_set), len(self.r_hash_set)
             )
         )
 
+    def get_cache_stats(self):
+        return {
+            "m_header": self.m_header_cache.stats(),
+            "m_meta": self.m_meta_cache.stats(),
+            "m_block": self.m_block_cache.stats(),
+            "r_header": self.r_header_cache.stats(),
+            "r_minor_header": self.r_minor_header_cache.stats(),
+            "r_block": self.r_block_cache.stats(),
+            "m_receipt": self.m_receipt_cache.stats(),
+        }
+
     # ------------------------- Root block db operations --------------------------------
+    def __load_root_block(self, h) -> Optional[RootBlock]:
+        """ Read the root block from the block cache or db, and fill the header caches """
+        block = self.r_block_cache.get(h)
+        if block is not None:
+            return block
+        data = self.db.get(b"rblock_" + h, None)
+        if data is None:
+            return None
+        block = RootBlock.deserialize(data)
+        self.r_block_cache.put(h, block, len(data))
+        if h not in self.r_header_cache:
+            self.r_header_cache.put(
+                h,
+                block.header,
+                Constant.ROOT_BLOCK_HEADER_SIZE + len(block.header.extra_data),
+            )
+        if h not in self.r_minor_header_cache:
+            self.r_minor_header_cache.put(
+                h,
+                self.__get_last_minor_block_in_root_block(block),
+                Constant.MINOR_BLOCK_HEADER_SIZE,
+            )
+        return block
+
     def put_root_block(self, root_block, r_minor_header=None, root_block_hash=None):
         """ r_minor_header: the minor header of the shard in the root block with largest height
         """
@@ -245,43 +470,137 @@ class ShardDbOperator(TransactionHistoryMixin):
             root_block_hash = root_block.header.get_hash()
 
         self.db.put(b"rblock_" + root_block_hash, root_block.serialize())
-        self.r_header_pool[root_block_hash] = root_block.header
-        self.r_minor_header_pool[root_block_hash] = r_minor_header
+        if root_block_hash not in self.r_hash_set:
+            self.db.on_discard(lambda: self.__forget_root_block(root_block_hash))
+        self.r_hash_set.add(root_block_hash)
+        self.r_header_cache.put(
+            root_block_hash,
+            root_block.header,
+            Constant.ROOT_BLOCK_HEADER_SIZE + len(root_block.header.extra_data),
+        )
+        self.r_minor_header_cache.put(
+            root_block_hash, r_minor_header, Constant.MINOR_BLOCK_HEADER_SIZE
+        )
+
+    def __forget_root_block(self, h):
+        """ Undo the in-memory updates of put_root_block when its writes are discarded """
+        self.r_hash_set.discard(h)
+        self.r_header_cache.pop(h)
+        self.r_minor_header_cache.pop(h)
+        self.r_block_cache.pop(h)
 
     def get_root_block_by_hash(self, h):
-        if h not in self.r_header_pool:
+        if h not in self.r_hash_set:
             return None
-        return RootBlock.deserialize(self.db.get(b"rblock_" + h))
+        return self.__load_root_block(h)
 
     def get_root_block_header_by_hash(self, h):
-        return self.r_header_pool.get(h, None)
+        if h not in self.r_hash_set:
+            return None
+        header = self.r_header_cache.get(h)
+        if header is None:
+            header = self.__load_root_block(h).header
+        return header
 
     def contain_root_block_by_hash(self, h):
-        return h in self.r_header_pool
+        return h in self.r_hash_set
+
+    def get_root_block_hash_by_height(self, height):
+        """ Hash of the root block at height in the chain of the root tip or None """
+        return self.db.get(b"ri_%d" % height, None)
+
+    def rewrite_root_block_index_to(self, header):
+        """ Index the chain of header as the root chain, which is walked back until the common
+        ancestor with the indexed chain or the first root block not in memory.
+        """
+        height = header.height + 1
+        while self.get_root_block_hash_by_height(height) is not None:
+            self.db.remove(b"ri_%d" % height)
+            height += 1
+
+        block_hash = header.get_hash()
+        while header is not None:
+            if self.get_root_block_hash_by_height(header.height) == block_hash:
+                break
+            self.db.put(b"ri_%d" % header.height, block_hash)
+            block_hash = header.hash_prev_block
+            header = self.get_root_block_header_by_hash(block_hash)
 
     # TODO: make sure all the callers check None
     def get_last_minor_block_in_root_block(self, h):
-        if h not in self.r_header_pool:
+        if h not in self.r_hash_set:
             return None
-        return self.r_minor_header_pool.get(h)
+        if h in self.r_minor_header_cache:
+            return self.r_minor_header_cache.get(h)
+        return self.__get_last_minor_block_in_root_block(self.__load_root_block(h))
 
     # ------------------------- Minor block db operations --------------------------------
-    def put_minor_block(self, m_block, x_shard_receive_tx_list):
+    def __load_minor_block(self, h) -> Optional[MinorBlock]:
+        """ Read the minor block from the block cache or db, and fill the header and meta caches.
+        The block returned may be shared with other callers and should not be modified.
+        """
+        block = self.m_block_cache.get(h)
+        if block is not None:
+            return block
+        data = self.db.get(b"mblock_" + h, None)
+        if data is None:
+            return None
+        block = MinorBlock.deserialize(data)
+        self.m_block_cache.put(h, block, len(data))
+        if h not in self.m_header_cache:
+            self.m_header_cache.put(h, block.header, Constant.MINOR_BLOCK_HEADER_SIZE)
+        if h not in self.m_meta_cache:
+            self.m_meta_cache.put(
+                h,
+                block.meta,
+                Constant.MINOR_BLOCK_META_SIZE + len(block.meta.extra_data),
+            )
+        return block
+
+    def put_minor_block(self, m_block, x_shard_receive_tx_list, receipt_list=None):
+        """ receipt_list: TransactionReceipt of each tx in the block, see MinorBlock.create_receipt_list
+        """
         m_block_hash = m_block.header.get_hash()
 
-        self.db.put(b"mblock_" + m_block_hash, m_block.serialize())
-        self.put_total_tx_count(m_block)
+        with self.db.write_batch():
+            self.db.put(b"mblock_" + m_block_hash, m_block.serialize())
+            self.put_total_tx_count(m_block)
+            self.put_confirmed_cross_shard_transaction_deposit_list(
+                m_block_hash, x_shard_receive_tx_list
+            )
+            # the receipt cache is filled by get_receipt_list() once the receipts are committed
+            if receipt_list is not None:
+                self.db.put(
+                    b"receipts_" + m_block_hash,
+                    TransactionReceiptList(receipt_list).serialize(),
+                )
 
-        self.m_header_pool[m_block_hash] = m_block.header
-        self.m_meta_pool[m_block_hash] = m_block.meta
+        if m_block_hash not in self.m_hash_set:
+            self.db.on_discard(
+                lambda: self.__forget_minor_block(m_block_hash, m_block.header.height)
+            )
+        self.m_hash_set.add(m_block_hash)
+        self.m_header_cache.put(
+            m_block_hash, m_block.header, Constant.MINOR_BLOCK_HEADER_SIZE
+        )
+        self.m_meta_cache.put(
+            m_block_hash,
+            m_block.meta,
+            Constant.MINOR_BLOCK_META_SIZE + len(m_block.meta.extra_data),
+        )
 
         self.height_to_minor_block_hashes.setdefault(m_block.header.height, set()).add(
             m_block.header.get_hash()
         )
 
-        self.put_confirmed_cross_shard_transaction_deposit_list(
-            m_block_hash, x_shard_receive_tx_list
-        )
+    def __forget_minor_block(self, h, height):
+        """ Undo the in-memory updates of put_minor_block when its writes are discarded """
+        self.m_hash_set.discard(h)
+        self.m_header_cache.pop(h)
+        self.m_meta_cache.pop(h)
+        self.m_block_cache.pop(h)
+        self.m_receipt_cache.pop(h)
+        self.height_to_minor_block_hashes.get(height, set()).discard(h)
 
     def put_total_tx_count(self, m_block):
         prev_count = 0
@@ -297,43 +616,78 @@ class ShardDbOperator(TransactionHistoryMixin):
         return int.from_bytes(count_bytes, "big")
 
     def get_minor_block_header_by_hash(self, h, consistency_check=True):
-        header = self.m_header_pool.get(h, None)
-        if not header and not consistency_check:
-            block = self.get_minor_block_by_hash(h, False)
-            header = block.header
+        if consistency_check and h not in self.m_hash_set:
+            return None
+        header = self.m_header_cache.get(h)
+        if header is None:
+            block = self.__load_minor_block(h)
+            header = block.header if block else None
         return header
 
     def get_minor_block_evm_root_hash_by_hash(self, h):
-        if h not in self.m_header_pool:
+        meta = self.get_minor_block_meta_by_hash(h)
+        if meta is None:
             return None
-        check(h in self.m_meta_pool)
-        meta = self.m_meta_pool[h]
         return meta.hash_evm_state_root
 
     def get_minor_block_meta_by_hash(self, h):
-        return self.m_meta_pool.get(h, None)
+        if h not in self.m_hash_set:
+            return None
+        meta = self.m_meta_cache.get(h)
+        if meta is None:
+            meta = self.__load_minor_block(h).meta
+        return meta
 
     def get_minor_block_by_hash(
         self, h, consistency_check=True
     ) -> Optional[MinorBlock]:
-        if consistency_check and h not in self.m_header_pool:
+        if consistency_check and h not in self.m_hash_set:
             return None
-        return MinorBlock.deserialize(self.db.get(b"mblock_" + h))
+        return self.__load_minor_block(h)
 
     def contain_minor_block_by_hash(self, h):
-        return h in self.m_header_pool
+        return h in self.m_hash_set
+
+    def get_receipt_list(self, m_block) -> List[TransactionReceipt]:
+        """ Receipts of all the txs in the block, read with a single db lookup.
+        Blocks stored without their receipts fall back to the receipt trie.
+        The list returned may be shared with other callers and should not be modified.
+        """
+        m_block_hash = m_block.header.get_hash()
+        receipt_list = self.m_receipt_cache.get(m_block_hash)
+        if receipt_list is not None:
+            return receipt_list
+        data = self.db.get(b"receipts_" + m_block_hash, None)
+        if data is not None:
+            receipt_list = TransactionReceiptList.deserialize(data).receipt_list
+        else:
+            receipt_list = [
+                m_block.get_receipt(self.db, i) for i in range(len(m_block.tx_list))
+            ]
+            data = TransactionReceiptList(receipt_list).serialize()
+        # receipts read from a pending write batch are only cached if the batch commits
+        self.db.after_commit(
+            lambda: self.m_receipt_cache.put(m_block_hash, receipt_list, len(data))
+        )
+        return receipt_list
+
+    def get_receipt(self, m_block, index) -> TransactionReceipt:
+        return self.get_receipt_list(m_block)[index]
 
     def put_minor_block_index(self, block):
         self.db.put(b"mi_%d" % block.header.height, block.header.get_hash())
 
     def remove_minor_block_index(self, block):
         self.db.remove(b"mi_%d" % block.header.height)
+        self.invalidate_bloom_bits_index(block.header.height)
+
+    def get_minor_block_hash_by_height(self, height):
+        return self.db.get(b"mi_%d" % height, None)
 
     def get_minor_block_by_height(self, height) -> Optional[MinorBlock]:
-        key = b"mi_%d" % height
-        if key not in self.db:
+        block_hash = self.get_minor_block_hash_by_height(height)
+        if block_hash is None:
             return None
-        block_hash = self.db.get(key)
         return self.get_minor_block_by_hash(block_hash, False)
 
     def get_block_count_by_height(self, height):
@@ -341,14 +695,14 @@ class ShardDbOperator(TransactionHistoryMixin):
         return len(self.height_to_minor_block_hashes.setdefault(height, set()))
 
     # ------------------------- Transaction db operations --------------------------------
-    def put_transaction_index(self, tx, block_height, index):
+    def put_transaction_index(self, tx, minor_block, index):
         tx_hash = tx.get_hash()
         self.db.put(
             b"txindex_" + tx_hash,
-            block_height.to_bytes(4, "big") + index.to_bytes(4, "big"),
+            minor_block.header.height.to_bytes(4, "big") + index.to_bytes(4, "big"),
         )
 
-        self.put_transaction_history_index(tx, block_height, index)
+        self.put_transaction_history_index(tx, minor_block, index)
 
     def remove_transaction_index(self, tx, block_height, index):
         tx_hash = tx.get_hash()
@@ -360,6 +714,15 @@ class ShardDbOperator(TransactionHistoryMixin):
         key = b"txindex_" + tx_hash
         return key in self.db
 
+    def get_contained_transaction_hashes(self, tx_hash_list):
+        """ Return the set of the given tx hashes that are in the db with a single lookup """
+        result = self.db.multi_get([b"txindex_" + tx_hash for tx_hash in tx_hash_list])
+        return {
+            tx_hash
+            for tx_hash in tx_hash_list
+            if result.get(b"txindex_" + tx_hash, None) is not None
+        }
+
     def get_transaction_by_hash(
         self, tx_hash
     ) -> Tuple[Optional[MinorBlock], Optional[int]]:
@@ -372,16 +735,18 @@ class ShardDbOperator(TransactionHistoryMixin):
         return self.get_minor_block_by_height(block_height), index
 
     def put_transaction_index_from_block(self, minor_block):
-        for i, tx in enumerate(minor_block.tx_list):
-            self.put_transaction_index(tx, minor_block.header.height, i)
+        with self.db.write_batch():
+            for i, tx in enumerate(minor_block.tx_list):
+                self.put_transaction_index(tx, minor_block, i)
 
-        self.put_transaction_history_index_from_block(minor_block)
+            self.put_transaction_history_index_from_block(minor_block)
 
     def remove_transaction_index_from_block(self, minor_block):
-        for i, tx in enumerate(minor_block.tx_list):
-            self.remove_transaction_index(tx, minor_block.header.height, i)
+        with self.db.write_batch():
+            for i, tx in enumerate(minor_block.tx_list):
+                self.remove_transaction_index(tx, minor_block.header.height, i)
 
-        self.remove_transaction_history_index_from_block(minor_block)
+            self.remove_transaction_history_index_from_block(minor_block)
 
     # -------------------------- Cross-shard tx operations ----------------------------
     def put_minor_block_xshard_tx_list(self, h, tx_list: CrossShardTransactionList):
@@ -399,6 +764,15 @@ class ShardDbOperator(TransactionHistoryMixin):
         return key in self.db
 
     # ------------------------- Common operations -----------------------------------------
+    def write_batch(self):
+        return self.db.write_batch()
+
+    def after_commit(self, callback):
+        self.db.after_commit(callback)
+
+    def on_discard(self, callback):
+        self.db.on_discard(callback)
+
     def put(self, key, value):
         self.db.put(key, value)
 
@@ -1,13 +1,16 @@
 import asyncio
+import functools
 import json
 import time
 from collections import defaultdict
 from typing import Optional, Tuple, List, Union, Dict
 
+from quarkchain.cluster.chain_index import is_same_chain
 from quarkchain.cluster.filter import Filter
 from quarkchain.cluster.neighbor import is_neighbor
 from quarkchain.cluster.rpc import ShardStats, TransactionDetail
 from quarkchain.cluster.shard_db_operator import ShardDbOperator
+from quarkchain.cluster.tx_pool import TransactionPool
 from quarkchain.config import NetworkId
 from quarkchain.core import (
     calculate_merkle_root,
@@ -17,9 +20,9 @@ from quarkchain.core import (
     RootBlock,
     Transaction,
     Log,
+    MerkleAccumulator,
 )
 from quarkchain.core import (
-    mk_receipt_sha,
     CrossShardTransactionList,
     CrossShardTransactionDeposit,
     MinorBlock,
@@ -29,10 +32,11 @@ from quarkchain.core import (
 )
 from quarkchain.diff import EthDifficultyCalculator
 from quarkchain.evm import opcodes
+from quarkchain.evm.flat_state import FlatState
 from quarkchain.evm.messages import apply_transaction, validate_transaction
 from quarkchain.evm.state import State as EvmState
-from quarkchain.evm.transaction_queue import TransactionQueue
 from quarkchain.evm.transactions import Transaction as EvmTransaction
+from quarkchain.evm.trie import enable_node_cache
 from quarkchain.genesis import GenesisManager
 from quarkchain.reward import ConstMinorBlockRewardCalcultor
 from quarkchain.utils import Logger, check, time_ms
@@ -57,7 +61,9 @@ class ShardState:
     - reshard by split
     """
 
-    def __init__(self, env, shard_id, db=None, diff_calc=None):
+    def __init__(
+        self, env, shard_id, db=None, diff_calc=None, sender_recovery_pool=None
+    ):
         self.env = env
         self.shard_id = shard_id
         self.diff_calc = (
@@ -67,10 +73,19 @@ class ShardState:
         )
         self.reward_calc = ConstMinorBlockRewardCalcultor(env)
         self.raw_db = db if db is not None else env.db
+        enable_node_cache(self.raw_db, env.cluster_config.TRIE_NODE_CACHE_SIZE)
         self.branch = Branch.create(env.quark_chain_config.SHARD_SIZE, shard_id)
         self.db = ShardDbOperator(self.raw_db, self.env, self.branch)
-        self.tx_queue = TransactionQueue()  # queue of EvmTransaction
-        self.tx_dict = dict()  # hash -> Transaction for explorer
+        # flat snapshot of the state of the last block in the canonical chain index
+        self.flat_state = FlatState(self.raw_db)
+        # times the snapshot is generated again after failing to follow the chain
+        self.flat_state_regenerated_count = 0
+        # pending txs indexed by hash, sender and gas price
+        self.tx_queue = TransactionPool(
+            env.quark_chain_config.TRANSACTION_QUEUE_SIZE_LIMIT_PER_SHARD
+        )
+        # recovers the senders of the txs in a block in parallel, see SenderRecoveryPool
+        self.sender_recovery_pool = sender_recovery_pool
         self.initialized = False
         # TODO: make the oracle configurable
         self.gas_price_suggestion_oracle = GasPriceSuggestionOracle(
@@ -117,6 +132,7 @@ class ShardState:
         self.header_tip = __get_header_tip_from_root_block(self.branch)
 
         self.db.recover_state(self.root_tip, self.header_tip)
+        self.db.rewrite_root_block_index_to(self.root_tip)
         Logger.info(
             "[{}] Done recovery from db. shard tip {} {}, root tip {} {}".format(
                 self.shard_id,
@@ -136,13 +152,20 @@ class ShardState:
             == self.meta_tip.hash_evm_state_root
         )
 
+        # blocks below the tip are not in the bloom bits index if the db was created without it
+        self.db.init_bloom_bits_index(self.header_tip.height + 1)
         self.__rewrite_block_index_to(
             self.db.get_minor_block_by_hash(self.header_tip.get_hash()),
             add_tx_back_to_queue=False,
         )
+        if self.flat_state.root != self.meta_tip.hash_evm_state_root:
+            Logger.info("[{}] Generating flat state snapshot".format(self.shard_id))
+            self.flat_state.generate(self.meta_tip.hash_evm_state_root)
 
     def __create_evm_state(self):
-        return EvmState(env=self.env.evm_env, db=self.raw_db)
+        return EvmState(
+            env=self.env.evm_env, db=self.raw_db, flat_state=self.flat_state
+        )
 
     def init_genesis_state(self, root_block):
         """ root_block should have the same height as configured in shard GENESIS.
@@ -158,16 +181,20 @@ class ShardState:
             root_block, self.shard_id, self.__create_evm_state()
         )
 
-        self.db.put_minor_block(genesis_block, [])
-        self.db.put_root_block(root_block)
+        with self.db.write_batch():
+            self.db.put_minor_block(genesis_block, [])
+            self.db.put_root_block(root_block)
 
-        if self.initialized:
-            # already initialized. just return the block without resetting the state.
-            return genesis_block
+            if self.initialized:
+                # already initialized. just return the block without resetting the state.
+                return genesis_block
 
-        # block index should not be overwritten if there is already a genesis block
-        # this must happen after the above initialization check
-        self.db.put_minor_block_index(genesis_block)
+            # block index should not be overwritten if there is already a genesis block
+            # this must happen after the above initialization check
+            self.db.put_minor_block_index(genesis_block)
+            self.db.rewrite_root_block_index_to(root_block.header)
+            self.db.init_bloom_bits_index(genesis_block.header.height)
+            self.flat_state.generate(genesis_block.meta.hash_evm_state_root)
 
         self.evm_state = self.__create_evm_state()
         self.evm_state.trie.root_hash = genesis_block.meta.hash_evm_state_root
@@ -190,9 +217,11 @@ class ShardState:
         return genesis_block
 
     def __validate_tx(
-        self, tx: Transaction, evm_state, from_address=None, gas=None
+        self, tx: Transaction, evm_state, from_address=None, gas=None, evm_tx=None
     ) -> EvmTransaction:
-        """from_address will be set for execute_tx"""
+        """from_address will be set for execute_tx
+        evm_tx can be given if it has been decoded from tx already
+        """
         # UTXOs are not supported now
         if len(tx.in_list) != 0:
             raise RuntimeError("input list must be empty")
@@ -207,7 +236,8 @@ class ShardState:
         if not tx.code.is_evm():
             raise RuntimeError("only evm transaction is supported now")
 
-        evm_tx = tx.code.get_evm_transaction()
+        if evm_tx is None:
+            evm_tx = tx.code.get_evm_transaction()
 
         if from_address:
             check(evm_tx.from_full_shard_id == from_address.full_shard_id)
@@ -256,31 +286,70 @@ class ShardState:
         # TODO: xshard gas limit check
         return evm_tx
 
-    def add_tx(self, tx: Transaction):
-        if (
-            len(self.tx_queue)
-            > self.env.quark_chain_config.TRANSACTION_QUEUE_SIZE_LIMIT_PER_SHARD
-        ):
-            # exceeding tx queue size limit
-            return False
+    def __decode_and_recover_senders(
+        self, tx_list: List[Transaction]
+    ) -> List[Optional[EvmTransaction]]:
+        """ Decode the evm txs and recover their senders in one pass.
+        The errors are left to __validate_tx to report.
+        """
+        evm_tx_list = []
+        for tx in tx_list:
+            try:
+                evm_tx = tx.code.get_evm_transaction()
+            except Exception:
+                evm_tx_list.append(None)
+                continue
+            try:
+                tx.code.set_evm_sender(evm_tx.sender)
+            except Exception:
+                pass
+            evm_tx_list.append(evm_tx)
+        return evm_tx_list
 
-        if self.db.contain_transaction_hash(tx.get_hash()):
-            return False
+    def add_tx(self, tx: Transaction):
+        return self.add_tx_list([tx])[0]
 
-        tx_hash = tx.get_hash()
-        if tx_hash in self.tx_dict:
-            return False
+    def add_tx_list(self, tx_list: List[Transaction]) -> List[bool]:
+        """ Validate the txs as a batch and add the valid ones to the tx queue.
+        Returns whether each tx is accepted.
+        """
+        results = [False] * len(tx_list)
+
+        # skip the txs already in the queue or repeated in the list
+        candidates = []  # (index, tx_hash, tx)
+        seen = set()
+        for i, tx in enumerate(tx_list):
+            tx_hash = tx.get_hash()
+            if tx_hash in self.tx_queue or tx_hash in seen:
+                continue
+            seen.add(tx_hash)
+            candidates.append((i, tx_hash, tx))
+        if not candidates:
+            return results
+
+        # skip the txs already in the chain
+        contained = self.db.get_contained_transaction_hashes(
+            [tx_hash for _, tx_hash, _ in candidates]
+        )
+        candidates = [c for c in candidates if c[1] not in contained]
+        if not candidates:
+            return results
 
+        evm_tx_list = self.__decode_and_recover_senders([tx for _, _, tx in candidates])
+        # validation only reads the state so one clone is shared by all the txs
         evm_state = self.evm_state.ephemeral_clone()
         evm_state.gas_used = 0
-        try:
-            evm_tx = self.__validate_tx(tx, evm_state)
-            self.tx_queue.add_transaction(evm_tx)
-            self.tx_dict[tx_hash] = tx
-            return True
-        except Exception as e:
-            Logger.warning_every_sec("Failed to add transaction: {}".format(e), 1)
-            return False
+        for (i, tx_hash, tx), evm_tx in zip(candidates, evm_tx_list):
+            if evm_tx is not None and not self.tx_queue.has_room_for(evm_tx.gasprice):
+                # tx pool is full of txs paying more
+                continue
+
+            try:
+                evm_tx = self.__validate_tx(tx, evm_state, evm_tx=evm_tx)
+                results[i] = self.tx_queue.add_transaction(evm_tx, tx)
+            except Exception as e:
+                Logger.warning_every_sec("Failed to add transaction: {}".format(e), 1)
+        return results
 
     def _get_evm_state_for_new_block(self, block, ephemeral=True):
         state = self.__create_evm_state()
@@ -304,24 +373,22 @@ class ShardState:
         return state
 
     def __is_same_minor_chain(self, longer_block_header, shorter_block_header):
-        if shorter_block_header.height > longer_block_header.height:
-            return False
-
-        header = longer_block_header
-        for i in range(longer_block_header.height - shorter_block_header.height):
-            header = self.db.get_minor_block_header_by_hash(
-                header.hash_prev_minor_block
-            )
-        return header == shorter_block_header
+        return is_same_chain(
+            longer_block_header,
+            shorter_block_header,
+            self.db.get_minor_block_hash_by_height,
+            self.db.get_minor_block_header_by_hash,
+            lambda header: header.hash_prev_minor_block,
+        )
 
     def __is_same_root_chain(self, longer_block_header, shorter_block_header):
-        if shorter_block_header.height > longer_block_header.height:
-            return False
-
-        header = longer_block_header
-        for i in range(longer_block_header.height - shorter_block_header.height):
-            header = self.db.get_root_block_header_by_hash(header.hash_prev_block)
-        return header == shorter_block_header
+        return is_same_chain(
+            longer_block_header,
+            shorter_block_header,
+            self.db.get_root_block_hash_by_height,
+            self.db.get_root_block_header_by_hash,
+            lambda header: header.hash_prev_block,
+        )
 
     def __validate_block(self, block):
         """ Validate a block before running evm transactions
@@ -519,36 +586,116 @@ class ShardState:
                 break
             block = self.db.get_minor_block_by_hash(block.header.hash_prev_minor_block)
 
+        # the tx pool is updated once the batch is committed so that it is kept if the batch is discarded
         for block in old_chain:
             self.db.remove_transaction_index_from_block(block)
             self.db.remove_minor_block_index(block)
             if add_tx_back_to_queue:
-                self.__add_transactions_from_block(block)
+                self.db.after_commit(
+                    functools.partial(self.__add_transactions_from_block, block)
+                )
         for block in new_chain:
             self.db.put_transaction_index_from_block(block)
             self.db.put_minor_block_index(block)
-            self.__remove_transactions_from_block(block)
+            self.db.after_commit(
+                functools.partial(self.__remove_transactions_from_block, block)
+            )
+        self.db.update_bloom_bits_index(minor_block.header.height)
+        self.__move_flat_state(old_chain, new_chain, minor_block)
+
+    def __get_block_hashes_by_height(self, height):
+        """ Hashes of the block at height in the chain index and of the forks added since startup """
+        block_hashes = set(self.db.height_to_minor_block_hashes.get(height, set()))
+        block_hash = self.db.get_minor_block_hash_by_height(height)
+        if block_hash is not None:
+            block_hashes.add(block_hash)
+        return block_hashes
+
+    def __move_flat_state(self, old_chain, new_chain, minor_block):
+        """ Revert the blocks of old_chain from the flat state snapshot and apply the ones of new_chain.
+        The snapshot is generated again at the state of minor_block if it is not at the expected state
+        or a block diff is missing, e.g., for the blocks added before the snapshot existed.
+        """
+        if self.flat_state.root is None or (not old_chain and not new_chain):
+            return
+        old_chain = sorted(old_chain, key=lambda b: b.header.height, reverse=True)
+        if old_chain:
+            expected_root = old_chain[0].meta.hash_evm_state_root
+        else:
+            expected_root = self.db.get_minor_block_evm_root_hash_by_hash(
+                new_chain[-1].header.hash_prev_minor_block
+            )
+        moved = self.flat_state.root == expected_root
+        for block in old_chain:
+            if not moved:
+                break
+            moved = self.flat_state.revert_block(
+                block.header.get_hash(),
+                self.db.get_minor_block_evm_root_hash_by_hash(
+                    block.header.hash_prev_minor_block
+                ),
+            )
+        for block in reversed(new_chain):
+            if not moved:
+                break
+            moved = self.flat_state.apply_block(
+                block.header.get_hash(), block.meta.hash_evm_state_root
+            )
+        if not moved:
+            Logger.warning(
+                "[{}] Regenerating flat state snapshot at {}".format(
+                    self.shard_id, minor_block.header.height
+                )
+            )
+            self.flat_state_regenerated_count += 1
+            self.flat_state.generate(minor_block.meta.hash_evm_state_root)
 
     def __add_transactions_from_block(self, block):
         for tx in block.tx_list:
-            self.tx_dict[tx.get_hash()] = tx
-            self.tx_queue.add_transaction(tx.code.get_evm_transaction())
+            self.tx_queue.add_transaction(tx.code.get_evm_transaction(), tx)
 
     def __remove_transactions_from_block(self, block):
-        evm_tx_list = []
-        for tx in block.tx_list:
-            self.tx_dict.pop(tx.get_hash(), None)
-            evm_tx_list.append(tx.code.get_evm_transaction())
-        self.tx_queue = self.tx_queue.diff(evm_tx_list)
+        self.tx_queue.remove_transactions([tx.get_hash() for tx in block.tx_list])
+
+    def __get_tips(self):
+        return (
+            self.evm_state,
+            self.header_tip,
+            self.meta_tip,
+            self.root_tip,
+            self.confirmed_header_tip,
+        )
+
+    def __restore_tips(self, tips):
+        """ Restore the in-memory state saved by __get_tips() when the batch updating it is discarded """
+        (
+            self.evm_state,
+            self.header_tip,
+            self.meta_tip,
+            self.root_tip,
+            self.confirmed_header_tip,
+        ) = tips
 
     def add_block(self, block):
         """  Add a block to local db.  Perform validate and update tip accordingly
         Returns None if block is already added.
         Returns a list of CrossShardTransactionDeposit from block.
         Raises on any error.
+        All the db writes of the block (evm state, block, indexes) are committed atomically in a single batch.
+        The tips and the evm state are restored if the batch is discarded.
         """
-        start_time = time.time()
         start_ms = time_ms()
+        with self.db.write_batch():
+            self.db.on_discard(
+                functools.partial(self.__restore_tips, self.__get_tips())
+            )
+            xshard_list = self.__add_block(block)
+        if xshard_list is not None:
+            self.__log_block_propagation(block, start_ms)
+        return xshard_list
+
+    def __add_block(self, block):
+        start_time = time.time()
         if self.header_tip.height - block.header.height > 700:
             Logger.info(
                 "[{}] drop old block {} << {}".format(
@@ -563,6 +710,8 @@ class ShardState:
         x_shard_receive_tx_list = []
         # Throw exception if fail to run
         self.__validate_block(block)
+        if self.sender_recovery_pool:
+            self.sender_recovery_pool.recover_senders_sync(block.tx_list)
         evm_state = self.run_block(
             block,
             evm_tx_included=evm_tx_included,
@@ -576,7 +725,7 @@ class ShardState:
                 % (block.meta.hash_evm_state_root.hex(), evm_state.trie.root_hash.hex())
             )
 
-        receipt_root = mk_receipt_sha(evm_state.receipts, evm_state.db)
+        receipt_root = evm_state.get_receipt_root()
         if block.meta.hash_evm_receipt_root != receipt_root:
             raise ValueError(
                 "Receipt root mismatch: header {} computed {}".format(
@@ -611,7 +760,14 @@ class ShardState:
 
         # TODO: Add block reward to coinbase
         # self.reward_calc.get_block_reward(self):
-        self.db.put_minor_block(block, x_shard_receive_tx_list)
+        self.db.put_minor_block(
+            block,
+            x_shard_receive_tx_list,
+            receipt_list=block.create_receipt_list(evm_state.receipts),
+        )
+        self.flat_state.put_block_diff(
+            block.header.get_hash(), block.header.height, evm_state.flat_diff
+        )
 
         # Update tip if a block is appended or a fork is longer (with the same ancestor confirmed by root block tip)
         # or they are equal length but the root height confirmed by the block is longer
@@ -642,6 +798,10 @@ class ShardState:
             self.evm_state = evm_state
             self.header_tip = block.header
             self.meta_tip = block.meta
+            self.flat_state.prune(
+                self.header_tip.height - self.env.cluster_config.FLAT_STATE_DIFF_DEPTH,
+                self.__get_block_hashes_by_height,
+            )
 
         check(
             self.__is_same_root_chain(
@@ -656,7 +816,15 @@ class ShardState:
                 time.time() - start_time, len(block.tx_list)
             )
         )
-        if block.meta.extra_data.decode("utf-8") != "":
+        return evm_state.xshard_list
+
+    def __log_block_propagation(self, block, start_ms):
+        """ Send the propagation latency of a block carrying monitoring info in its extra data.
+        The extra data comes from peers, so it is not trusted to be well-formed.
+        """
+        if not block.meta.extra_data:
+            return
+        try:
             extra_data = json.loads(block.meta.extra_data.decode("utf-8"))
             sample = {
                 "time": time_ms() // 1000,
@@ -673,12 +841,19 @@ class ShardState:
                 "propagation_latency_ms": start_ms - extra_data.get("mined", 0),
                 "num_tx": len(block.tx_list),
             }
-            asyncio.ensure_future(
-                self.env.cluster_config.kafka_logger.log_kafka_sample_async(
-                    self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
-                )
+        except Exception as e:
+            Logger.warning_every_sec(
+                "[{}] Invalid monitoring extra data in minor block: {}".format(
+                    self.shard_id, e
+                ),
+                10,
             )
-        return evm_state.xshard_list
+            return
+        asyncio.ensure_future(
+            self.env.cluster_config.kafka_logger.log_kafka_sample_async(
+                self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
+            )
+        )
 
     def get_tip(self) -> MinorBlock:
         return self.db.get_minor_block_by_hash(self.header_tip.get_hash())
@@ -747,8 +922,7 @@ class ShardState:
         # TODO: add block reward
         # TODO: the current calculation is bogus and just serves as a placeholder.
         coinbase = 0
-        for tx_wrapper in self.tx_queue.peek():
-            tx = tx_wrapper.tx
+        for tx in self.tx_queue.get_evm_transactions():
             coinbase += tx.gasprice * tx.startgas
 
         if self.root_tip.get_hash() != self.header_tip.hash_prev_root_block:
@@ -805,8 +979,12 @@ class ShardState:
             )
         return results
 
-    def __add_transactions_to_block(self, block: MinorBlock, evm_state: EvmState):
-        """ Fill up the block tx list with tx from the tx queue"""
+    def __add_transactions_to_block(
+        self, block: MinorBlock, evm_state: EvmState, tx_merkle: MerkleAccumulator
+    ):
+        """ Fill up the block tx list with tx from the tx queue
+        The included txs are appended to tx_merkle and their receipts to the receipt trie of evm_state
+        """
         poped_txs = []
         xshard_tx_counters = defaultdict(int)
         xshard_tx_limits = self.__get_xshard_tx_limits(
@@ -837,14 +1015,13 @@ class ShardState:
                 tx = Transaction(code=Code.create_evm_code(evm_tx))
                 apply_transaction(evm_state, evm_tx, tx.get_hash())
                 block.add_tx(tx)
+                tx_merkle.append(tx)
                 poped_txs.append(evm_tx)
                 xshard_tx_counters[evm_tx.to_shard_id()] += 1
             except Exception as e:
                 Logger.warning_every_sec(
                     "Failed to include transaction: {}".format(e), 1
                 )
-                tx = Transaction(code=Code.create_evm_code(evm_tx))
-                self.tx_dict.pop(tx.get_hash(), None)
 
         # We don't want to drop the transactions if the mined block failed to be appended
         for evm_tx in poped_txs:
@@ -884,7 +1061,8 @@ class ShardState:
             ancestor_root_header=ancestor_root_header,
         ).get_hash()
 
-        self.__add_transactions_to_block(block, evm_state)
+        tx_merkle = MerkleAccumulator()
+        self.__add_transactions_to_block(block, evm_state, tx_merkle)
 
         # Put only half of block fee to coinbase address
         check(evm_state.get_balance(evm_state.block_coinbase) >= evm_state.block_fee)
@@ -895,7 +1073,7 @@ class ShardState:
 
         extra_data["creation_ms"] = time_ms() - extra_data["inception"]
         block.meta.extra_data = json.dumps(extra_data).encode("utf-8")
-        block.finalize(evm_state=evm_state)
+        block.finalize(evm_state=evm_state, tx_merkle=tx_merkle)
 
         end_time = time.time()
         Logger.debug(
@@ -935,7 +1113,16 @@ class ShardState:
         Make sure all cross shard tx lists of remote shards confirmed by the root block are in local db.
         Return True if the new block become head else False.
         Raise ValueError on any failure.
+        All the db writes of the block are committed atomically in a single batch.
+        The tips are restored if the batch is discarded.
         """
+        with self.db.write_batch():
+            self.db.on_discard(
+                functools.partial(self.__restore_tips, self.__get_tips())
+            )
+            return self.__add_root_block(root_block)
+
+    def __add_root_block(self, root_block):
         check(
             root_block.header.height
             > self.env.quark_chain_config.get_genesis_root_height(self.shard_id)
@@ -987,6 +1174,7 @@ class ShardState:
         if root_block.header.height > self.root_tip.height:
             # Switch to the longest root block
             self.root_tip = root_block.header
+            self.db.rewrite_root_block_index_to(self.root_tip)
             self.confirmed_header_tip = shard_header
 
             orig_header_tip = self.header_tip
@@ -1159,9 +1347,10 @@ class ShardState:
         block, index = self.db.get_transaction_by_hash(h)
         if block:
             return block, index
-        if h in self.tx_dict:
+        tx = self.tx_queue.get(h)
+        if tx:
             block = MinorBlock(MinorBlockHeader(), MinorBlockMeta())
-            block.tx_list.append(self.tx_dict[h])
+            block.tx_list.append(tx)
             return block, 0
         return None, None
 
@@ -1171,7 +1360,7 @@ class ShardState:
         block, index = self.db.get_transaction_by_hash(h)
         if not block:
             return None
-        receipt = block.get_receipt(self.evm_state.db, index)
+        receipt = self.db.get_receipt(block, index)
         if receipt.contract_address != Address.create_empty_account(0):
             address = receipt.contract_address
             check(
@@ -1186,8 +1375,7 @@ class ShardState:
 
         if start == bytes(1):  # get pending tx
             tx_list = []
-            for orderable_tx in self.tx_queue.txs + self.tx_queue.aside:
-                tx = orderable_tx.tx
+            for tx in self.tx_queue.get_evm_transactions():
                 if Address(tx.sender, tx.from_full_shard_id) == address:
                     tx_list.append(
                         TransactionDetail(
@@ -1222,12 +1410,21 @@ class ShardState:
                 last_block_time = self.header_tip.create_time - block.header.create_time
 
         check(stale_block_count >= 0)
+        tx_pool_stats = self.tx_queue.get_stats()
+        cache_stats = self.db.get_cache_stats().values()
         return ShardStats(
             branch=self.branch,
             height=self.header_tip.height,
             timestamp=self.header_tip.create_time,
             tx_count60s=tx_count,
             pending_tx_count=len(self.tx_queue),
+            pending_sender_count=tx_pool_stats["senders"],
+            tx_pool_replaced_count=tx_pool_stats["replaced"],
+            tx_pool_evicted_count=tx_pool_stats["evicted"],
+            flat_state_regenerated_count=self.flat_state_regenerated_count,
+            cache_hit_count=sum(stats["hits"] for stats in cache_stats),
+            cache_miss_count=sum(stats["misses"] for stats in cache_stats),
+            cache_eviction_count=sum(stats["evictions"] for stats in cache_stats),
             total_tx_count=self.db.get_total_tx_count(self.header_tip.get_hash()),
             block_count60s=block_count,
             stale_block_count60s=stale_block_count,
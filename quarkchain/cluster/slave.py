@@ -18,6 +18,7 @@ from quarkchain.cluster.protocol import (
 )
 from quarkchain.cluster.rpc import (
     AddMinorBlockHeaderRequest,
+    AddPendingTransactionListCommand,
     GetLogRequest,
     GetLogResponse,
     EstimateGasRequest,
@@ -63,6 +64,7 @@ from quarkchain.cluster.rpc import (
     GetTransactionReceiptResponse,
     SlaveInfo,
 )
+from quarkchain.cluster.sender_recovery import SenderRecoveryPool
 from quarkchain.cluster.shard import Shard, PeerShardConnection
 from quarkchain.core import Branch, Transaction, Address, Log
 from quarkchain.core import (
@@ -407,6 +409,10 @@ class MasterConnection(ClusterConnection):
                 )
                 check(len(block_chain) == len(blocks_to_download))
 
+                # master may request the minor blocks of several root blocks at once
+                check(
+                    await shard.wait_for_sync_dependencies(block_chain, peer_shard_conn)
+                )
                 await self.slave_server.add_block_list_for_sync(block_chain)
                 block_hash_list = block_hash_list[BLOCK_BATCH_SIZE:]
 
@@ -760,6 +766,10 @@ class SlaveServer:
         self.mining = False
 
         self.artificial_tx_config = None
+        self.sender_recovery_pool = SenderRecoveryPool(
+            self.env.cluster_config.SENDER_RECOVERY_WORKERS,
+            self.env.cluster_config.SENDER_RECOVERY_USE_PROCESSES,
+        )
         self.shards = dict()  # type: Dict[Branch, Shard]
         self.shutdown_in_progress = False
 
@@ -859,6 +869,7 @@ class SlaveServer:
             self.master.close()
         self.slave_connection_manager.close_all()
         self.server.close()
+        self.sender_recovery_pool.shutdown()
 
     def get_shutdown_future(self):
         return self.server.wait_closed()
@@ -878,6 +889,15 @@ class SlaveServer:
         check(resp.error_code == 0)
         self.artificial_tx_config = resp.artificial_tx_config
 
+    def send_pending_tx_list_to_master(self, tx_list):
+        """ Notify master about the txs from peers or the tx generator added to the tx pool,
+        which master does not see otherwise
+        """
+        self.master.write_command(
+            op=ClusterOp.ADD_PENDING_TRANSACTION_LIST_COMMAND,
+            cmd=AddPendingTransactionListCommand(tx_list),
+        )
+
     def __get_branch_to_add_xshard_tx_list_request(
         self, block_hash, xshard_tx_list, prev_root_height
     ):
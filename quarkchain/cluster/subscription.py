@@ -0,0 +1,95 @@
+import asyncio
+from typing import Callable, Dict, Optional, Set
+
+from quarkchain.core import MinorBlockHeader, RootBlock, Transaction
+
+
+class Subscription:
+    def __init__(
+        self, sub_id: int, event_type: str, match: Optional[Callable], params=None
+    ):
+        self.sub_id = sub_id
+        self.event_type = event_type
+        # returns whether an event should be sent, None to send all the events of the type
+        self.match = match
+        # parsed parameters of the subscription, e.g., the log filter
+        self.params = params
+
+
+class Subscriber:
+    """ The subscriptions of a websocket client and the events waiting to be sent to it.
+    When the queue is full, i.e., the client reads slower than the events arrive, the waiting
+    events are dropped and None is queued to tell the sender to disconnect the client.
+    """
+
+    def __init__(self, max_queue_size: int):
+        self.queue = asyncio.Queue(max_queue_size)
+        self.subscriptions = dict()  # type: Dict[int, Subscription]
+        self.closed = False
+
+    def put(self, subscription: Subscription, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((subscription, event))
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class SubscriptionManager:
+    """ Pushes the new blocks and txs of the master to the websocket subscribers """
+
+    NEW_ROOT_BLOCKS = "newRootBlocks"
+    NEW_MINOR_BLOCK_HEADERS = "newMinorBlockHeaders"
+    LOGS = "logs"  # the events are the minor block headers the logs are read from
+    PENDING_TRANSACTIONS = "pendingTransactions"
+    EVENT_TYPES = (NEW_ROOT_BLOCKS, NEW_MINOR_BLOCK_HEADERS, LOGS, PENDING_TRANSACTIONS)
+
+    def __init__(self):
+        self.subscribers = set()  # type: Set[Subscriber]
+        self.next_sub_id = 1
+
+    def add_subscriber(self, subscriber: Subscriber):
+        self.subscribers.add(subscriber)
+
+    def remove_subscriber(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def subscribe(
+        self, subscriber: Subscriber, event_type: str, match=None, params=None
+    ) -> int:
+        sub_id = self.next_sub_id
+        self.next_sub_id += 1
+        subscriber.subscriptions[sub_id] = Subscription(
+            sub_id, event_type, match, params
+        )
+        return sub_id
+
+    def unsubscribe(self, subscriber: Subscriber, sub_id: int) -> bool:
+        return subscriber.subscriptions.pop(sub_id, None) is not None
+
+    def __publish(self, event_types, event):
+        for subscriber in self.subscribers:
+            for subscription in list(subscriber.subscriptions.values()):
+                if subscription.event_type not in event_types:
+                    continue
+                if subscription.match is None or subscription.match(event):
+                    subscriber.put(subscription, event)
+
+    def notify_root_block(self, block: RootBlock):
+        self.__publish((self.NEW_ROOT_BLOCKS,), block)
+
+    def notify_minor_block_header(self, header: MinorBlockHeader):
+        self.__publish((self.NEW_MINOR_BLOCK_HEADERS, self.LOGS), header)
+
+    def notify_pending_transaction(self, tx: Transaction):
+        self.__publish((self.PENDING_TRANSACTIONS,), tx)
@@ -0,0 +1,73 @@
+import unittest
+
+from quarkchain.cluster.chain_index import is_same_chain
+
+
+class FakeHeader:
+    def __init__(self, height, block_hash, prev_hash):
+        self.height = height
+        self.block_hash = block_hash
+        self.prev_hash = prev_hash
+
+    def get_hash(self):
+        return self.block_hash
+
+
+class FakeChain:
+    def __init__(self):
+        self.headers = dict()
+        self.index = dict()
+        self.read_count = 0
+
+    def add_chain(self, parent, length, tag):
+        headers = []
+        for i in range(length):
+            height = parent.height + 1 if parent else 0
+            header = FakeHeader(
+                height, b"%s%d" % (tag, height), parent.get_hash() if parent else None
+            )
+            self.headers[header.get_hash()] = header
+            headers.append(header)
+            parent = header
+        return headers
+
+    def get_header(self, block_hash):
+        self.read_count += 1
+        return self.headers.get(block_hash)
+
+    def is_same_chain(self, longer, shorter):
+        return is_same_chain(
+            longer,
+            shorter,
+            self.index.get,
+            self.get_header,
+            lambda header: header.prev_hash,
+        )
+
+
+class TestIsSameChain(unittest.TestCase):
+    def setUp(self):
+        self.chain = FakeChain()
+        self.main = self.chain.add_chain(None, 1000, b"a")
+        self.fork = self.chain.add_chain(self.main[900], 10, b"b")
+        self.chain.index = {h.height: h.get_hash() for h in self.main}
+
+    def test_indexed_chain(self):
+        self.assertTrue(self.chain.is_same_chain(self.main[999], self.main[0]))
+        self.assertTrue(self.chain.is_same_chain(self.main[500], self.main[500]))
+        self.assertFalse(self.chain.is_same_chain(self.main[500], self.main[999]))
+        self.assertFalse(self.chain.is_same_chain(self.main[999], self.fork[0]))
+        self.assertEqual(self.chain.read_count, 0)
+
+    def test_fork(self):
+        self.assertTrue(self.chain.is_same_chain(self.fork[9], self.main[1]))
+        self.assertTrue(self.chain.is_same_chain(self.fork[9], self.fork[2]))
+        self.assertFalse(self.chain.is_same_chain(self.fork[9], self.main[950]))
+        # only the fork is walked
+        self.assertLessEqual(self.chain.read_count, 10 + 7 + 10)
+
+    def test_partial_index(self):
+        self.chain.index = {h.height: h.get_hash() for h in self.main[990:]}
+        self.assertTrue(self.chain.is_same_chain(self.main[999], self.main[10]))
+        self.assertFalse(self.chain.is_same_chain(self.main[999], self.fork[0]))
+        self.assertTrue(self.chain.is_same_chain(self.fork[5], self.main[3]))
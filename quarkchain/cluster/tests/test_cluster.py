@@ -1,5 +1,6 @@
 import unittest
 from quarkchain.genesis import GenesisManager
+from quarkchain.cluster.subscription import Subscriber, SubscriptionManager
 from quarkchain.cluster.tests.test_utils import (
     create_transfer_transaction,
     ClusterContext,
@@ -195,6 +196,11 @@ class TestCluster(unittest.TestCase):
         with ClusterContext(2, acc1) as clusters:
             master = clusters[0].master
             slaves = clusters[0].slave_list
+            # the txs received from peers are pending txs of the other cluster too
+            subscriber = Subscriber(max_queue_size=10)
+            manager = clusters[1].master.subscription_manager
+            manager.add_subscriber(subscriber)
+            manager.subscribe(subscriber, SubscriptionManager.PENDING_TRANSACTIONS)
 
             branch0 = Branch.create(2, 0)
             tx1 = create_transfer_transaction(
@@ -228,6 +234,13 @@ class TestCluster(unittest.TestCase):
             assert_true_with_timeout(lambda: len(tx_queue) == 1)
             self.assertEqual(tx_queue.pop_transaction(), tx2.code.get_evm_transaction())
 
+            assert_true_with_timeout(lambda: subscriber.queue.qsize() == 2)
+            pending_txs = set()
+            while not subscriber.queue.empty():
+                subscription, tx = subscriber.queue.get_nowait()
+                pending_txs.add(tx.get_hash())
+            self.assertEqual(pending_txs, {tx1.get_hash(), tx2.get_hash()})
+
     def test_add_minor_block_request_list(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1, full_shard_id=0)
@@ -120,3 +120,44 @@ class TestFilter(unittest.TestCase):
         f = self.filter_gen_with_criteria(criteria, addresses)
         logs = f._get_logs([self.hit_block])
         self.assertEqual([self.log], logs)
+
+    def test_get_block_candidates_legacy_db(self):
+        # blocks below the start height of the bloom bits index are scanned one by one
+        for start in (self.start_height, self.start_height + 1):
+            self.state.db.db.remove(b"bloombits_start")
+            self.state.db.init_bloom_bits_index(start)
+            f = self.filter_gen_with_criteria([[self.log.topics[0]]])
+            blocks = f._get_block_candidates()
+            self.assertEqual(len(blocks), 1)
+            self.assertEqual(blocks[0].header.height, self.start_height)
+
+    def test_bloom_bits_index(self):
+        db = self.state.db
+        criteria = [[tp] for tp in self.log.topics]
+        db.BLOOM_BITS_SECTION_SIZE = 8
+        db.BLOOM_BITS_CONFIRMATIONS = 2
+        # the chain is not far enough past the second section
+        for _ in range(3):
+            db.update_bloom_bits_index(self.state.header_tip.height)
+        self.assertEqual(db.get_bloom_bits_indexed_range(), (0, 8))
+        self.assertEqual(
+            db.get_heights_by_bloom_bits(
+                self.filter_gen_with_criteria(criteria).bloom_bits, 0, 7
+            ),
+            [self.start_height],
+        )
+        # the candidates are found in the indexed section and the scanned heights after it
+        f = self.filter_gen_with_criteria(criteria)
+        self.assertEqual(
+            [b.header.height for b in f._get_block_candidates()], [self.start_height]
+        )
+
+        # a reorg of an indexed height makes its section be indexed again
+        db.invalidate_bloom_bits_index(self.start_height)
+        self.assertEqual(db.get_bloom_bits_indexed_range(), (0, 0))
+        f = self.filter_gen_with_criteria(criteria)
+        self.assertEqual(
+            [b.header.height for b in f._get_block_candidates()], [self.start_height]
+        )
+        db.update_bloom_bits_index(self.state.header_tip.height)
+        self.assertEqual(db.get_bloom_bits_indexed_range(), (0, 8))
@@ -8,6 +8,7 @@ from jsonrpcclient.aiohttp_client import aiohttpClient
 
 from quarkchain.cluster.cluster_config import ClusterConfig
 from quarkchain.cluster.jsonrpc import JSONRPCServer, quantity_encoder
+from quarkchain.cluster.rpc_metrics import RpcMetrics
 from quarkchain.cluster.tests.test_utils import (
     create_transfer_transaction,
     ClusterContext,
@@ -700,6 +701,59 @@ class TestJSONRPC(unittest.TestCase):
                         resp[0]["topics"][0],
                     )
 
+    def test_getLogs_all_shards(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_id=0)
+
+        with ClusterContext(1, acc1) as clusters, jrpc_server_context(
+            clusters[0].master
+        ):
+            master = clusters[0].master
+            slaves = clusters[0].slave_list
+
+            branch = Branch.create(2, 0)
+            tx = create_contract_creation_with_event_transaction(
+                shard_state=slaves[0].shards[branch].state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_full_shard_id=acc1.full_shard_id,
+            )
+            self.assertTrue(slaves[0].add_tx(tx))
+
+            _, block = call_async(master.get_next_block_to_mine(address=acc1))
+            self.assertTrue(call_async(clusters[0].get_shard(0).add_block(block)))
+
+            contract_addr = mk_contract_address(acc1.recipient, acc1.full_shard_id, 0)
+            for method, filter_obj in (
+                ("getLogs", {}),
+                ("eth_getLogs", {}),
+                (
+                    "getLogs",
+                    {
+                        "address": "0x"
+                        + contract_addr.hex()
+                        + hex(acc1.full_shard_id)[2:].zfill(8)
+                    },
+                ),
+                ("eth_getLogs", {"address": "0x" + contract_addr.hex()}),
+            ):
+                # no shard specified, query all the shards
+                resp = send_request(method, filter_obj)
+                self.assertEqual(1, len(resp))
+                self.assertEqual("0x1", resp[0]["blockHeight"])
+
+            # contract not in shard 1
+            resp = send_request(
+                "getLogs",
+                {"address": "0x" + contract_addr.hex() + hex(1)[2:].zfill(8)},
+            )
+            self.assertEqual(0, len(resp))
+
+            # an invalid shard is rejected instead of querying all the shards
+            for method in ("getLogs", "eth_getLogs"):
+                with self.assertRaises(Exception):
+                    send_request(method, {}, "not a shard")
+
     def test_estimateGas(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1, full_shard_id=0)
@@ -841,3 +895,53 @@ class TestJSONRPC(unittest.TestCase):
                     resp = send_request("gasPrice", "0x0")
 
                 self.assertEqual(resp, "0xc")
+
+    def test_batch_request(self):
+        async def post(data):
+            async with aiohttp.ClientSession(loop=asyncio.get_event_loop()) as session:
+                async with session.post("http://localhost:38391", json=data) as resp:
+                    return await resp.json()
+
+        with jrpc_server_context(None) as server:
+            batch = [
+                {
+                    "jsonrpc": "2.0",
+                    "method": "echoQuantity",
+                    "params": [quantity_encoder(i)],
+                    "id": i,
+                }
+                for i in range(5)
+            ]
+            # notification without a response
+            batch.append({"jsonrpc": "2.0", "method": "echoData", "params": ["0x01"]})
+            resp = call_async(post(batch))
+            self.assertEqual(
+                [r["result"] for r in resp], [quantity_encoder(i) for i in range(5)]
+            )
+            self.assertEqual(server.counters["echoQuantity"], 5)
+            self.assertEqual(server.counters["echoData"], 1)
+
+    def test_metrics_on_private_server(self):
+        async def get(port):
+            async with aiohttp.ClientSession(loop=asyncio.get_event_loop()) as session:
+                async with session.get(
+                    "http://localhost:{}/metrics".format(port)
+                ) as resp:
+                    return resp.status, await resp.text()
+
+        env = DEFAULT_ENV.copy()
+        env.cluster_config = ClusterConfig()
+        metrics = RpcMetrics("qkc_jsonrpc")
+        public_server = JSONRPCServer.start_public_server(env, None, metrics)
+        private_server = JSONRPCServer.start_private_server(env, None, metrics)
+        try:
+            self.assertEqual(send_request("echoQuantity", "0x1"), "0x1")
+            status, _ = call_async(get(env.cluster_config.JSON_RPC_PORT))
+            self.assertEqual(status, 404)
+            # the calls to the public server are reported by the private one
+            status, text = call_async(get(env.cluster_config.PRIVATE_JSON_RPC_PORT))
+            self.assertEqual(status, 200)
+            self.assertIn('qkc_jsonrpc_requests_total{method="echoQuantity"} 1', text)
+        finally:
+            public_server.shutdown()
+            private_server.shutdown()
@@ -1,11 +1,12 @@
 import asyncio
 import unittest
-from unittest.mock import call, MagicMock
+from unittest.mock import MagicMock
 
 from quarkchain.cluster.protocol import ClusterConnection, P2PConnection
 from quarkchain.cluster.protocol import ClusterMetadata, P2PMetadata
 from quarkchain.env import DEFAULT_ENV
 from quarkchain.core import uint32, Branch, Serializable
+from quarkchain.protocol import Connection
 
 FORWARD_BRANCH = Branch(123)
 EMPTY_BRANCH = Branch(456)
@@ -76,7 +77,7 @@ class TestP2PConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyP2PConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
@@ -98,15 +99,15 @@ class TestP2PConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyP2PConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
+        # let the buffered response be flushed
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
 
         conn.mockClusterConnection.write_raw_data.assert_not_called()
-        writer.write.assert_has_calls(
-            [call(requestSizeBytes), call(metaBytes), call(rawData)]
-        )
+        writer.write.assert_called_once_with(requestSizeBytes + metaBytes + rawData)
 
 
 class TestClusterConnection(unittest.TestCase):
@@ -123,7 +124,7 @@ class TestClusterConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyClusterConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
@@ -145,12 +146,70 @@ class TestClusterConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyClusterConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
+        # let the buffered response be flushed
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
 
         conn.mockP2PConnection.write_raw_data.assert_not_called()
-        writer.write.assert_has_calls(
-            [call(requestSizeBytes), call(metaBytes), call(rawData)]
+        writer.write.assert_called_once_with(requestSizeBytes + metaBytes + rawData)
+
+
+class TestConnection(unittest.TestCase):
+    def test_coalesced_writes(self):
+        reader = AsyncMock()
+        writer = MagicMock()
+        conn = Connection(DEFAULT_ENV, reader, writer, OP_SER_MAP, {}, OP_RPC_MAP)
+        conn.write_command(OP, DummyPackage(1), rpc_id=1)
+        conn.write_command(OP, DummyPackage(2), rpc_id=2)
+        writer.write.assert_not_called()
+
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+        frames = b"".join(
+            len(DummyPackage(i).serialize()).to_bytes(4, byteorder="big")
+            + bytes([OP])
+            + i.to_bytes(8, byteorder="big")
+            + DummyPackage(i).serialize()
+            for i in (1, 2)
+        )
+        writer.write.assert_called_once_with(frames)
+
+        # read back the frames written
+        self.assertEqual(len(frames), 34)
+        reader.readexactly.side_effect = [
+            frames[:4],
+            frames[4:17],
+            frames[17:21],
+            frames[21:],
+        ]
+        for raw_frame in (frames[4:17], frames[21:]):
+            _, raw_data = asyncio.get_event_loop().run_until_complete(
+                conn.read_metadata_and_raw_data()
+            )
+            self.assertEqual(raw_data, raw_frame)
+
+    def test_eof(self):
+        reader = AsyncMock()
+        writer = MagicMock()
+        conn = Connection(DEFAULT_ENV, reader, writer, OP_SER_MAP, {}, OP_RPC_MAP)
+        conn.write_command(OP, DummyPackage(1), rpc_id=1)
+        reader.readexactly.side_effect = asyncio.IncompleteReadError(b"", 4)
+        self.assertEqual(
+            asyncio.get_event_loop().run_until_complete(
+                conn.read_metadata_and_raw_data()
+            ),
+            (None, None),
         )
+        # the buffered frame is sent before the connection is closed
+        self.assertTrue(conn.is_closed())
+        writer.write.assert_called_once()
+        writer.close.assert_called_once()
+
+        conn = Connection(DEFAULT_ENV, reader, writer, OP_SER_MAP, {}, OP_RPC_MAP)
+        reader.readexactly.side_effect = asyncio.IncompleteReadError(b"\x00", 4)
+        with self.assertRaises(RuntimeError):
+            asyncio.get_event_loop().run_until_complete(
+                conn.read_metadata_and_raw_data()
+            )
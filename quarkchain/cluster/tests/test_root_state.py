@@ -230,6 +230,11 @@ class TestRootState(unittest.TestCase):
         self.assertEqual(s_states[0].root_tip, root_block2.header)
         self.assertEqual(s_states[1].root_tip, root_block2.header)
 
+        # the height index is rewritten to the fork
+        self.assertEqual(r_state.get_root_block_by_height(1), root_block1)
+        self.assertEqual(r_state.get_root_block_by_height(2), root_block2)
+        self.assertEqual(r_state.db.get(b"ri_1"), root_block1.header.get_hash())
+
     def test_root_state_difficulty(self):
         env = get_test_env()
         env.quark_chain_config.SKIP_ROOT_DIFFICULTY_CHECK = False
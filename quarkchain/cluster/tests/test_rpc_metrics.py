@@ -0,0 +1,46 @@
+import unittest
+
+from quarkchain.cluster.rpc_metrics import RpcMetrics
+
+
+class TestRpcMetrics(unittest.TestCase):
+    def test_metrics(self):
+        metrics = RpcMetrics("qkc_test")
+        metrics.start("getBalance", 100)
+        metrics.start("getBalance", 100)
+        self.assertEqual(metrics.methods["getBalance"].in_flight, 2)
+        metrics.finish("getBalance", 0.002, 50)
+        metrics.finish("getBalance", 10, 30, error=True)
+
+        d = metrics.to_dict()["getBalance"]
+        self.assertEqual(d["count"], 2)
+        self.assertEqual(d["errors"], 1)
+        self.assertEqual(d["inFlight"], 0)
+        self.assertEqual(d["requestBytes"], 200)
+        self.assertEqual(d["responseBytes"], 80)
+        self.assertEqual(d["latencyBuckets"]["0.005"], 1)
+        self.assertEqual(d["latencyBuckets"]["+Inf"], 1)
+        self.assertEqual(metrics.get_counts(), {"getBalance": 2})
+
+    def test_prometheus(self):
+        metrics = RpcMetrics("qkc_test")
+        metrics.start("gasPrice", 10)
+        metrics.finish("gasPrice", 0.02, 5)
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn("# TYPE qkc_test_requests_total counter", lines)
+        self.assertIn('qkc_test_requests_total{method="gasPrice"} 1', lines)
+        self.assertIn('qkc_test_in_flight{method="gasPrice"} 0', lines)
+        # the buckets are cumulative
+        self.assertIn(
+            'qkc_test_request_duration_seconds_bucket{method="gasPrice",le="0.01"} 0',
+            lines,
+        )
+        self.assertIn(
+            'qkc_test_request_duration_seconds_bucket{method="gasPrice",le="0.05"} 1',
+            lines,
+        )
+        self.assertIn(
+            'qkc_test_request_duration_seconds_bucket{method="gasPrice",le="+Inf"} 1',
+            lines,
+        )
+        self.assertIn('qkc_test_request_duration_seconds_count{method="gasPrice"} 1', lines)
@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+
+from quarkchain.cluster.sender_recovery import SenderRecoveryPool
+from quarkchain.core import Identity, Address, Code, Transaction
+from quarkchain.evm.transactions import Transaction as EvmTransaction, secpk1n
+
+
+def create_tx_list(n):
+    tx_list, sender_list = [], []
+    for i in range(n):
+        id1 = Identity.create_random_identity()
+        evm_tx = EvmTransaction(
+            nonce=i,
+            gasprice=1,
+            startgas=21000,
+            to=Address.create_random_account().recipient,
+            value=1,
+            data=b"",
+            from_full_shard_id=0,
+            to_full_shard_id=0,
+            network_id=1,
+        )
+        evm_tx.sign(key=id1.get_key())
+        tx_list.append(
+            Transaction(in_list=[], code=Code.create_evm_code(evm_tx), out_list=[])
+        )
+        sender_list.append(id1.get_recipient())
+    return tx_list, sender_list
+
+
+class TestSenderRecoveryPool(unittest.TestCase):
+    def test_code_sender_cache(self):
+        tx_list, sender_list = create_tx_list(1)
+        code = tx_list[0].code
+        self.assertIsNone(code.get_evm_sender())
+        code.set_evm_sender(sender_list[0])
+        self.assertEqual(code.get_evm_transaction()._sender, sender_list[0])
+        # invalidated by changing the code
+        code.code = code.code + b"\0"
+        self.assertIsNone(code.get_evm_sender())
+
+    def test_recover_senders(self):
+        for use_processes in (False, True):
+            pool = SenderRecoveryPool(num_workers=2, use_processes=use_processes)
+            tx_list, sender_list = create_tx_list(5)
+            # invalid signature
+            evm_tx = tx_list[4].code.get_evm_transaction()
+            evm_tx = EvmTransaction(
+                evm_tx.nonce,
+                evm_tx.gasprice,
+                evm_tx.startgas,
+                evm_tx.to,
+                evm_tx.value,
+                evm_tx.data,
+                v=27,
+                r=secpk1n,
+                s=1,
+                from_full_shard_id=0,
+                to_full_shard_id=0,
+                network_id=1,
+            )
+            tx_list[4].code = Code.create_evm_code(evm_tx)
+
+            asyncio.get_event_loop().run_until_complete(pool.recover_senders(tx_list))
+            for tx, sender in zip(tx_list[:4], sender_list):
+                self.assertEqual(tx.code.get_evm_sender(), sender)
+                self.assertEqual(tx.code.get_evm_transaction()._sender, sender)
+            self.assertIsNone(tx_list[4].code.get_evm_sender())
+
+            tx_list, sender_list = create_tx_list(3)
+            pool.recover_senders_sync(tx_list)
+            self.assertEqual([tx.code.get_evm_sender() for tx in tx_list], sender_list)
+            pool.shutdown()
+
+    def test_no_workers(self):
+        pool = SenderRecoveryPool()
+        tx_list, _ = create_tx_list(1)
+        pool.recover_senders_sync(tx_list)
+        self.assertIsNone(tx_list[0].code.get_evm_sender())
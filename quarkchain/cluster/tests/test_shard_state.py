@@ -5,11 +5,15 @@ from quarkchain.cluster.shard_state import ShardState
 from quarkchain.cluster.tests.test_utils import (
     get_test_env,
     create_transfer_transaction,
+    create_contract_with_storage_transaction,
 )
 from quarkchain.core import CrossShardTransactionDeposit, CrossShardTransactionList
 from quarkchain.core import Identity, Address
 from quarkchain.diff import EthDifficultyCalculator
 from quarkchain.evm import opcodes
+from quarkchain.evm.flat_state import ACCOUNT_PREFIX, KEY_RANGE_END, STORAGE_PREFIX
+from quarkchain.evm.flat_state import DIFF_PREFIX, UNDO_PREFIX
+from quarkchain.evm.messages import mk_contract_address
 from quarkchain.genesis import GenesisManager
 
 
@@ -97,6 +101,79 @@ class TestShardState(unittest.TestCase):
         res = state.execute_tx(tx, acc1)
         self.assertEqual(res, b"")
 
+    def test_evm_state_ephemeral_clone(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_id=0)
+        acc2 = Address.create_random_account(full_shard_id=0)
+        env = get_test_env(genesis_account=acc1, genesis_minor_quarkash=10000000)
+        state = create_default_shard_state(env=env)
+        evm_state = state.evm_state
+
+        # account cached in the parent is copied to the clone
+        self.assertEqual(evm_state.get_balance(acc1.recipient), 10000000)
+        clone = evm_state.ephemeral_clone()
+        self.assertEqual(clone.get_balance(acc1.recipient), 10000000)
+        clone.delta_balance(acc1.recipient, -100)
+        clone.delta_balance(acc2.recipient, 100)
+        clone.commit()
+        self.assertEqual(clone.get_balance(acc1.recipient), 10000000 - 100)
+        self.assertEqual(clone.get_balance(acc2.recipient), 100)
+        # nested clone sees the committed changes of its parent
+        self.assertEqual(
+            clone.ephemeral_clone().get_balance(acc1.recipient), 10000000 - 100
+        )
+
+        # the parent is not affected
+        self.assertEqual(evm_state.get_balance(acc1.recipient), 10000000)
+        self.assertEqual(evm_state.get_balance(acc2.recipient), 0)
+
+        # uncommitted changes of the parent are not visible in the clone
+        evm_state.delta_balance(acc1.recipient, 1)
+        self.assertEqual(
+            evm_state.ephemeral_clone().get_balance(acc1.recipient), 10000000
+        )
+
+    def test_add_tx_list(self):
+        id_list = [Identity.create_random_identity() for _ in range(3)]
+        acc_list = [Address.create_from_identity(i, full_shard_id=0) for i in id_list]
+        acc3 = Address.create_random_account(full_shard_id=0)
+        env = get_test_env(genesis_account=acc_list[0], genesis_minor_quarkash=10000000)
+        state = create_default_shard_state(env=env)
+
+        tx0 = create_transfer_transaction(
+            shard_state=state,
+            key=id_list[0].get_key(),
+            from_address=acc_list[0],
+            to_address=acc3,
+            value=12345,
+        )
+        self.assertTrue(state.add_tx(tx0))
+        b = state.create_block_to_mine(address=acc3)
+        state.finalize_and_add_block(b)
+
+        tx1 = create_transfer_transaction(
+            shard_state=state,
+            key=id_list[0].get_key(),
+            from_address=acc_list[0],
+            to_address=acc3,
+            value=12345,
+        )
+        # not funded
+        tx2 = create_transfer_transaction(
+            shard_state=state,
+            key=id_list[1].get_key(),
+            from_address=acc_list[1],
+            to_address=acc3,
+            value=12345,
+        )
+        self.assertEqual(
+            state.add_tx_list([tx0, tx1, tx2, tx1]), [False, True, False, False]
+        )
+        self.assertEqual(len(state.tx_queue), 1)
+        self.assertIn(tx1.get_hash(), state.tx_queue)
+        # already in the queue
+        self.assertEqual(state.add_tx_list([tx1]), [False])
+
     def test_add_tx_incorrect_from_shard_id(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1, full_shard_id=1)
@@ -172,6 +249,11 @@ class TestShardState(unittest.TestCase):
         self.assertEqual(i, 0)
         self.assertEqual(r.success, b"\x01")
         self.assertEqual(r.gas_used, 21000)
+        # the receipts stored with the block match the receipt trie
+        state.db.m_receipt_cache.clear()
+        self.assertEqual(
+            state.db.get_receipt_list(b1), [b1.get_receipt(state.evm_state.db, 0)]
+        )
 
         # Check Account has full_shard_id
         self.assertEqual(
@@ -182,6 +264,14 @@ class TestShardState(unittest.TestCase):
         self.assertEqual(tx_list[0].value, 12345)
         tx_list, _ = state.db.get_transactions_by_address(acc2)
         self.assertEqual(tx_list[0].value, 12345)
+        # the details are stored in the index and the block is not read
+        state.db.m_block_cache.clear()
+        state.db.m_receipt_cache.clear()
+        tx_list, _ = state.db.get_transactions_by_address(acc2)
+        self.assertEqual(tx_list[0].tx_hash, tx.get_hash())
+        self.assertEqual(tx_list[0].block_height, b1.header.height)
+        self.assertTrue(tx_list[0].success)
+        self.assertEqual(len(state.db.m_block_cache), 0)
 
     def test_duplicated_tx(self):
         id1 = Identity.create_random_identity()
@@ -203,7 +293,7 @@ class TestShardState(unittest.TestCase):
         self.assertFalse(state.add_tx(tx))  # already in tx_queue
 
         self.assertEqual(len(state.tx_queue), 1)
-        self.assertEqual(len(state.tx_dict), 1)
+        self.assertEqual(state.tx_queue.get(tx.get_hash()), tx)
 
         block, i = state.get_transaction_by_hash(tx.get_hash())
         self.assertEqual(len(block.tx_list), 1)
@@ -312,7 +402,7 @@ class TestShardState(unittest.TestCase):
         b1 = state.create_block_to_mine(address=acc3)
         self.assertEqual(len(b1.tx_list), 0)
 
-        # inshard tx
+        # inshard tx, replacing the xshard tx with the same nonce by paying more
         tx = create_transfer_transaction(
             shard_state=state,
             key=id1.get_key(),
@@ -320,6 +410,7 @@ class TestShardState(unittest.TestCase):
             to_address=acc3,
             value=12345,
             gas=50000,
+            gas_price=2,
         )
         self.assertTrue(state.add_tx(tx))
 
@@ -505,6 +596,167 @@ class TestShardState(unittest.TestCase):
         # b0-b3-b4 becomes the best chain
         self.assertEqual(len(state.tx_queue), 0)
 
+    def test_flat_state_follows_reorg(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_id=0)
+        acc2 = Address.create_random_account(full_shard_id=0)
+
+        env = get_test_env(genesis_account=acc1, genesis_minor_quarkash=10000000)
+        state = create_default_shard_state(env=env)
+
+        def get_flat_kv():
+            kv = dict()
+            for prefix in [ACCOUNT_PREFIX, STORAGE_PREFIX]:
+                kv.update(state.raw_db.range_iter(prefix, prefix + KEY_RANGE_END))
+            return kv
+
+        def assert_flat_state_synced():
+            self.assertEqual(state.flat_state.root, state.meta_tip.hash_evm_state_root)
+            kv = get_flat_kv()
+            state.flat_state.generate(state.flat_state.root)
+            self.assertEqual(kv, get_flat_kv())
+
+        assert_flat_state_synced()
+        contract = mk_contract_address(acc1.recipient, acc1.full_shard_id, 0)
+        state.add_tx(
+            create_contract_with_storage_transaction(
+                shard_state=state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_full_shard_id=acc1.full_shard_id,
+            )
+        )
+        b0 = state.create_block_to_mine(address=acc2)
+        b1 = state.create_block_to_mine(address=acc2)
+        b1.tx_list = []
+        state.finalize_and_add_block(b0)
+        assert_flat_state_synced()
+        self.assertEqual(state.get_storage_at(contract, 0), (1234).to_bytes(32, "big"))
+
+        # b1-b2 reverts the contract creation
+        state.finalize_and_add_block(b1)
+        b2 = b1.create_block_to_append(address=acc2)
+        state.finalize_and_add_block(b2)
+        self.assertEqual(state.header_tip, b2.header)
+        assert_flat_state_synced()
+        self.assertEqual(state.get_storage_at(contract, 0), bytes(32))
+
+        # b0-b3-b4 applies it again
+        b3 = b0.create_block_to_append(address=acc2)
+        state.finalize_and_add_block(b3)
+        b4 = b3.create_block_to_append(address=acc2)
+        state.finalize_and_add_block(b4)
+        self.assertEqual(state.header_tip, b4.header)
+        assert_flat_state_synced()
+        self.assertEqual(state.get_storage_at(contract, 0), (1234).to_bytes(32, "big"))
+
+    def test_flat_state_diffs_pruned(self):
+        env = get_test_env()
+        env.cluster_config.FLAT_STATE_DIFF_DEPTH = 2
+        state = create_default_shard_state(env=env)
+        blocks = []
+        for i in range(5):
+            b = state.get_tip().create_block_to_append()
+            state.finalize_and_add_block(b)
+            blocks.append(b)
+        # a fork below the pruned height does not keep its diff
+        fork = state.db.get_minor_block_by_height(0).create_block_to_append(
+            create_time=100
+        )
+        state.finalize_and_add_block(fork)
+        b = state.get_tip().create_block_to_append()
+        state.finalize_and_add_block(b)
+        blocks.append(b)
+
+        # the tip is at height 6 and the diffs below height 4 are deleted
+        for block in blocks[:3] + [fork]:
+            block_hash = block.header.get_hash()
+            self.assertNotIn(DIFF_PREFIX + block_hash, state.raw_db)
+            self.assertNotIn(UNDO_PREFIX + block_hash, state.raw_db)
+        for block in blocks[3:]:
+            block_hash = block.header.get_hash()
+            self.assertIn(DIFF_PREFIX + block_hash, state.raw_db)
+            self.assertIn(UNDO_PREFIX + block_hash, state.raw_db)
+
+    def test_flat_state_root_after_discarded_batch(self):
+        env = get_test_env()
+        state = create_default_shard_state(env=env)
+        genesis = state.get_tip()
+        b1 = genesis.create_block_to_append()
+        b1.finalize(evm_state=state.run_block(b1))
+        with self.assertRaises(RuntimeError):
+            with state.db.write_batch():
+                state.add_block(b1)
+                raise RuntimeError()
+        self.assertEqual(state.flat_state.root, genesis.meta.hash_evm_state_root)
+
+    def test_flat_state_regenerated(self):
+        env = get_test_env()
+        state = create_default_shard_state(env=env)
+        genesis = state.get_tip()
+        b1 = genesis.create_block_to_append()
+        state.finalize_and_add_block(b1)
+        # b1 cannot be reverted from the snapshot without its undo
+        state.raw_db.remove(UNDO_PREFIX + b1.header.get_hash())
+
+        b2 = genesis.create_block_to_append(create_time=b1.header.create_time + 1)
+        state.finalize_and_add_block(b2)
+        b3 = b2.create_block_to_append()
+        state.finalize_and_add_block(b3)
+        self.assertEqual(state.header_tip, b3.header)
+        self.assertEqual(state.flat_state.root, b3.meta.hash_evm_state_root)
+        self.assertEqual(state.flat_state_regenerated_count, 1)
+        self.assertEqual(state.get_shard_stats().flat_state_regenerated_count, 1)
+
+    def test_flat_state_reads_after_commit(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_id=0)
+        acc2 = Address.create_random_account(full_shard_id=0)
+        acc3 = Address.create_random_account(full_shard_id=0)
+
+        env = get_test_env(genesis_account=acc1, genesis_minor_quarkash=10000000)
+        state = create_default_shard_state(env=env)
+        for i, to_address in enumerate([acc2, acc3]):
+            state.add_tx(
+                create_transfer_transaction(
+                    shard_state=state,
+                    key=id1.get_key(),
+                    from_address=acc1,
+                    to_address=to_address,
+                    value=12345,
+                    nonce=i,
+                )
+            )
+        b1 = state.create_block_to_mine(address=acc1)
+        self.assertEqual(len(b1.tx_list), 2)
+
+        flat_reads = []
+        get_account = state.flat_state.get_account
+
+        def record_flat_read(address):
+            flat_reads.append(address)
+            return get_account(address)
+
+        state.flat_state.get_account = record_flat_read
+        evm_state = state.run_block(b1)
+        # acc3 is first read by the second tx after the first one is committed
+        self.assertIn(acc3.recipient, flat_reads)
+        self.assertEqual(evm_state.get_balance(acc3.recipient), 12345)
+
+        b1.finalize(evm_state=evm_state)
+        state.add_block(b1)
+        self.assertEqual(state.get_balance(acc3.recipient), 12345)
+
+    def test_cache_stats(self):
+        env = get_test_env()
+        state = create_default_shard_state(env=env)
+        b1 = state.get_tip().create_block_to_append()
+        state.finalize_and_add_block(b1)
+        state.db.get_minor_block_by_hash(b1.header.get_hash())
+        stats = state.get_shard_stats()
+        self.assertGreater(stats.cache_hit_count, 0)
+        self.assertEqual(stats.cache_eviction_count, 0)
+
     def test_stale_block_count(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1, full_shard_id=0)
@@ -1150,6 +1402,69 @@ class TestShardState(unittest.TestCase):
             recoveredState.evm_state.trie.root_hash, blockMetas[4].hash_evm_state_root
         )
 
+    def test_add_block_with_invalid_extra_data(self):
+        env = get_test_env()
+        state = create_default_shard_state(env=env)
+        b1 = state.get_tip().create_block_to_append(extra_data=b"not json")
+        state.finalize_and_add_block(b1)
+        self.assertEqual(state.header_tip, b1.header)
+        self.assertEqual(state.get_tip(), b1)
+
+    def test_add_block_in_discarded_batch(self):
+        env = get_test_env()
+        state = create_default_shard_state(env=env)
+        genesis = state.get_tip()
+        b1 = genesis.create_block_to_append()
+        b1.finalize(evm_state=state.run_block(b1))
+        with self.assertRaises(RuntimeError):
+            with state.db.write_batch():
+                state.add_block(b1)
+                self.assertEqual(state.header_tip, b1.header)
+                raise RuntimeError()
+
+        # the in-memory state follows the db
+        self.assertEqual(state.header_tip, genesis.header)
+        self.assertEqual(state.get_tip(), genesis)
+        self.assertFalse(state.db.contain_minor_block_by_hash(b1.header.get_hash()))
+        self.assertIsNone(
+            state.db.get_minor_block_header_by_hash(b1.header.get_hash())
+        )
+        self.assertNotIn(b1.header.get_hash(), state.db.m_receipt_cache)
+
+        # and the block can be added again
+        state.add_block(b1)
+        self.assertEqual(state.header_tip, b1.header)
+        self.assertEqual(state.get_tip(), b1)
+
+    def test_tx_pool_after_discarded_batch(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_id=0)
+        acc2 = Address.create_random_account(full_shard_id=0)
+
+        env = get_test_env(genesis_account=acc1, genesis_minor_quarkash=10000000)
+        state = create_default_shard_state(env=env)
+        state.add_tx(
+            create_transfer_transaction(
+                shard_state=state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_address=acc2,
+                value=12345,
+            )
+        )
+        b1 = state.create_block_to_mine(address=acc2)
+        self.assertEqual(len(b1.tx_list), 1)
+        b1.finalize(evm_state=state.run_block(b1))
+        with self.assertRaises(RuntimeError):
+            with state.db.write_batch():
+                state.add_block(b1)
+                raise RuntimeError()
+        # the tx included by the discarded block stays in the pool
+        self.assertEqual(len(state.tx_queue), 1)
+
+        state.add_block(b1)
+        self.assertEqual(len(state.tx_queue), 0)
+
     def test_add_block_receipt_root_not_match(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1)
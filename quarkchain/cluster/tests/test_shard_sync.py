@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+
+from quarkchain.cluster.p2p_commands import (
+    CommandOp,
+    GetMinorBlockHeaderListResponse,
+    GetMinorBlockListResponse,
+)
+from quarkchain.cluster.shard import SyncTask
+from quarkchain.cluster.tests.test_shard_state import create_default_shard_state
+from quarkchain.cluster.tests.test_utils import get_test_env
+from quarkchain.utils import call_async
+
+
+class FakeShard:
+    def __init__(self, state):
+        self.state = state
+        self.peers = dict()
+
+    async def add_block(self, block):
+        self.state.add_block(block)
+        return True
+
+
+class FakePeerShardConnection:
+    """ Serves the blocks of source_state like a PeerShardConnection """
+
+    def __init__(self, shard, source_state, cluster_peer_id, drop_blocks=False):
+        self.shard = shard
+        self.shard_state = shard.state
+        self.source_state = source_state
+        self.cluster_peer_id = cluster_peer_id
+        self.best_minor_block_header_observed = source_state.header_tip
+        self.drop_blocks = drop_blocks
+        self.block_request_count = 0
+        self.error = None
+
+    def is_closed(self):
+        return False
+
+    def close_with_error(self, error):
+        self.error = error
+
+    async def write_rpc_request(self, op, request):
+        await asyncio.sleep(0)
+        db = self.source_state.db
+        if op == CommandOp.GET_MINOR_BLOCK_HEADER_LIST_REQUEST:
+            header_list = []
+            block_hash = request.block_hash
+            for _ in range(request.limit):
+                header = db.get_minor_block_header_by_hash(block_hash)
+                header_list.append(header)
+                if header.height == 0:
+                    break
+                block_hash = header.hash_prev_minor_block
+            resp = GetMinorBlockHeaderListResponse(
+                self.source_state.root_tip, self.source_state.header_tip, header_list
+            )
+            return op, resp, 0
+
+        self.block_request_count += 1
+        block_list = [
+            db.get_minor_block_by_hash(h) for h in request.minor_block_hash_list
+        ]
+        if self.drop_blocks:
+            block_list = block_list[1:]
+        return op, GetMinorBlockListResponse(block_list), 0
+
+
+class TestSyncTask(unittest.TestCase):
+    def test_sync_from_multiple_peers(self):
+        source_state = create_default_shard_state(get_test_env())
+        for _ in range(45):
+            block = source_state.get_tip().create_block_to_append()
+            source_state.finalize_and_add_block(block)
+
+        shard = FakeShard(create_default_shard_state(get_test_env()))
+        conn = FakePeerShardConnection(shard, source_state, 1)
+        good_peer = FakePeerShardConnection(shard, source_state, 2)
+        bad_peer = FakePeerShardConnection(shard, source_state, 3, drop_blocks=True)
+        shard.peers = {1: conn, 2: good_peer, 3: bad_peer}
+
+        task = SyncTask(source_state.header_tip, conn)
+        task.BLOCK_BATCH_SIZE = 5
+        task.MAX_BATCHES_AHEAD = 3
+        call_async(task.sync())
+
+        self.assertIsNone(conn.error)
+        self.assertEqual(shard.state.header_tip, source_state.header_tip)
+        self.assertGreater(good_peer.block_request_count, 0)
+        # the bad peer is tried once and its batch is downloaded again from conn
+        self.assertEqual(bad_peer.block_request_count, 1)
+        self.assertEqual(
+            conn.block_request_count + good_peer.block_request_count, 45 // 5
+        )
+        self.assertEqual(task.stage_stats["execution"][0], 45)
+
+    def test_sync_bad_peer_of_task(self):
+        source_state = create_default_shard_state(get_test_env())
+        for _ in range(3):
+            block = source_state.get_tip().create_block_to_append()
+            source_state.finalize_and_add_block(block)
+
+        shard = FakeShard(create_default_shard_state(get_test_env()))
+        conn = FakePeerShardConnection(shard, source_state, 1, drop_blocks=True)
+        shard.peers = {1: conn}
+        call_async(SyncTask(source_state.header_tip, conn).sync())
+        self.assertIsNotNone(conn.error)
+        self.assertEqual(shard.state.header_tip.height, 0)
@@ -0,0 +1,47 @@
+import unittest
+
+from quarkchain.cluster.subscription import Subscriber, SubscriptionManager
+from quarkchain.core import Branch, MinorBlockHeader
+
+
+class TestSubscriptionManager(unittest.TestCase):
+    def test_publish(self):
+        manager = SubscriptionManager()
+        subscriber = Subscriber(max_queue_size=10)
+        manager.add_subscriber(subscriber)
+        headers_id = manager.subscribe(
+            subscriber,
+            SubscriptionManager.NEW_MINOR_BLOCK_HEADERS,
+            lambda header: header.branch.get_shard_id() == 1,
+        )
+        logs_id = manager.subscribe(subscriber, SubscriptionManager.LOGS)
+        self.assertNotEqual(headers_id, logs_id)
+
+        header0 = MinorBlockHeader(branch=Branch.create(2, 0))
+        header1 = MinorBlockHeader(branch=Branch.create(2, 1))
+        manager.notify_minor_block_header(header0)
+        manager.notify_minor_block_header(header1)
+        events = []
+        while not subscriber.queue.empty():
+            subscription, event = subscriber.queue.get_nowait()
+            events.append((subscription.sub_id, event))
+        self.assertEqual(
+            events, [(logs_id, header0), (headers_id, header1), (logs_id, header1)]
+        )
+
+        self.assertTrue(manager.unsubscribe(subscriber, logs_id))
+        self.assertFalse(manager.unsubscribe(subscriber, logs_id))
+        manager.notify_minor_block_header(header0)
+        self.assertTrue(subscriber.queue.empty())
+
+    def test_slow_subscriber(self):
+        manager = SubscriptionManager()
+        subscriber = Subscriber(max_queue_size=2)
+        manager.add_subscriber(subscriber)
+        manager.subscribe(subscriber, SubscriptionManager.NEW_MINOR_BLOCK_HEADERS)
+        for i in range(3):
+            manager.notify_minor_block_header(MinorBlockHeader(height=i))
+        # the waiting events are dropped and the subscriber is told to disconnect
+        self.assertTrue(subscriber.closed)
+        self.assertEqual(subscriber.queue.qsize(), 1)
+        self.assertIsNone(subscriber.queue.get_nowait())
@@ -0,0 +1,100 @@
+import unittest
+
+from quarkchain.cluster.tx_pool import TransactionPool
+from quarkchain.core import Identity
+from quarkchain.evm.transactions import Transaction as EvmTransaction
+
+
+def create_evm_tx(key, nonce=0, gasprice=1, startgas=21000):
+    evm_tx = EvmTransaction(
+        nonce=nonce,
+        gasprice=gasprice,
+        startgas=startgas,
+        to=b"\x35" * 20,
+        value=0,
+        data=b"",
+    )
+    return evm_tx.sign(key=key)
+
+
+class TestTransactionPool(unittest.TestCase):
+    def setUp(self):
+        self.keys = [Identity.create_random_identity().get_key() for _ in range(3)]
+
+    def test_pop_by_gas_price_and_nonce(self):
+        pool = TransactionPool(100)
+        txs = [
+            create_evm_tx(self.keys[0], nonce=0, gasprice=5),
+            create_evm_tx(self.keys[0], nonce=1, gasprice=100),
+            create_evm_tx(self.keys[1], nonce=0, gasprice=10),
+            create_evm_tx(self.keys[2], nonce=0, gasprice=10),
+        ]
+        # add out of nonce order
+        for tx in reversed(txs):
+            self.assertTrue(pool.add_transaction(tx))
+        self.assertEqual(len(pool), 4)
+
+        # same gas price is first in first out
+        self.assertEqual(pool.pop_transaction(), txs[3])
+        self.assertEqual(pool.pop_transaction(), txs[2])
+        # nonce 1 is not ready before nonce 0
+        self.assertEqual(pool.pop_transaction(), txs[0])
+        self.assertEqual(pool.pop_transaction(), txs[1])
+        self.assertIsNone(pool.pop_transaction())
+        self.assertEqual(len(pool), 0)
+
+    def test_pop_max_gas(self):
+        pool = TransactionPool(100)
+        tx1 = create_evm_tx(self.keys[0], gasprice=10, startgas=50000)
+        tx2 = create_evm_tx(self.keys[1], gasprice=1, startgas=21000)
+        pool.add_transaction(tx1)
+        pool.add_transaction(tx2)
+        self.assertEqual(pool.pop_transaction(max_gas=30000), tx2)
+        self.assertIsNone(pool.pop_transaction(max_gas=30000))
+        self.assertEqual(pool.pop_transaction(max_gas=50000), tx1)
+
+    def test_replace_by_fee(self):
+        pool = TransactionPool(100)
+        tx1 = create_evm_tx(self.keys[0], gasprice=100)
+        self.assertTrue(pool.add_transaction(tx1))
+        self.assertFalse(pool.add_transaction(tx1))
+        # not enough price bump
+        self.assertFalse(
+            pool.add_transaction(create_evm_tx(self.keys[0], gasprice=109))
+        )
+        tx2 = create_evm_tx(self.keys[0], gasprice=110)
+        self.assertTrue(pool.add_transaction(tx2))
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.get_stats()["replaced"], 1)
+        self.assertEqual(pool.pop_transaction(), tx2)
+
+    def test_evict_cheapest(self):
+        pool = TransactionPool(3)
+        tx0 = create_evm_tx(self.keys[0], nonce=0, gasprice=2)
+        tx1 = create_evm_tx(self.keys[0], nonce=1, gasprice=20)
+        tx2 = create_evm_tx(self.keys[1], gasprice=5)
+        for tx in [tx0, tx1, tx2]:
+            self.assertTrue(pool.add_transaction(tx))
+
+        self.assertFalse(pool.has_room_for(2))
+        self.assertFalse(pool.add_transaction(create_evm_tx(self.keys[2], gasprice=2)))
+        # evicting tx0 also evicts tx1 of the same sender
+        tx3 = create_evm_tx(self.keys[2], gasprice=3)
+        self.assertTrue(pool.add_transaction(tx3))
+        self.assertEqual(pool.get_evm_transactions(), [tx2, tx3])
+        self.assertEqual(pool.get_stats()["evicted"], 2)
+
+    def test_remove_transactions(self):
+        pool = TransactionPool(100)
+        tx0 = create_evm_tx(self.keys[0], nonce=0)
+        tx1 = create_evm_tx(self.keys[0], nonce=1)
+        pool.add_transaction(tx0)
+        pool.add_transaction(tx1)
+        hashes = [h for h in pool.entries]
+        self.assertEqual(pool.get_stats()["senders"], 1)
+
+        pool.remove_transactions(hashes[:1] + [bytes(32)])
+        self.assertNotIn(hashes[0], pool)
+        self.assertIn(hashes[1], pool)
+        self.assertEqual(pool.pop_transaction(), tx1)
+        self.assertEqual(pool.get_stats()["senders"], 0)
@@ -0,0 +1,182 @@
+import bisect
+import heapq
+from typing import List, Optional
+
+from quarkchain.core import Code, Transaction
+from quarkchain.evm.transactions import Transaction as EvmTransaction
+
+
+class PoolEntry:
+    def __init__(self, tx: Transaction, evm_tx: EvmTransaction, counter: int):
+        self.tx = tx
+        self.evm_tx = evm_tx
+        self.tx_hash = tx.get_hash()
+        self.sender = evm_tx.sender
+        self.nonce = evm_tx.nonce
+        self.gasprice = evm_tx.gasprice
+        self.counter = counter
+        self.removed = False
+        self.in_ready_heap = False
+
+
+class TransactionPool:
+    """ Pending transactions of a shard indexed by
+    - tx hash
+    - sender, with the nonces of the sender sorted
+    - gas price of the lowest-nonce tx of each sender, to pick the txs for a block
+    - gas price of all the txs, to evict the cheapest one when the pool is full
+    The heaps are cleaned lazily so removing a tx takes O(log n) amortized.
+    A tx with the same sender and nonce as a pending one replaces it if its gas price is at least
+    PRICE_BUMP_PERCENT higher.
+    """
+
+    PRICE_BUMP_PERCENT = 10
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.counter = 0
+        self.entries = dict()  # tx hash -> PoolEntry
+        self.sender_entries = dict()  # sender -> {nonce -> PoolEntry}
+        self.sender_nonces = dict()  # sender -> sorted list of nonces
+        self.ready_heap = []  # (-gasprice, counter, PoolEntry)
+        self.price_heap = []  # (gasprice, counter, PoolEntry)
+
+        self.replaced_count = 0
+        self.evicted_count = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.entries
+
+    def get(self, tx_hash) -> Optional[Transaction]:
+        entry = self.entries.get(tx_hash, None)
+        return entry.tx if entry else None
+
+    def get_evm_transactions(self) -> List[EvmTransaction]:
+        return [entry.evm_tx for entry in self.entries.values()]
+
+    def __is_ready(self, entry):
+        """ Whether the entry is the lowest-nonce tx of its sender """
+        return not entry.removed and self.sender_nonces[entry.sender][0] == entry.nonce
+
+    def __push_ready(self, entry):
+        if entry.in_ready_heap:
+            return
+        entry.in_ready_heap = True
+        heapq.heappush(self.ready_heap, (-entry.gasprice, entry.counter, entry))
+
+    def __peek_cheapest(self) -> Optional[PoolEntry]:
+        while self.price_heap and self.price_heap[0][2].removed:
+            heapq.heappop(self.price_heap)
+        return self.price_heap[0][2] if self.price_heap else None
+
+    def __remove(self, entry):
+        entry.removed = True
+        del self.entries[entry.tx_hash]
+        nonce_to_entry = self.sender_entries[entry.sender]
+        del nonce_to_entry[entry.nonce]
+        nonces = self.sender_nonces[entry.sender]
+        index = bisect.bisect_left(nonces, entry.nonce)
+        del nonces[index]
+        if not nonces:
+            del self.sender_entries[entry.sender]
+            del self.sender_nonces[entry.sender]
+        elif index == 0:
+            self.__push_ready(nonce_to_entry[nonces[0]])
+
+    def __evict(self, entry):
+        """ Evict the entry and the txs of the same sender with higher nonces,
+        which cannot be executed without it.
+        """
+        nonces = self.sender_nonces[entry.sender]
+        higher_nonces = nonces[bisect.bisect_right(nonces, entry.nonce) :]
+        nonce_to_entry = self.sender_entries[entry.sender]
+        for e in [nonce_to_entry[nonce] for nonce in higher_nonces] + [entry]:
+            self.__remove(e)
+            self.evicted_count += 1
+
+    def has_room_for(self, gasprice) -> bool:
+        """ Whether a tx with the gas price can be added without exceeding the size limit """
+        if len(self.entries) < self.max_size:
+            return True
+        cheapest = self.__peek_cheapest()
+        return cheapest is not None and gasprice > cheapest.gasprice
+
+    def add_transaction(self, evm_tx: EvmTransaction, tx: Transaction = None) -> bool:
+        """ Returns False if the tx is rejected.
+        tx is the wrapper of evm_tx and will be created if not given.
+        """
+        if tx is None:
+            tx = Transaction(code=Code.create_evm_code(evm_tx))
+        tx_hash = tx.get_hash()
+        if tx_hash in self.entries:
+            return False
+
+        old = self.sender_entries.get(evm_tx.sender, dict()).get(evm_tx.nonce, None)
+        if old is not None:
+            if evm_tx.gasprice * 100 < old.gasprice * (100 + self.PRICE_BUMP_PERCENT):
+                return False
+            self.__remove(old)
+            self.replaced_count += 1
+        elif len(self.entries) >= self.max_size:
+            if not self.has_room_for(evm_tx.gasprice):
+                return False
+            self.__evict(self.__peek_cheapest())
+
+        entry = PoolEntry(tx, evm_tx, self.counter)
+        self.counter += 1
+        self.entries[tx_hash] = entry
+        self.sender_entries.setdefault(entry.sender, dict())[entry.nonce] = entry
+        nonces = self.sender_nonces.setdefault(entry.sender, [])
+        bisect.insort(nonces, entry.nonce)
+        heapq.heappush(self.price_heap, (entry.gasprice, entry.counter, entry))
+        if nonces[0] == entry.nonce:
+            self.__push_ready(entry)
+        return True
+
+    def remove_transactions(self, tx_hash_list):
+        for tx_hash in tx_hash_list:
+            entry = self.entries.get(tx_hash, None)
+            if entry:
+                self.__remove(entry)
+
+    def pop_transaction(
+        self, max_gas=9999999999, max_seek_depth=16, min_gasprice=0
+    ) -> Optional[EvmTransaction]:
+        """ Remove and return the tx of the highest gas price among the lowest-nonce txs of all the
+        senders, skipping the ones exceeding max_gas. Up to max_seek_depth txs are checked.
+        """
+        skipped = []
+        result = None
+        depth = 0
+        while self.ready_heap and depth < max_seek_depth:
+            _, _, entry = heapq.heappop(self.ready_heap)
+            entry.in_ready_heap = False
+            if not self.__is_ready(entry):
+                continue
+            depth += 1
+            if entry.evm_tx.startgas > max_gas:
+                skipped.append(entry)
+                continue
+            if entry.gasprice < min_gasprice:
+                skipped.append(entry)
+                break
+            result = entry
+            break
+
+        for entry in skipped:
+            self.__push_ready(entry)
+        if result is None:
+            return None
+        self.__remove(result)
+        return result.evm_tx
+
+    def get_stats(self):
+        return {
+            "pending": len(self.entries),
+            "senders": len(self.sender_entries),
+            "replaced": self.replaced_count,
+            "evicted": self.evicted_count,
+        }
@@ -5,8 +5,10 @@
 # implementation
 
 import argparse
+import collections.abc
 import copy
 import random
+import struct
 from typing import List
 
 import ecdsa
@@ -38,28 +40,39 @@ class Constant:
     SIGNATURE_HEX_LENGTH = SIGNATURE_LENGTH * 2
     TX_HASH_HEX_LENGTH = 64
     HASH_LENGTH = 32
+    # serialized sizes excluding extra_data
+    MINOR_BLOCK_HEADER_SIZE = 456
+    MINOR_BLOCK_META_SIZE = 186
+    ROOT_BLOCK_HEADER_SIZE = 146
 
 
 class ByteBuffer:
     """ Java-like ByteBuffer, which wraps a bytes or bytearray with position.
+    Reads go through a memoryview of the data so that only the returned bytes are copied.
     If there is no enough space during deserialization, throw exception
     """
 
     def __init__(self, data):
         # We don't want deserialized object to have bytearray
         # which isn't hashable
-        self.bytes = bytes(data)
+        self.bytes = data if isinstance(data, bytes) else bytes(data)
+        self.view = memoryview(self.bytes)
         self.position = 0
 
-    def __check_space(self, space):
+    def check_space(self, space):
         if space > len(self.bytes) - self.position:
             raise RuntimeError("buffer is shorter than expected")
 
     def get_uint(self, size):
-        self.__check_space(size)
-        value = int.from_bytes(
-            self.bytes[self.position : self.position + size], byteorder="big"
-        )
+        if size > len(self.bytes) - self.position:
+            raise RuntimeError("buffer is shorter than expected")
+        st = UINT_STRUCTS.get(size, None)
+        if st is not None:
+            value = st.unpack_from(self.bytes, self.position)[0]
+        else:
+            value = int.from_bytes(
+                self.view[self.position : self.position + size], byteorder="big"
+            )
         self.position += size
         return value
 
@@ -79,8 +92,12 @@ class ByteBuffer:
         return self.get_uint(32)
 
     def get_bytes(self, size):
-        self.__check_space(size)
-        value = self.bytes[self.position : self.position + size]
+        return bytes(self.get_view(size))
+
+    def get_view(self, size):
+        """ Same as get_bytes() but returns a memoryview of the buffer without copying """
+        self.check_space(size)
+        value = self.view[self.position : self.position + size]
         self.position += size
         return value
 
@@ -93,6 +110,10 @@ class ByteBuffer:
         return len(self.bytes) - self.position
 
 
+UINT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+UINT_STRUCTS = {size: struct.Struct(">" + fmt) for size, fmt in UINT_FORMATS.items()}
+
+
 class UintSerializer:
     def __init__(self, size):
         self.size = size
@@ -121,14 +142,17 @@ class FixedSizeBytesSerializer:
     def __init__(self, size):
         self.size = size
 
-    def serialize(self, bs, barray):
+    def check_size(self, bs):
         if len(bs) != self.size:
             raise RuntimeError(
                 "FixedSizeBytesSerializer input bytes size {} expect {}".format(
                     len(bs), self.size
                 )
             )
-        barray.extend(bs)
+        return bs
+
+    def serialize(self, bs, barray):
+        barray.extend(self.check_size(bs))
         return barray
 
     def deserialize(self, bb):
@@ -167,15 +191,126 @@ class PrependedSizeListSerializer:
         return [self.ser.deserialize(bb) for i in range(size)]
 
 
+class StructCodec:
+    """ Contiguous fixed-width fields packed and unpacked with a single precompiled struct.
+    fields is a list of (name, format, encode, decode), where encode converts the value of the field
+    to a tuple of struct items and decode converts the items back.
+    Both are None for the fields packed as a single item without conversion.
+    """
+
+    def __init__(self, fields):
+        self.fields = []
+        self.format = "".join(fmt for _, fmt, _, _ in fields)
+        self.struct = struct.Struct(">" + self.format)
+        for name, fmt, encode, decode in fields:
+            field_struct = struct.Struct(">" + fmt)
+            item_count = len(field_struct.unpack(bytes(field_struct.size)))
+            self.fields.append((name, encode, decode, item_count))
+
+    def to_items(self, obj):
+        items = []
+        for name, encode, _, _ in self.fields:
+            if encode is None:
+                items.append(getattr(obj, name))
+            else:
+                items.extend(encode(getattr(obj, name)))
+        return items
+
+    def from_items(self, items, kwargs):
+        i = 0
+        for name, _, decode, item_count in self.fields:
+            if decode is None:
+                kwargs[name] = items[i]
+            else:
+                kwargs[name] = decode(items[i : i + item_count])
+            i += item_count
+        return kwargs
+
+    def serialize(self, obj, barray):
+        try:
+            barray.extend(self.struct.pack(*self.to_items(obj)))
+        except struct.error as e:
+            raise OverflowError(str(e))
+
+    def deserialize_into(self, bb, kwargs):
+        bb.check_space(self.struct.size)
+        self.from_items(self.struct.unpack_from(bb.bytes, bb.position), kwargs)
+        bb.position += self.struct.size
+
+
+def get_struct_field(ser):
+    """ (format, encode, decode) of the serializer for StructCodec, or None if not fixed-width """
+    if isinstance(ser, UintSerializer):
+        size = ser.size
+        if size in UINT_FORMATS:
+            return UINT_FORMATS[size], None, None
+        return (
+            "%ds" % size,
+            lambda value: (value.to_bytes(size, byteorder="big"),),
+            lambda items: int.from_bytes(items[0], byteorder="big"),
+        )
+    if isinstance(ser, BooleanSerializer):
+        return "?", None, None
+    if isinstance(ser, FixedSizeBytesSerializer):
+        return "%ds" % ser.size, lambda bs: (ser.check_size(bs),), None
+    if isinstance(ser, type) and issubclass(ser, Serializable):
+        if len(ser.CODEC) == 1 and ser.CODEC[0][0] is None:
+            # flatten the fixed-width fields of the nested object into the struct
+            nested = ser.CODEC[0][1]
+            return (
+                nested.format,
+                nested.to_items,
+                lambda items: ser(**nested.from_items(items, dict())),
+            )
+    return None
+
+
+def compile_fields(fields):
+    """ Group the runs of fixed-width fields of FIELDS into StructCodecs.
+    Returns a list of (name, serializer) with name being None for the StructCodecs.
+    """
+    codec = []
+    struct_fields = []
+    for name, ser in fields:
+        struct_field = get_struct_field(ser)
+        if struct_field is not None:
+            struct_fields.append((name,) + struct_field)
+            continue
+        if struct_fields:
+            codec.append((None, StructCodec(struct_fields)))
+            struct_fields = []
+        codec.append((name, ser))
+    if struct_fields:
+        codec.append((None, StructCodec(struct_fields)))
+    return codec
+
+
 class Serializable:
+    FIELDS = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # FIELDS only refer to the classes already defined so they can be compiled here
+        cls.CODEC = compile_fields(cls.FIELDS)
+
     def __init__(self, *args, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @classmethod
+    def get_fixed_size(cls):
+        """ Serialized size if all the fields are fixed-width, None otherwise """
+        if len(cls.CODEC) == 1 and cls.CODEC[0][0] is None:
+            return cls.CODEC[0][1].struct.size
+        return None
+
     def serialize(self, barray: bytearray = None):
         barray = bytearray() if barray is None else barray
-        for name, ser in self.FIELDS:
-            ser.serialize(getattr(self, name), barray)
+        for name, ser in self.CODEC:
+            if name is None:
+                ser.serialize(self, barray)
+            else:
+                ser.serialize(getattr(self, name), barray)
         return barray
 
     def serialize_without(self, exclude_list, barray: bytearray = None):
@@ -190,8 +325,11 @@ class Serializable:
         if not isinstance(bb, ByteBuffer):
             bb = ByteBuffer(bb)
         kwargs = dict()
-        for name, ser in cls.FIELDS:
-            kwargs[name] = ser.deserialize(bb)
+        for name, ser in cls.CODEC:
+            if name is None:
+                ser.deserialize_into(bb, kwargs)
+            else:
+                kwargs[name] = ser.deserialize(bb)
         return cls(**kwargs)
 
     def __eq__(self, other):
@@ -207,6 +345,26 @@ class Serializable:
         return hash(tuple(h_list))
 
 
+class CachedHashMixin:
+    """ Caches get_hash() of a Serializable until any attribute is set again.
+    Fields mutated in place, e.g. appending to a list field or setting a field of a nested object,
+    are not detected, so the field should be assigned again instead.
+    """
+
+    def __setattr__(self, name, value):
+        # the classes have no descriptors so the attributes are set in __dict__ directly
+        attrs = self.__dict__
+        attrs[name] = value
+        attrs["_hash"] = None
+
+    def get_hash(self):
+        h = self.__dict__.get("_hash", None)
+        if h is None:
+            h = sha3_256(self.serialize())
+            self.__dict__["_hash"] = h
+        return h
+
+
 class Optional:
     def __init__(self, serializer):
         self.serializer = serializer
@@ -496,10 +654,24 @@ class Code(Serializable):
 
     def get_evm_transaction(self) -> EvmTransaction:
         assert self.is_evm()
-        return rlp.decode(self.code[1:], EvmTransaction)
+        evm_tx = rlp.decode(self.code[1:], EvmTransaction)
+        sender = self.get_evm_sender()
+        if sender is not None:
+            evm_tx.sender = sender
+        return evm_tx
+
+    def get_evm_sender(self):
+        """ Sender of the evm tx if it has been recovered and cached by set_evm_sender() """
+        cache = getattr(self, "_evm_sender", None)
+        if cache is None or cache[0] != self.code:
+            return None
+        return cache[1]
+
+    def set_evm_sender(self, sender: bytes):
+        self._evm_sender = (self.code, sender)
 
 
-class Transaction(Serializable):
+class Transaction(CachedHashMixin, Serializable):
     FIELDS = [
         ("in_list", PrependedSizeListSerializer(1, TransactionInput)),
         ("code", Code),
@@ -517,8 +689,13 @@ class Transaction(Serializable):
         barray = barray if barray is not None else bytearray()
         return self.serialize_without(["sign_list"], barray)
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
+    @staticmethod
+    def skip(bb):
+        """ Move the position of the ByteBuffer past a serialized tx without decoding it """
+        bb.get_view(bb.get_uint8() * TransactionInput.get_fixed_size())
+        bb.get_view(bb.get_uint32())
+        bb.get_view(bb.get_uint8() * TransactionOutput.get_fixed_size())
+        bb.get_view(bb.get_uint8() * Constant.SIGNATURE_LENGTH)
 
     def get_hash_hex(self):
         return self.get_hash().hex()
@@ -556,22 +733,116 @@ class Transaction(Serializable):
         return True
 
 
-def calculate_merkle_root(item_list):
-    if len(item_list) == 0:
-        return bytes(32)
+class LazyTransactionList(collections.abc.Sequence):
+    """ tx_list of a deserialized MinorBlock, which keeps the serialized txs and decodes each of them
+    at the first access. The txs that are never accessed are serialized by copying their bytes.
+    """
+
+    def __init__(self, data, offsets):
+        # data of the txs and the offset of each tx in it followed by the end offset
+        self.data = data
+        self.offsets = offsets
+        self.tx_list = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self.tx_list)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        tx = self.tx_list[index]
+        if tx is None:
+            if index < 0:
+                index += len(self)
+            tx = Transaction.deserialize(
+                self.data[self.offsets[index] : self.offsets[index + 1]]
+            )
+            self.tx_list[index] = tx
+        return tx
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def append(self, tx):
+        self.tx_list.append(tx)
+
+    def extend(self, tx_list):
+        self.tx_list.extend(tx_list)
+
+    def serialize(self, barray):
+        barray.extend(len(self).to_bytes(4, byteorder="big"))
+        for i, tx in enumerate(self.tx_list):
+            if tx is None:
+                barray.extend(self.data[self.offsets[i] : self.offsets[i + 1]])
+            else:
+                tx.serialize(barray)
+        return barray
+
+
+class TransactionListSerializer(PrependedSizeListSerializer):
+    """ Deserializes the txs into a LazyTransactionList """
+
+    def __init__(self):
+        super().__init__(4, Transaction)
+
+    def serialize(self, item_list, barray):
+        if isinstance(item_list, LazyTransactionList):
+            return item_list.serialize(barray)
+        return super().serialize(item_list, barray)
 
-    sha_tree = []
+    def deserialize(self, bb):
+        size = bb.get_uint(self.size_bytes)
+        start = bb.position
+        offsets = [0]
+        for i in range(size):
+            Transaction.skip(bb)
+            offsets.append(bb.position - start)
+        return LazyTransactionList(bb.view[start : bb.position], offsets)
+
+
+def calculate_merkle_root(item_list):
+    """ The leaves are the hashes of the items, an odd node at any level is paired with itself """
+    acc = MerkleAccumulator()
     for item in item_list:
-        sha_tree.append(sha3_256(item.serialize()))
+        acc.append(item)
+    return acc.root()
 
-    while len(sha_tree) != 1:
-        next_sha_tree = []
-        for i in range(0, len(sha_tree) - 1, 2):
-            next_sha_tree.append(sha3_256(sha_tree[i] + sha_tree[i + 1]))
-        if len(sha_tree) % 2 != 0:
-            next_sha_tree.append(sha3_256(sha_tree[-1] + sha_tree[-1]))
-        sha_tree = next_sha_tree
-    return sha_tree[0]
+
+class MerkleAccumulator:
+    """ Computes the merkle root of calculate_merkle_root() while the items are appended one at a time.
+    Complete subtrees are merged as soon as they are formed, so root() only hashes the O(log n)
+    pending subtrees on the right edge of the tree.
+    The items are Transaction or MinorBlockHeader, whose get_hash() is sha3_256(item.serialize()).
+    """
+
+    def __init__(self):
+        # (level, hash) of the complete subtrees, levels strictly decreasing
+        self.stack = []
+        self.count = 0
+
+    def append(self, item):
+        self.append_hash(item.get_hash())
+
+    def append_hash(self, h):
+        level = 0
+        while self.stack and self.stack[-1][0] == level:
+            h = sha3_256(self.stack.pop()[1] + h)
+            level += 1
+        self.stack.append((level, h))
+        self.count += 1
+
+    def root(self):
+        if not self.stack:
+            return bytes(32)
+        level, h = self.stack[-1]
+        for next_level, next_h in reversed(self.stack[:-1]):
+            # an odd node is paired with itself until it reaches the level of its left sibling
+            while level < next_level:
+                h = sha3_256(h + h)
+                level += 1
+            h = sha3_256(next_h + h)
+            level += 1
+        return h
 
 
 class ShardInfo(Serializable):
@@ -605,7 +876,7 @@ def mk_receipt_sha(receipts, db):
     return t.root_hash
 
 
-class MinorBlockMeta(Serializable):
+class MinorBlockMeta(CachedHashMixin, Serializable):
     """ Meta data that are not included in root block
     """
 
@@ -637,11 +908,8 @@ class MinorBlockMeta(Serializable):
         self.evm_cross_shard_receive_gas_used = evm_cross_shard_receive_gas_used
         self.extra_data = extra_data
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
-
 
-class MinorBlockHeader(Serializable):
+class MinorBlockHeader(CachedHashMixin, Serializable):
     """ Header fields that are included in root block so that the root chain could quickly verify
     - Verify minor block headers included are valid appends on existing shards
     - Verify minor block headers reach sufficient difficulty
@@ -692,15 +960,12 @@ class MinorBlockHeader(Serializable):
         self.nonce = nonce
         self.bloom = bloom
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
-
 
 class MinorBlock(Serializable):
     FIELDS = [
         ("header", MinorBlockHeader),
         ("meta", MinorBlockMeta),
-        ("tx_list", PrependedSizeListSerializer(4, Transaction)),
+        ("tx_list", TransactionListSerializer()),
     ]
 
     def __init__(
@@ -716,23 +981,26 @@ class MinorBlock(Serializable):
     def calculate_merkle_root(self):
         return calculate_merkle_root(self.tx_list)
 
-    def finalize_merkle_root(self):
+    def finalize_merkle_root(self, tx_merkle=None):
         """ Compute merkle root hash and put it in the field
+        tx_merkle is a MerkleAccumulator the txs of tx_list have been appended to while building the block
         """
-        self.meta.hash_merkle_root = self.calculate_merkle_root()
+        if tx_merkle is not None:
+            check(tx_merkle.count == len(self.tx_list))
+            self.meta.hash_merkle_root = tx_merkle.root()
+        else:
+            self.meta.hash_merkle_root = self.calculate_merkle_root()
         return self
 
-    def finalize(self, evm_state, hash_prev_root_block=None):
+    def finalize(self, evm_state, hash_prev_root_block=None, tx_merkle=None):
         if hash_prev_root_block is not None:
             self.header.hash_prev_root_block = hash_prev_root_block
         self.meta.hash_evm_state_root = evm_state.trie.root_hash
         self.meta.evm_gas_used = evm_state.gas_used
         self.meta.evm_cross_shard_receive_gas_used = evm_state.xshard_receive_gas_used
         self.header.coinbase_amount = evm_state.block_fee // 2
-        self.finalize_merkle_root()
-        self.meta.hash_evm_receipt_root = mk_receipt_sha(
-            evm_state.receipts, evm_state.db
-        )
+        self.finalize_merkle_root(tx_merkle)
+        self.meta.hash_evm_receipt_root = evm_state.get_receipt_root()
         self.header.hash_meta = self.meta.get_hash()
         self.header.bloom = evm_state.bloom
         return self
@@ -742,21 +1010,33 @@ class MinorBlock(Serializable):
         return self
 
     def get_receipt(self, db, i):
+        """ Read the receipt of the i-th tx from the receipt trie of the block """
         t = trie.Trie(db, self.meta.hash_evm_receipt_root)
         receipt = rlp.decode(t.get(rlp.encode(i)), quarkchain.evm.messages.Receipt)
-        if receipt.contract_address != b"":
-            contract_address = Address(
-                receipt.contract_address, receipt.contract_full_shard_id
-            )
-        else:
-            contract_address = Address.create_empty_account(full_shard_id=0)
-
         if i > 0:
             prev_gas_used = rlp.decode(
                 t.get(rlp.encode(i - 1)), quarkchain.evm.messages.Receipt
             ).gas_used
         else:
             prev_gas_used = self.meta.evm_cross_shard_receive_gas_used
+        return self.__create_receipt(receipt, i, prev_gas_used)
+
+    def create_receipt_list(self, evm_receipts):
+        """ Convert the EVM receipts of all the txs in the block to TransactionReceipt """
+        receipt_list = []
+        prev_gas_used = self.meta.evm_cross_shard_receive_gas_used
+        for i, receipt in enumerate(evm_receipts):
+            receipt_list.append(self.__create_receipt(receipt, i, prev_gas_used))
+            prev_gas_used = receipt.gas_used
+        return receipt_list
+
+    def __create_receipt(self, receipt, i, prev_gas_used):
+        if receipt.contract_address != b"":
+            contract_address = Address(
+                receipt.contract_address, receipt.contract_full_shard_id
+            )
+        else:
+            contract_address = Address.create_empty_account(full_shard_id=0)
 
         logs = [
             Log.create_from_eth_log(eth_log, self, tx_idx=i, log_idx=j)
@@ -810,7 +1090,7 @@ class MinorBlock(Serializable):
         return MinorBlock(header, meta, [])
 
 
-class RootBlockHeader(Serializable):
+class RootBlockHeader(CachedHashMixin, Serializable):
     FIELDS = [
         ("version", uint32),
         ("height", uint32),
@@ -842,9 +1122,6 @@ class RootBlockHeader(Serializable):
         fields = {k: v for k, v in locals().items() if k != "self"}
         super(type(self), self).__init__(**fields)
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
-
     def create_block_to_append(
         self, create_time=None, difficulty=None, address=None, nonce=0, extra_data: bytes=b"",
     ):
@@ -1024,6 +1301,13 @@ class TransactionReceipt(Serializable):
         return cls(b"", 0, 0, Address.create_empty_account(0), 0, [])
 
 
+class TransactionReceiptList(Serializable):
+    FIELDS = [("receipt_list", PrependedSizeListSerializer(4, TransactionReceipt))]
+
+    def __init__(self, receipt_list):
+        self.receipt_list = receipt_list
+
+
 def test():
     priv = KeyAPI.PrivateKey(
         bytes.fromhex(
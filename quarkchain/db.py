@@ -2,11 +2,52 @@
 import copy
 import pathlib
 import shutil
+from contextlib import contextmanager
 
 import rocksdb
 
 
+class WriteBatch:
+    """ A set of puts and deletes to be applied to a db atomically with Db.write().
+    Only the last operation on a key is kept; deleted keys map to None.
+    """
+
+    def __init__(self):
+        self.kv = dict()
+        # called after the batch is written, see Db.after_commit()
+        self.commit_callbacks = []
+        # called in reverse order if the batch is discarded, see Db.on_discard()
+        self.discard_callbacks = []
+
+    def put(self, key, value):
+        self.kv[key] = bytes(value) if isinstance(value, bytearray) else value
+
+    def delete(self, key):
+        self.kv[key] = None
+
+    def remove(self, key):
+        self.delete(key)
+
+    def clear(self):
+        self.kv.clear()
+
+    def items(self):
+        return self.kv.items()
+
+    def __len__(self):
+        return len(self.kv)
+
+    def __contains__(self, key):
+        return key in self.kv
+
+    def get(self, key):
+        return self.kv[key]
+
+
 class Db:
+    # the batch buffering all the writes inside a write_batch() context
+    _batch = None
+
     def __getitem__(self, key):
         value = self.get(key)
         if value is None:
@@ -16,6 +57,83 @@ class Db:
     def close(self):
         pass
 
+    def write(self, batch: WriteBatch):
+        """ Apply all the operations in batch atomically """
+        raise NotImplementedError()
+
+    @contextmanager
+    def write_batch(self):
+        """ Buffer all the writes to this db until the context exits, and then commit them in a single
+        atomic write. Reads inside the context see the pending writes. Nested contexts join the outermost
+        one. If an exception is raised the pending writes are discarded.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = self._batch = WriteBatch()
+        try:
+            yield batch
+            self._batch = None
+            self.write(batch)
+        except BaseException:
+            self._batch = None
+            for callback in reversed(batch.discard_callbacks):
+                callback()
+            raise
+        for callback in batch.commit_callbacks:
+            callback()
+
+    def after_commit(self, callback):
+        """ Call callback once the pending writes are committed, or right away outside of a
+        write_batch() context. Used to update the in-memory state that must match the db.
+        """
+        if self._batch is None:
+            callback()
+        else:
+            self._batch.commit_callbacks.append(callback)
+
+    def on_discard(self, callback):
+        """ Call callback if the pending writes are discarded, to undo the in-memory state updated
+        along with them. Does nothing outside of a write_batch() context.
+        """
+        if self._batch is not None:
+            self._batch.discard_callbacks.append(callback)
+
+    def _get_from_batch(self, key):
+        """ Returns (True, value) if key is pending in the current batch with value None for deletion
+        or (False, None) otherwise """
+        if self._batch is None or key not in self._batch:
+            return False, None
+        return True, self._batch.get(key)
+
+    def _merge_batch_iter(self, it, in_range, reverse=False):
+        """ Merge the sorted (key, value) iterator from storage with the pending writes in the batch """
+        if self._batch is None or len(self._batch) == 0:
+            yield from it
+            return
+
+        pending = sorted(
+            ((k, v) for k, v in self._batch.items() if in_range(k)), reverse=reverse
+        )
+        i = 0
+        for k, v in it:
+            while i < len(pending) and (
+                pending[i][0] > k if reverse else pending[i][0] < k
+            ):
+                if pending[i][1] is not None:
+                    yield pending[i]
+                i += 1
+            if i < len(pending) and pending[i][0] == k:
+                if pending[i][1] is not None:
+                    yield pending[i]
+                i += 1
+                continue
+            yield k, v
+        for k, v in pending[i:]:
+            if v is not None:
+                yield k, v
+
 
 class InMemoryDb(Db):
     """ A simple in-memory key-value database
@@ -25,7 +143,7 @@ class InMemoryDb(Db):
     def __init__(self):
         self.kv = dict()
 
-    def range_iter(self, start, end):
+    def __range_iter(self, start, end):
         keys = []
         for k in self.kv.keys():
             if k >= start and k < end:
@@ -34,7 +152,7 @@ class InMemoryDb(Db):
         for k in keys:
             yield k, self.kv[k]
 
-    def reversed_range_iter(self, start, end):
+    def __reversed_range_iter(self, start, end):
         keys = []
         for k in self.kv.keys():
             if k <= start and k > end:
@@ -43,16 +161,52 @@ class InMemoryDb(Db):
         for k in keys:
             yield k, self.kv[k]
 
+    def range_iter(self, start, end):
+        return self._merge_batch_iter(
+            self.__range_iter(start, end), lambda k: start <= k < end
+        )
+
+    def reversed_range_iter(self, start, end):
+        return self._merge_batch_iter(
+            self.__reversed_range_iter(start, end),
+            lambda k: end < k <= start,
+            reverse=True,
+        )
+
     def get(self, key, default=None):
+        found, value = self._get_from_batch(key)
+        if found:
+            return default if value is None else value
         return self.kv.get(key, default)
 
+    def multi_get(self, keys):
+        return {k: self.get(k) for k in keys}
+
     def put(self, key, value):
+        if self._batch is not None:
+            self._batch.put(key, bytes(value))
+            return
         self.kv[key] = bytes(value)
 
     def remove(self, key):
+        if self._batch is not None:
+            if key not in self:
+                raise KeyError(key)
+            self._batch.delete(key)
+            return
         del self.kv[key]
 
+    def write(self, batch):
+        for k, v in batch.items():
+            if v is None:
+                self.kv.pop(k, None)
+            else:
+                self.kv[k] = v
+
     def __contains__(self, key):
+        found, value = self._get_from_batch(key)
+        if found:
+            return value is not None
         return key in self.kv
 
 
@@ -78,31 +232,54 @@ class PersistentDb(Db):
 
     def get(self, key, default=None):
         key = key.encode() if not isinstance(key, bytes) else key
-        value = self._db.get(key)
+        found, value = self._get_from_batch(key)
+        if not found:
+            value = self._db.get(key)
         return default if value is None else value
 
     def multi_get(self, keys):
         keys = [k.encode() if not isinstance(k, bytes) else k for k in keys]
-        return self._db.multi_get(keys)  # returns a dict with keys as keys
+        result = self._db.multi_get(keys)  # returns a dict with keys as keys
+        if self._batch is not None:
+            for k in keys:
+                found, value = self._get_from_batch(k)
+                if found:
+                    result[k] = value
+        return result
 
     def put(self, key, value):
         key = key.encode() if not isinstance(key, bytes) else key
         value = bytes(value) if isinstance(value, bytearray) else value
+        if self._batch is not None:
+            return self._batch.put(key, value)
         return self._db.put(key, value)
 
     def delete(self, key):
         key = key.encode() if not isinstance(key, bytes) else key
+        if self._batch is not None:
+            return self._batch.delete(key)
         return self._db.delete(key)
 
     def remove(self, key):
         return self.delete(key)
 
+    def write(self, batch):
+        rocksdb_batch = rocksdb.WriteBatch()
+        for k, v in batch.items():
+            if v is None:
+                rocksdb_batch.delete(k)
+            else:
+                rocksdb_batch.put(k, v)
+        return self._db.write(rocksdb_batch)
+
     def __contains__(self, key):
         key = key.encode() if not isinstance(key, bytes) else key
+        found, value = self._get_from_batch(key)
+        if found:
+            return value is not None
         return self._db.get(key) is not None
 
-    def range_iter(self, start, end):
-        """ A generator yielding (key, value) for keys in [start, end) ordered by key in ascending order"""
+    def __range_iter(self, start, end):
         it = self._db.iteritems()
         it.seek(start)
         for item in it:
@@ -111,8 +288,7 @@ class PersistentDb(Db):
             else:
                 return
 
-    def reversed_range_iter(self, start, end):
-        """ A generator yielding (key, value) for keys in (end, start] ordered key in descending order"""
+    def __reversed_range_iter(self, start, end):
         it = self._db.iteritems()
         it.seek_for_prev(start)
         it = reversed(it)
@@ -122,6 +298,20 @@ class PersistentDb(Db):
             else:
                 return
 
+    def range_iter(self, start, end):
+        """ A generator yielding (key, value) for keys in [start, end) ordered by key in ascending order"""
+        return self._merge_batch_iter(
+            self.__range_iter(start, end), lambda k: start <= k < end
+        )
+
+    def reversed_range_iter(self, start, end):
+        """ A generator yielding (key, value) for keys in (end, start] ordered key in descending order"""
+        return self._merge_batch_iter(
+            self.__reversed_range_iter(start, end),
+            lambda k: end < k <= start,
+            reverse=True,
+        )
+
     def close(self):
         # No close() available for rocksdb
         # see https://github.com/twmht/python-rocksdb/issues/10
@@ -0,0 +1,175 @@
+import rlp
+
+from quarkchain.evm import utils
+from quarkchain.evm.securetrie import SecureTrie
+from quarkchain.evm.trie import BLANK_ROOT, Trie
+
+ACCOUNT_PREFIX = b"address:"
+STORAGE_PREFIX = b"storage:"
+ROOT_KEY = b"flat_state_root"
+DIFF_PREFIX = b"flat_diff:"
+UNDO_PREFIX = b"flat_undo:"
+# the diffs and undos of the blocks below this height are deleted
+PRUNED_HEIGHT_KEY = b"flat_pruned_height"
+
+# longer than any account or storage key after the prefixes
+KEY_RANGE_END = b"\xff" * 53
+
+
+def account_key(address):
+    return ACCOUNT_PREFIX + address
+
+
+def storage_key(address, key):
+    return STORAGE_PREFIX + address + utils.encode_int32(key)
+
+
+class StateDiff:
+    """ Changes made to the flat state by a block, recorded by State.commit().
+    Values are the rlp-encoded accounts and storage values, b"" for the deleted keys.
+    The storage of the accounts in wiped is cleared before the changes are applied.
+    """
+
+    def __init__(self, changes=None, wiped=None):
+        self.changes = changes if changes is not None else dict()
+        self.wiped = wiped if wiped is not None else set()
+
+    def set(self, key, value):
+        self.changes[key] = value
+
+    def wipe_storage(self, address):
+        prefix = STORAGE_PREFIX + address
+        for key in [k for k in self.changes if k.startswith(prefix)]:
+            del self.changes[key]
+        self.wiped.add(address)
+
+    def serialize(self):
+        return rlp.encode(
+            [sorted(self.wiped), [[k, v] for k, v in self.changes.items()]]
+        )
+
+    @classmethod
+    def deserialize(cls, data):
+        wiped, changes = rlp.decode(data)
+        return cls({k: v for k, v in changes}, set(wiped))
+
+
+class FlatState:
+    """ The accounts and the storage of the state at root kept as flat key-values in db,
+    so that reading an account or a storage slot takes a single lookup instead of walking the tries.
+    The diff of every block and the previous values overwritten by the blocks applied (undo)
+    are stored by block hash so that the snapshot can follow the canonical chain across reorgs.
+    root is None if there is no valid snapshot, in which case the reads go through the tries.
+    root is reloaded from db if the write batch moving the snapshot is discarded.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.root = db.get(ROOT_KEY, None)
+
+    def __reload_root(self):
+        self.root = self.db.get(ROOT_KEY, None)
+
+    def get_account(self, address):
+        return self.db.get(account_key(address), b"")
+
+    def get_storage(self, address, key):
+        return self.db.get(storage_key(address, key), b"")
+
+    def __set_root(self, root):
+        self.db.on_discard(self.__reload_root)
+        self.root = root
+        if root is not None:
+            self.db.put(ROOT_KEY, root)
+        elif ROOT_KEY in self.db:
+            self.db.remove(ROOT_KEY)
+
+    def invalidate(self):
+        self.__set_root(None)
+
+    def __remove_range(self, prefix):
+        for key, _ in list(self.db.range_iter(prefix, prefix + KEY_RANGE_END)):
+            self.db.remove(key)
+
+    def generate(self, state_root):
+        """ Rebuild the snapshot from the tries, which reads the whole state """
+        self.invalidate()
+        self.__remove_range(ACCOUNT_PREFIX)
+        self.__remove_range(STORAGE_PREFIX)
+        for address, rlpdata in SecureTrie(Trie(self.db, state_root)).iter_branch():
+            self.db.put(account_key(address), rlpdata)
+            storage_root = rlp.decode(rlpdata)[2]
+            if storage_root == BLANK_ROOT:
+                continue
+            storage_trie = SecureTrie(Trie(self.db, storage_root))
+            for key, value in storage_trie.iter_branch():
+                self.db.put(STORAGE_PREFIX + address + key, value)
+        self.__set_root(state_root)
+
+    def get_pruned_height(self):
+        return int.from_bytes(self.db.get(PRUNED_HEIGHT_KEY, b""), "big")
+
+    def put_block_diff(self, block_hash, height, diff: StateDiff):
+        """ The diff of a block below the pruned height is not kept, see prune() """
+        if height < self.get_pruned_height():
+            return
+        self.db.put(DIFF_PREFIX + block_hash, diff.serialize())
+
+    def __write(self, key, value, undo):
+        old = self.db.get(key, b"")
+        if old == value:
+            return
+        undo.append([key, old])
+        if value:
+            self.db.put(key, value)
+        else:
+            self.db.remove(key)
+
+    def apply_block(self, block_hash, state_root) -> bool:
+        """ Move the snapshot from the parent state of the block to its state.
+        Returns False if the diff of the block is missing.
+        """
+        data = self.db.get(DIFF_PREFIX + block_hash, None)
+        if data is None:
+            return False
+        diff = StateDiff.deserialize(data)
+        undo = []
+        for address in diff.wiped:
+            prefix = STORAGE_PREFIX + address
+            for key, _ in list(self.db.range_iter(prefix, prefix + KEY_RANGE_END)):
+                self.__write(key, b"", undo)
+        for key, value in diff.changes.items():
+            self.__write(key, value, undo)
+        self.db.put(UNDO_PREFIX + block_hash, rlp.encode(undo))
+        self.__set_root(state_root)
+        return True
+
+    def revert_block(self, block_hash, parent_state_root) -> bool:
+        """ Move the snapshot from the state of the block back to its parent state.
+        Returns False if the block has not been applied.
+        """
+        data = self.db.get(UNDO_PREFIX + block_hash, None)
+        if data is None:
+            return False
+        for key, value in reversed(rlp.decode(data)):
+            if value:
+                self.db.put(key, value)
+            elif key in self.db:
+                self.db.remove(key)
+        self.__set_root(parent_state_root)
+        return True
+
+    def prune(self, height, get_block_hashes):
+        """ Delete the diffs and undos of the blocks below height, which are not expected to be
+        applied or reverted any more. get_block_hashes(h) returns the hashes of the blocks at height h.
+        Should a deeper reorg happen, the missing diff only makes the snapshot be generated again.
+        """
+        pruned_height = self.get_pruned_height()
+        if height <= pruned_height:
+            return
+        for h in range(pruned_height, height):
+            for block_hash in get_block_hashes(h):
+                for key in (DIFF_PREFIX + block_hash, UNDO_PREFIX + block_hash):
+                    if key in self.db:
+                        self.db.remove(key)
+        self.db.put(PRUNED_HEIGHT_KEY, height.to_bytes(4, "big"))
@@ -30,6 +30,9 @@ class SecureTrie(object):
             k = self.db.get(h)
             yield (k, v)
 
+    def flush(self):
+        self.trie.flush()
+
     def root_hash_valid(self):
         return self.trie.root_hash_valid()
 
@@ -8,6 +8,7 @@ from quarkchain.evm import utils
 from quarkchain.evm import trie
 from quarkchain.evm.trie import Trie
 from quarkchain.evm.securetrie import SecureTrie
+from quarkchain.evm.flat_state import StateDiff, account_key, storage_key
 from quarkchain.evm.config import Env
 from quarkchain.db import Db, OverlayDb
 from quarkchain.evm.common import FakeHeader
@@ -49,6 +50,33 @@ STATE_DEFAULTS = {
 }
 
 
+class ReceiptTrie:
+    """ Trie of the receipts of a block keyed by tx index, updated as the receipts are added.
+    sync() follows the receipts list of the state, which may have been truncated by a revert.
+    """
+
+    def __init__(self, db):
+        self.trie = Trie(db, buffer_writes=True)
+        self.receipts = []
+
+    def sync(self, receipts):
+        n = min(len(self.receipts), len(receipts))
+        i = 0
+        while i < n and self.receipts[i] is receipts[i]:
+            i += 1
+        while len(self.receipts) > i:
+            self.trie.delete(rlp.encode(len(self.receipts) - 1))
+            self.receipts.pop()
+        for receipt in receipts[i:]:
+            self.trie.update(rlp.encode(len(self.receipts)), rlp.encode(receipt))
+            self.receipts.append(receipt)
+        return self
+
+    @property
+    def root_hash(self):
+        return self.trie.root_hash
+
+
 class Account(rlp.Serializable):
 
     fields = [
@@ -66,12 +94,17 @@ class Account(rlp.Serializable):
         self.address = address
         super(Account, self).__init__(nonce, balance, storage, code_hash, full_shard_id)
         self.storage_cache = {}
-        self.storage_trie = SecureTrie(Trie(self.db))
+        self.storage_trie = SecureTrie(Trie(self.db, buffer_writes=True))
         self.storage_trie.root_hash = self.storage
         self.touched = False
         self.existent_at_start = True
         self._mutable = True
         self.deleted = False
+        # the storage is read from the flat state if it is still at the root the account was read on
+        # and the slot is not changed by flat_diff, see State.get_and_cache_account()
+        self.flat_state = None
+        self.flat_root = None
+        self.flat_diff = None
 
     def commit(self):
         for k, v in self.storage_cache.items():
@@ -81,6 +114,8 @@ class Account(rlp.Serializable):
                 self.storage_trie.delete(utils.encode_int32(k))
         self.storage_cache = {}
         self.storage = self.storage_trie.root_hash
+        self.storage_trie.flush()
+        self.flat_state = None
 
     @property
     def code(self):
@@ -96,7 +131,13 @@ class Account(rlp.Serializable):
 
     def get_storage_data(self, key):
         if key not in self.storage_cache:
-            v = self.storage_trie.get(utils.encode_int32(key))
+            if self.flat_state is not None and self.flat_state.root == self.flat_root \
+                    and self.storage_trie.root_hash == self.storage \
+                    and self.address not in self.flat_diff.wiped \
+                    and storage_key(self.address, key) not in self.flat_diff.changes:
+                v = self.flat_state.get_storage(self.address, key)
+            else:
+                v = self.storage_trie.get(utils.encode_int32(key))
             self.storage_cache[key] = utils.big_endian_to_int(
                 rlp.decode(v) if v else b'')
         return self.storage_cache[key]
@@ -104,6 +145,25 @@ class Account(rlp.Serializable):
     def set_storage_data(self, key, value):
         self.storage_cache[key] = value
 
+    def copy(self, env, db):
+        """ Copy an unmodified account to another state without reloading its storage root """
+        o = Account.__new__(Account)
+        rlp.Serializable.__init__(
+            o, self.nonce, self.balance, self.storage, self.code_hash, self.full_shard_id)
+        o.db = db
+        o.env = env
+        o.address = self.address
+        o.storage_cache = dict(self.storage_cache)
+        o.storage_trie = SecureTrie(self.storage_trie.trie.copy_with_db(db))
+        o.flat_state = self.flat_state
+        o.flat_root = self.flat_root
+        o.flat_diff = self.flat_diff
+        o.touched = False
+        o.existent_at_start = self.existent_at_start
+        o._mutable = True
+        o.deleted = False
+        return o
+
     @classmethod
     def blank_account(cls, env, address, full_shard_id, initial_nonce=0, db=None):
         if db is None:
@@ -135,20 +195,30 @@ class Account(rlp.Serializable):
 # from ethereum.state import State
 class State:
 
-    def __init__(self, root=BLANK_ROOT, env=Env(), executing_on_head=False, db=None, **kwargs):
+    def __init__(self, root=BLANK_ROOT, env=Env(), flat_state=None, db=None, **kwargs):
         if db is None:
             db = env.db
         self.env = env
         self.__db = db
-        self.trie = SecureTrie(Trie(self.db, root))
+        self.trie = SecureTrie(Trie(self.db, root, buffer_writes=True))
         for k, v in STATE_DEFAULTS.items():
             setattr(self, k, kwargs.get(k, copy.copy(v)))
         self.journal = []
         self.cache = {}
+        # accounts cached by the parent of an ephemeral clone, valid while the root is unchanged
+        self.shared_cache = {}
+        self.shared_cache_root = None
         self.log_listeners = []
         self.deletes = []
         self.changed = {}
-        self.executing_on_head = executing_on_head
+        # snapshot of the state at flat_state.root for single lookup reads, see FlatState
+        self.flat_state = flat_state
+        # changes to the flat state made by the commits of this state
+        self.flat_diff = StateDiff()
+        # the root flat_diff is made on and the root after the last commit, see __get_flat_root()
+        self.flat_base_root = None
+        self.flat_commit_root = None
+        self.receipt_trie = None
 
     @property
     def db(self):
@@ -171,15 +241,23 @@ class State:
     def get_and_cache_account(self, address):
         if address in self.cache:
             return self.cache[address]
-        if self.executing_on_head and False:
-            try:
-                rlpdata = self.db[b'address:' + address]
-            except KeyError:
-                rlpdata = b''
+        shared = self.shared_cache.get(address, None)
+        if shared is not None and not shared.touched and not shared.deleted \
+                and self.trie.root_hash == self.shared_cache_root:
+            o = shared.copy(self.env, self.db)
+            self.cache[address] = o
+            return o
+        flat_root = self.__get_flat_root()
+        if flat_root is not None and account_key(address) not in self.flat_diff.changes:
+            rlpdata = self.flat_state.get_account(address)
         else:
             rlpdata = self.trie.get(address)
         if rlpdata != trie.BLANK_NODE:
             o = rlp.decode(rlpdata, Account, env=self.env, address=address, db=self.db)
+            if flat_root is not None:
+                o.flat_state = self.flat_state
+                o.flat_root = flat_root
+                o.flat_diff = self.flat_diff
         else:
             o = Account.blank_account(
                 self.env, address, self.full_shard_id, self.config['ACCOUNT_INITIAL_NONCE'], db=self.db)
@@ -188,6 +266,21 @@ class State:
         o._cached_rlp = None
         return o
 
+    def __get_flat_root(self):
+        """ Returns the root of the flat state if the committed state is the flat state with flat_diff
+        applied, in which case the keys not in flat_diff are read from the flat state, or None otherwise.
+        """
+        if self.flat_state is None or self.flat_state.root is None:
+            return None
+        if self.flat_commit_root is None:
+            base_root = self.trie.root_hash
+        elif self.flat_commit_root == self.trie.root_hash:
+            base_root = self.flat_base_root
+        else:
+            # the root is set or reverted after the commits
+            return None
+        return base_root if base_root == self.flat_state.root else None
+
     def get_balance(self, address):
         return self.get_and_cache_account(
             utils.normalize_address(address)).balance
@@ -264,6 +357,18 @@ class State:
     def add_receipt(self, receipt):
         self.receipts.append(receipt)
         self.journal.append(lambda: self.receipts.pop())
+        self._sync_receipt_trie()
+
+    def _sync_receipt_trie(self):
+        if self.receipt_trie is None:
+            self.receipt_trie = ReceiptTrie(self.db)
+        return self.receipt_trie.sync(self.receipts)
+
+    def get_receipt_root(self):
+        """ Root of the receipt trie, whose nodes are written to db """
+        receipt_trie = self._sync_receipt_trie()
+        receipt_trie.trie.flush()
+        return receipt_trie.root_hash
 
     def add_refund(self, value):
         preval = self.refunds
@@ -374,22 +479,32 @@ class State:
             utils.normalize_address(address)).to_dict()
 
     def commit(self, allow_empties=False):
+        if self.flat_commit_root is None:
+            self.flat_base_root = self.trie.root_hash
+        elif self.flat_commit_root != self.trie.root_hash:
+            self.flat_base_root = None
         for addr, acct in self.cache.items():
             if acct.touched or acct.deleted:
+                pre_storage = acct.storage
+                if pre_storage != BLANK_ROOT and acct.storage_trie.root_hash == BLANK_ROOT:
+                    # reset by reset_storage()
+                    self.flat_diff.wipe_storage(addr)
+                for k, v in acct.storage_cache.items():
+                    self.flat_diff.set(storage_key(addr, k), rlp.encode(v) if v else b'')
                 acct.commit()
                 self.deletes.extend(acct.storage_trie.deletes)
                 self.changed[addr] = True
                 if self.account_exists(addr) or allow_empties:
-                    self.trie.update(addr, rlp.encode(acct))
-                    if self.executing_on_head:
-                        self.db.put(b'address:' + addr, rlp.encode(acct))
+                    rlpdata = rlp.encode(acct)
+                    self.trie.update(addr, rlpdata)
+                    self.flat_diff.set(account_key(addr), rlpdata)
                 else:
                     self.trie.delete(addr)
-                    if self.executing_on_head:
-                        try:
-                            self.db.remove(b'address:' + addr)
-                        except KeyError:
-                            pass
+                    self.flat_diff.set(account_key(addr), b'')
+                    if pre_storage != BLANK_ROOT or acct.storage != BLANK_ROOT:
+                        self.flat_diff.wipe_storage(addr)
+        self.trie.flush()
+        self.flat_commit_root = self.trie.root_hash
         self.deletes.extend(self.trie.deletes)
         self.trie.deletes = []
         self.cache = {}
@@ -459,7 +574,7 @@ class State:
 
     # Creates a state from a snapshot
     @classmethod
-    def from_snapshot(cls, snapshot_data, env, executing_on_head=False):
+    def from_snapshot(cls, snapshot_data, env):
         state = State(env=env)
         if "alloc" in snapshot_data:
             for addr, data in snapshot_data["alloc"].items():
@@ -510,16 +625,18 @@ class State:
                 else:
                     uncles = default
                 setattr(state, k, uncles)
-        if executing_on_head:
-            state.executing_on_head = True
         state.commit()
         state.changed = {}
         return state
 
     def ephemeral_clone(self):
-        snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
+        """ Create a child state on top of the committed state that writes to an overlay db.
+        The decoded root node and the unmodified cached accounts are copied from this state
+        instead of going through a snapshot, and the accounts are only copied when accessed.
+        """
         env2 = Env(OverlayDb(self.db), self.env.config)
-        s = State.from_snapshot(snapshot, env2)
+        s = State(env=env2, flat_state=self.flat_state)
+        s.trie = SecureTrie(self.trie.trie.copy_with_db(env2.db))
         for param in STATE_DEFAULTS:
             setattr(s, param, getattr(self, param))
         s.recent_uncles = self.recent_uncles
@@ -527,7 +644,8 @@ class State:
         for acct in self.cache.values():
             assert not acct.touched or not acct.deleted
         s.journal = copy.copy(self.journal)
-        s.cache = {}
+        s.shared_cache = self.cache
+        s.shared_cache_root = self.trie.root_hash
         return s
 
 
@@ -1,7 +1,7 @@
 import os
 import json
 import quarkchain.evm.trie as trie
-from quarkchain.db import InMemoryDb
+from quarkchain.db import InMemoryDb, OverlayDb
 import itertools
 from quarkchain.utils import Logger
 import unittest
@@ -37,6 +37,7 @@ def load_tests(loader, tests, pattern):
     for key, pairs in load_tests_dict().items():
         test = unittest.FunctionTestCase((lambda key, pairs: lambda: run_test(key, pairs))(key, pairs), description=key)
         suite.addTests([test])
+    suite.addTests(loader.loadTestsFromTestCase(TestTrieWriteBuffer))
     return suite
 
 
@@ -75,6 +76,61 @@ def run_test(name, pairs):
                 name, pairs['root'], '0x' + t.root_hash.hex(), (i, list(permut) + deletes)))
 
 
+class TestTrieWriteBuffer(unittest.TestCase):
+
+    def test_flush_reachable_nodes(self):
+        pairs = [(bytes([i % 7, i]) * 16, bytes([i]) * 40) for i in range(200)]
+        db, buffered_db = InMemoryDb(), InMemoryDb()
+        t = trie.Trie(db)
+        bt = trie.Trie(buffered_db, buffer_writes=True)
+        for k, v in pairs:
+            t.update(k, v)
+            bt.update(k, v)
+        bt.delete(pairs[0][0])
+        t.delete(pairs[0][0])
+        self.assertEqual(bt.root_hash, t.root_hash)
+        self.assertEqual(len(buffered_db.kv), 0)
+        self.assertEqual(bt.get(pairs[1][0]), pairs[1][1])
+
+        bt.flush()
+        self.assertEqual(len(bt.dirty), 0)
+        # only the nodes of the final trie are written
+        self.assertLess(len(buffered_db.kv), len(db.kv))
+        self.assertEqual(trie.Trie(buffered_db, bt.root_hash).to_dict(), t.to_dict())
+
+    def test_node_cache_per_db(self):
+        pairs = [(bytes([i % 7, i]) * 16, bytes([i]) * 40) for i in range(50)]
+        db = InMemoryDb()
+        trie.enable_node_cache(db, 1000)
+        cache = trie.node_caches[db]
+
+        # nodes of a discarded batch are not cached
+        with self.assertRaises(RuntimeError):
+            with db.write_batch():
+                t = trie.Trie(db)
+                for k, v in pairs:
+                    t.update(k, v)
+                trie.Trie(db, t.root_hash).to_dict()
+                raise RuntimeError()
+        self.assertEqual(len(db.kv), 0)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+        t = trie.Trie(db)
+        for k, v in pairs:
+            t.update(k, v)
+        self.assertEqual(trie.Trie(db, t.root_hash).to_dict(), t.to_dict())
+        entries = cache.stats()["entries"]
+        self.assertGreater(entries, 0)
+
+        # the nodes in an overlay are neither cached nor visible to the tries of db
+        ot = trie.Trie(OverlayDb(db), t.root_hash)
+        ot.update(b"\xff" * 32, b"\xff" * 40)
+        self.assertEqual(ot.get(b"\xff" * 32), b"\xff" * 40)
+        self.assertEqual(cache.stats()["entries"], entries)
+        with self.assertRaises(KeyError):
+            trie.Trie(db, ot.root_hash)
+
+
 if __name__ == '__main__':
     for name, pairs in load_tests_dict().items():
         run_test(name, pairs)
@@ -1,8 +1,11 @@
 #!/usr/bin/python3
 # trie.py from ethereum under MIT license
 # use rlp to encode/decode a node as the original code
+import weakref
+
 import rlp
 from quarkchain import utils
+from quarkchain.cache import LRUCache
 from quarkchain.evm.fast_rlp import encode_optimized
 rlp_encode = encode_optimized
 
@@ -142,15 +145,46 @@ BLANK_NODE = b''
 BLANK_ROOT = utils.sha3_256(rlp.encode(b''))
 
 
+def copy_node(node):
+    """ Copy the nested lists of a decoded node, which may be modified in place by updates """
+    if isinstance(node, list):
+        return [copy_node(item) for item in node]
+    return node
+
+
+# db -> LRUCache of the decoded nodes stored in the db, keyed by node hash.
+# Only the dbs with enable_node_cache() are cached so the nodes of the overlay and
+# in-memory dbs of temporary tries are never served to the tries of another db.
+node_caches = weakref.WeakKeyDictionary()
+
+
+def enable_node_cache(db, max_entries):
+    """ Cache up to max_entries decoded nodes read from db by all the tries on it """
+    if db not in node_caches:
+        node_caches[db] = LRUCache(max_entries)
+
+
+def _child_hashes(node):
+    """ Hashes referenced by a decoded node, including the ones in the embedded nodes """
+    for item in node:
+        if isinstance(item, list):
+            yield from _child_hashes(item)
+        elif len(item) == 32:
+            yield item
+
+
 class Trie(object):
 
-    def __init__(self, db, root_hash=BLANK_ROOT):
+    def __init__(self, db, root_hash=BLANK_ROOT, buffer_writes=False):
         """it also present a dictionary like interface
 
         :param db key value database
         :root: blank or trie node in form of [key, value] or [v0,v1..v15,v]
+        :param buffer_writes: keep the new nodes in memory until flush()
         """
         self.db = db  # Pass in a database object directly
+        self.buffer_writes = buffer_writes
+        self.dirty = dict()  # hash -> rlp of the nodes not written to db yet
         self.set_root_hash(root_hash)
         self.deletes = []
 
@@ -179,7 +213,7 @@ class Trie(object):
     def _update_root_hash(self):
         val = rlp_encode(self.root_node)
         key = utils.sha3_256(val)
-        self.db.put(key, val)
+        self._put_node(key, val)
         self._root_hash = key
 
     @root_hash.setter
@@ -196,6 +230,29 @@ class Trie(object):
         self.root_node = self._decode_to_node(root_hash)
         self._root_hash = root_hash
 
+    def copy_with_db(self, db):
+        """ Return a trie with the same root on db without decoding the root node again
+        """
+        t = Trie(db, buffer_writes=self.buffer_writes)
+        t.root_node = copy_node(self.root_node)
+        t._root_hash = self._root_hash
+        t.dirty = dict(self.dirty)
+        return t
+
+    def flush(self):
+        """ Write the buffered nodes reachable from the root to db and drop the others,
+        which have been replaced by later updates
+        """
+        stack = [self._root_hash]
+        while stack:
+            hashkey = stack.pop()
+            rlpnode = self.dirty.pop(hashkey, None)
+            if rlpnode is None:
+                continue
+            self.db.put(hashkey, rlpnode)
+            stack.extend(h for h in _child_hashes(rlp.decode(rlpnode)) if h in self.dirty)
+        self.dirty.clear()
+
     def clear(self):
         """ clear all tree data
         """
@@ -222,15 +279,34 @@ class Trie(object):
 
         hashkey = utils.sha3_256(rlpnode)
         if put_in_db:
-            self.db.put(hashkey, rlpnode)
+            self._put_node(hashkey, rlpnode)
         return hashkey
 
+    def _put_node(self, hashkey, rlpnode):
+        if self.buffer_writes:
+            self.dirty[hashkey] = rlpnode
+        else:
+            self.db.put(hashkey, rlpnode)
+
     def _decode_to_node(self, encoded):
         if encoded == BLANK_NODE:
             return BLANK_NODE
         if isinstance(encoded, list):
             return encoded
+        rlpnode = self.dirty.get(encoded, None)
+        if rlpnode is not None:
+            return rlp.decode(rlpnode)
+        node_cache = node_caches.get(self.db, None)
+        if node_cache is None:
+            return rlp.decode(self.db[encoded])
+        # the callers may modify the node in place so never hand out the cached one
+        o = node_cache.get(encoded)
+        if o is not None:
+            return copy_node(o)
         o = rlp.decode(self.db[encoded])
+        # the node may be pending in a write batch of db so cache it once committed
+        cached = copy_node(o)
+        self.db.after_commit(lambda: node_cache.put(encoded, cached))
         return o
 
     def _get_node_type(self, node):
@@ -798,7 +874,7 @@ class Trie(object):
             Here key is in full form, rather than key of the individual node
         """
         if node == BLANK_NODE:
-            raise StopIteration
+            return
 
         node_type = self._get_node_type(node)
 
@@ -942,7 +1018,7 @@ class Trie(object):
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
             return True
-        return self.root_hash in self.db
+        return self.root_hash in self.dirty or self.root_hash in self.db
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+# Performance of adding transactions to a shard state and of EvmState.ephemeral_clone(),
+# which is called for every transaction added.
+#
+# --snapshot uses the previous implementation of ephemeral_clone(), which goes through
+# to_snapshot() / from_snapshot(), to compare with.
+#
+# Some numbers with 2000 transactions from different senders:
+# Clones PS: 10920.87, Add tx TPS: 4562.67 (--snapshot)
+# Clones PS: 21694.04, Add tx TPS: 6308.53
+
+from quarkchain.cluster.shard_state import ShardState
+from quarkchain.cluster.tests.test_utils import (
+    get_test_env,
+    create_transfer_transaction,
+)
+from quarkchain.core import Identity, Address
+from quarkchain.db import OverlayDb
+from quarkchain.evm.config import Env
+from quarkchain.evm.state import State as EvmState, STATE_DEFAULTS
+from quarkchain.genesis import GenesisManager
+import argparse
+import copy
+import time
+import profile
+
+
+def snapshot_ephemeral_clone(self):
+    snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
+    env2 = Env(OverlayDb(self.db), self.env.config)
+    s = EvmState.from_snapshot(snapshot, env2)
+    for param in STATE_DEFAULTS:
+        setattr(s, param, getattr(self, param))
+    s.recent_uncles = self.recent_uncles
+    s.prev_headers = self.prev_headers
+    s.journal = copy.copy(self.journal)
+    s.cache = {}
+    return s
+
+
+def create_shard_state(acc_list):
+    env = get_test_env()
+    env.quark_chain_config.TRANSACTION_QUEUE_SIZE_LIMIT_PER_SHARD = 10 ** 6
+    for acc in acc_list:
+        env.quark_chain_config.SHARD_LIST[0].GENESIS.ALLOC[
+            acc.serialize().hex()
+        ] = 10 ** 18
+    state = ShardState(env=env, shard_id=0)
+    state.init_genesis_state(GenesisManager(env.quark_chain_config).create_root_block())
+    return state
+
+
+def test_perf():
+    N = 2000
+    print("Creating %d identities" % N)
+    id_list = [Identity.create_random_identity() for i in range(N)]
+    acc_list = [Address.create_from_identity(i, full_shard_id=0) for i in id_list]
+    state = create_shard_state(acc_list)
+    # load some accounts into the cache as RPC queries would do
+    for acc in acc_list[: N // 2]:
+        state.evm_state.get_balance(acc.recipient)
+
+    start_time = time.time()
+    for acc in acc_list:
+        state.evm_state.ephemeral_clone().get_balance(acc.recipient)
+    duration = time.time() - start_time
+    print("Clones PS: %.2f" % (N / duration))
+
+    print("Creating %d transactions..." % N)
+    tx_list = [
+        create_transfer_transaction(
+            shard_state=state,
+            key=id_list[i].get_key(),
+            from_address=acc_list[i],
+            to_address=acc_list[(i + 1) % N],
+            value=1,
+        )
+        for i in range(N)
+    ]
+
+    start_time = time.time()
+    for tx in tx_list:
+        assert state.add_tx(tx)
+    duration = time.time() - start_time
+    print("Add tx TPS: %.2f" % (N / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", default=False)
+    parser.add_argument("--snapshot", default=False)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        EvmState.ephemeral_clone = snapshot_ephemeral_clone
+
+    if args.profile:
+        profile.run("test_perf()")
+    else:
+        test_perf()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Number of sha3_256 calls (header, meta and tx hashes and merkle roots) per minor block
+#
+# Blocks with evm transfer txs are finalized and added on one shard state, and the serialized blocks are
+# added to another shard state the way blocks received from peers are.
+
+from quarkchain.cluster.shard_state import ShardState
+from quarkchain.cluster.tests.test_utils import (
+    create_transfer_transaction,
+    get_test_env,
+)
+from quarkchain import core
+from quarkchain.core import Address, Identity, MinorBlock
+from quarkchain.genesis import GenesisManager
+from quarkchain.utils import sha3_256
+import argparse
+import cProfile
+import pstats
+
+
+def create_shard_state(env):
+    shard_state = ShardState(env=env, shard_id=0)
+    shard_state.init_genesis_state(
+        GenesisManager(env.quark_chain_config).create_root_block()
+    )
+    return shard_state
+
+
+def count_sha3_calls(profiler):
+    """ Number of sha3_256 calls from quarkchain.core and from everywhere (including the tries) """
+    stats = pstats.Stats(profiler).stats
+    for (filename, _, name), (_, ncalls, _, _, callers) in stats.items():
+        if name == sha3_256.__name__ and filename == sha3_256.__code__.co_filename:
+            core_calls = sum(
+                caller_stats[1]
+                for caller, caller_stats in callers.items()
+                if caller[0] == core.__file__
+            )
+            return core_calls, ncalls
+    return 0, 0
+
+
+def test_perf(num_blocks, num_txs):
+    id1 = Identity.create_random_identity()
+    acc1 = Address.create_from_identity(id1, full_shard_id=0)
+    miner_state = create_shard_state(
+        get_test_env(genesis_account=acc1, genesis_minor_quarkash=10 ** 18)
+    )
+    state = create_shard_state(
+        get_test_env(genesis_account=acc1, genesis_minor_quarkash=10 ** 18)
+    )
+
+    block_data_list = []
+    finalize_profiler = cProfile.Profile()
+    for i in range(num_blocks):
+        block = miner_state.create_block_to_mine(address=acc1)
+        for j in range(num_txs):
+            tx = create_transfer_transaction(
+                shard_state=miner_state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_address=Address.create_random_account(full_shard_id=0),
+                value=1,
+                nonce=i * num_txs + j,
+            )
+            block.add_tx(tx)
+        finalize_profiler.enable()
+        miner_state.finalize_and_add_block(block)
+        finalize_profiler.disable()
+        block_data_list.append(block.serialize())
+
+    add_profiler = cProfile.Profile()
+    add_profiler.enable()
+    for data in block_data_list:
+        state.add_block(MinorBlock.deserialize(data))
+    add_profiler.disable()
+
+    for stage, profiler in [("finalize", finalize_profiler), ("add", add_profiler)]:
+        core_calls, ncalls = count_sha3_calls(profiler)
+        print(
+            "sha3_256 calls per block with %d txs to %s: %.1f from core, %.1f in total"
+            % (num_txs, stage, core_calls / num_blocks, ncalls / num_blocks)
+        )
+    return add_profiler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", default=False)
+    parser.add_argument("--num_blocks", type=int, default=10)
+    parser.add_argument("--num_txs", type=int, default=20)
+    args = parser.parse_args()
+
+    profiler = test_perf(args.num_blocks, args.num_txs)
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+
+
+if __name__ == "__main__":
+    main()
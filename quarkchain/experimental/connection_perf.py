@@ -0,0 +1,131 @@
+# Messages per second through quarkchain.protocol.Connection over a local socket pair
+#
+# The client writes commands as fast as it can (fire-and-forget) or one rpc at a time and the
+# server counts or answers them.
+
+from quarkchain.core import PrependedSizeBytesSerializer, Serializable, uint32
+from quarkchain.env import DEFAULT_ENV
+from quarkchain.protocol import Connection
+import argparse
+import asyncio
+import socket
+import time
+
+OP_PING = 1
+OP_PONG = 2
+
+
+class Ping(Serializable):
+    FIELDS = [("value", uint32), ("data", PrependedSizeBytesSerializer(4))]
+
+    def __init__(self, value, data=b""):
+        self.value = value
+        self.data = data
+
+
+class Pong(Serializable):
+    FIELDS = [("value", uint32)]
+
+    def __init__(self, value):
+        self.value = value
+
+
+OP_SER_MAP = {OP_PING: Ping, OP_PONG: Pong}
+
+
+async def open_connection_pair(op_non_rpc_map, op_rpc_map, loop):
+    sock1, sock2 = socket.socketpair()
+    reader1, writer1 = await asyncio.open_connection(sock=sock1)
+    reader2, writer2 = await asyncio.open_connection(sock=sock2)
+    client = Connection(
+        DEFAULT_ENV, reader1, writer1, OP_SER_MAP, {}, {}, loop=loop, name="client"
+    )
+    server = Connection(
+        DEFAULT_ENV,
+        reader2,
+        writer2,
+        OP_SER_MAP,
+        op_non_rpc_map,
+        op_rpc_map,
+        loop=loop,
+        name="server",
+    )
+    asyncio.ensure_future(client.active_and_loop_forever())
+    asyncio.ensure_future(server.active_and_loop_forever())
+    return client, server
+
+
+async def test_non_rpc(n, payload_size, loop):
+    done = loop.create_future()
+    received = [0]
+
+    async def handle_ping(conn, op, ping, rpc_id):
+        received[0] += 1
+        if received[0] == n:
+            done.set_result(None)
+
+    client, server = await open_connection_pair({OP_PING: handle_ping}, {}, loop)
+    data = b"\x01" * payload_size
+    start_time = time.time()
+    for i in range(n):
+        client.write_command(OP_PING, Ping(i, data))
+        # let the event loop run now and then, as a busy node would
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    await done
+    used_time = time.time() - start_time
+    client.close()
+    server.close()
+    return used_time
+
+
+async def test_rpc(n, payload_size, loop):
+    async def handle_ping(conn, ping):
+        return Pong(ping.value)
+
+    client, server = await open_connection_pair(
+        {}, {OP_PING: (OP_PONG, handle_ping)}, loop
+    )
+    await client.wait_until_active()
+    data = b"\x01" * payload_size
+    start_time = time.time()
+    for i in range(n):
+        op, pong, rpc_id = await client.write_rpc_request(OP_PING, Ping(i, data))
+        assert pong.value == i
+    used_time = time.time() - start_time
+    client.close()
+    server.close()
+    return used_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_messages", type=int, default=100000)
+    parser.add_argument("--num_rpcs", type=int, default=10000)
+    parser.add_argument("--payload_size", type=int, default=100)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    used_time = loop.run_until_complete(
+        test_non_rpc(args.num_messages, args.payload_size, loop)
+    )
+    print(
+        "%d non-rpc messages of %d bytes: %.2fs, %.0f msgs/s"
+        % (
+            args.num_messages,
+            args.payload_size,
+            used_time,
+            args.num_messages / used_time,
+        )
+    )
+    used_time = loop.run_until_complete(
+        test_rpc(args.num_rpcs, args.payload_size, loop)
+    )
+    print(
+        "%d rpc round-trips of %d bytes: %.2fs, %.0f rpcs/s"
+        % (args.num_rpcs, args.payload_size, used_time, args.num_rpcs / used_time)
+    )
+
+
+if __name__ == "__main__":
+    main()
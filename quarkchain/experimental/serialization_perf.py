@@ -0,0 +1,64 @@
+# Performance of MinorBlock serialization round-trips
+#
+# Serializes and deserializes a block of evm transactions and its header alone.
+
+from quarkchain.core import Code, Identity, MinorBlock, MinorBlockHeader, MinorBlockMeta
+from quarkchain.core import Transaction
+from quarkchain.evm.transactions import Transaction as EvmTransaction
+import argparse
+import time
+import profile
+
+
+def create_block(tx_count):
+    key = Identity.create_random_identity().get_key()
+    tx_list = []
+    for i in range(tx_count):
+        evm_tx = EvmTransaction(
+            nonce=i,
+            gasprice=1,
+            startgas=21000,
+            to=b"\x35" * 20,
+            value=i,
+            data=b"",
+        ).sign(key=key)
+        tx_list.append(Transaction(code=Code.create_evm_code(evm_tx)))
+    return MinorBlock(MinorBlockHeader(), MinorBlockMeta(), tx_list)
+
+
+def test_perf(n, tx_count):
+    block = create_block(tx_count)
+    data = block.serialize()
+
+    start_time = time.time()
+    for i in range(n):
+        MinorBlock.deserialize(block.serialize())
+    duration = time.time() - start_time
+    print(
+        "Block round-trips: %.2f per second (%d txs, %d bytes)"
+        % (n / duration, tx_count, len(data))
+    )
+
+    header = block.header
+    start_time = time.time()
+    for i in range(n * 100):
+        MinorBlockHeader.deserialize(header.serialize())
+    duration = time.time() - start_time
+    print("Header round-trips: %.2f per second" % (n * 100 / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", default=False)
+    parser.add_argument("--num_rounds", type=int, default=200)
+    parser.add_argument("--num_txs", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile.run("test_perf({}, {})".format(args.num_rounds, args.num_txs))
+    else:
+        test_perf(args.num_rounds, args.num_txs)
+
+
+if __name__ == "__main__":
+    main()
@@ -245,49 +245,78 @@ class Connection(AbstractConnection):
         self.env = env
         self.reader = reader
         self.writer = writer
+        self.loop = loop
+        # Frames written in the current event loop iteration, sent together in one write
+        self.write_buffer = []
+        self.flush_scheduled = False
 
     async def __read_fully(self, n, allow_eof=False):
-        ba = bytearray()
-        bs = await self.reader.read(n)
-        if allow_eof and len(bs) == 0 and self.reader.at_eof():
-            return None
-
-        ba.extend(bs)
-        while len(ba) < n:
-            bs = await self.reader.read(n - len(ba))
-            if len(bs) == 0 and self.reader.at_eof():
-                raise RuntimeError("{}: read unexpected EOF".format(self.name))
-            ba.extend(bs)
-        return ba
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            if allow_eof and len(e.partial) == 0:
+                return None
+            raise RuntimeError("{}: read unexpected EOF".format(self.name))
 
     async def read_metadata_and_raw_data(self):
         """ Override AbstractConnection.read_metadata_and_raw_data()
+        The size and the metadata are read together, followed by the op, rpc id and command.
         """
-        size_bytes = await self.__read_fully(4, allow_eof=True)
-        if size_bytes is None:
+        metadata_size = self.metadata_class.get_byte_size()
+        header = await self.__read_fully(4 + metadata_size, allow_eof=True)
+        if header is None:
             self.close()
             return None, None
-        size = int.from_bytes(size_bytes, byteorder="big")
+        size = int.from_bytes(header[:4], byteorder="big")
 
         if size > self.env.quark_chain_config.P2P_COMMAND_SIZE_LIMIT:
             raise RuntimeError("{}: command package exceed limit".format(self.name))
 
-        metadata_bytes = await self.__read_fully(self.metadata_class.get_byte_size())
-        metadata = self.metadata_class.deserialize(metadata_bytes)
+        metadata = self.metadata_class.deserialize(header[4:])
 
         raw_data_without_size = await self.__read_fully(1 + 8 + size)
         return metadata, raw_data_without_size
 
+    def __write_frame(self, header, data):
+        self.write_buffer.append(header)
+        self.write_buffer.append(data)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """ Send the buffered frames to the transport """
+        self.flush_scheduled = False
+        if not self.write_buffer:
+            return
+        data = b"".join(self.write_buffer)
+        self.write_buffer = []
+        self.writer.write(data)
+
     def write_raw_data(self, metadata, raw_data):
         """ Override AbstractConnection.write_raw_data()
         """
         cmd_length_bytes = (len(raw_data) - 8 - 1).to_bytes(4, byteorder="big")
-        self.writer.write(cmd_length_bytes)
-        self.writer.write(metadata.serialize())
-        self.writer.write(raw_data)
+        self.__write_frame(cmd_length_bytes + metadata.serialize(), raw_data)
+
+    def write_raw_command(self, op, cmd_data, rpc_id=0, metadata=None):
+        """ Override AbstractConnection.write_raw_command()
+        The command is buffered as is instead of being copied into the raw data.
+        """
+        metadata = metadata if metadata else self.metadata_class()
+        header = b"".join(
+            (
+                len(cmd_data).to_bytes(4, byteorder="big"),
+                metadata.serialize(),
+                bytes((op,)),
+                rpc_id.to_bytes(8, byteorder="big"),
+            )
+        )
+        self.__write_frame(header, cmd_data)
 
     def close(self):
         """ Override AbstractConnection.close()
         """
+        self.flush()
         self.writer.close()
         super().close()
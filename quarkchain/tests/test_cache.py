@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+
+from quarkchain.cache import LRUCache, SingleFlightCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict_by_entries(self):
+        cache = LRUCache(max_entries=2)
+        cache.put(b"a", 1)
+        cache.put(b"b", 2)
+        self.assertEqual(cache.get(b"a"), 1)  # b"b" is now the least recently used
+        cache.put(b"c", 3)
+        self.assertNotIn(b"b", cache)
+        self.assertIn(b"a", cache)
+        self.assertIn(b"c", cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_evict_by_bytes(self):
+        cache = LRUCache(max_entries=10, max_bytes=100)
+        cache.put(b"a", 1, size=40)
+        cache.put(b"b", 2, size=40)
+        cache.put(b"c", 3, size=40)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(b"a", cache)
+        self.assertEqual(cache.total_bytes, 80)
+
+        # replacing an entry updates the size
+        cache.put(b"b", 4, size=10)
+        self.assertEqual(cache.total_bytes, 50)
+        self.assertEqual(cache.pop(b"c"), 3)
+        self.assertEqual(cache.total_bytes, 10)
+
+    def test_stats(self):
+        cache = LRUCache(max_entries=10)
+        cache.put(b"a", 1, size=5)
+        cache.get(b"a")
+        cache.get(b"b")
+        self.assertEqual(
+            cache.stats(),
+            {"entries": 1, "bytes": 5, "hits": 1, "misses": 1, "evictions": 0},
+        )
+
+
+class TestSingleFlightCache(unittest.TestCase):
+    def test_merge_and_cache(self):
+        cache = SingleFlightCache(ttl=60, max_entries=10)
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def run():
+            results = await asyncio.gather(
+                *[cache.get("a", 1, func) for i in range(5)]
+            )
+            self.assertEqual(results, [1] * 5)
+            self.assertEqual(await cache.get("a", 1, func), 1)
+            # a new version is computed again
+            self.assertEqual(await cache.get("a", 2, func), 2)
+            self.assertEqual(await cache.get("b", 2, func), 3)
+
+        asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(cache.merged, 4)
+
+    def test_exception(self):
+        cache = SingleFlightCache(ttl=60, max_entries=10)
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError()
+
+        async def run():
+            return await asyncio.gather(
+                *[cache.get("a", 1, func) for i in range(3)], return_exceptions=True
+            )
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        self.assertTrue(all(isinstance(e, ValueError) for e in results))
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn("a", cache.cache)
+
+    def test_cancelled(self):
+        cache = SingleFlightCache(ttl=60, max_entries=10)
+
+        async def func():
+            await asyncio.sleep(10)
+
+        async def run():
+            leader = asyncio.ensure_future(cache.get("a", 1, func))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(cache.get("a", 1, func))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.wait_for(
+                asyncio.gather(leader, follower, return_exceptions=True), timeout=1
+            )
+
+        results = asyncio.get_event_loop().run_until_complete(run())
+        self.assertTrue(
+            all(isinstance(e, asyncio.CancelledError) for e in results), results
+        )
+        self.assertEqual(cache.inflight, dict())
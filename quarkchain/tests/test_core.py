@@ -5,6 +5,12 @@ from quarkchain.core import Identity, Address
 from quarkchain.core import RootBlockHeader, MinorBlockHeader, MinorBlockMeta
 from quarkchain.core import ShardMask, Optional, Serializable, uint32
 from quarkchain.core import Transaction, ByteBuffer
+from quarkchain.core import LazyTransactionList, MinorBlock
+from quarkchain.core import MerkleAccumulator, calculate_merkle_root, mk_receipt_sha
+from quarkchain.db import InMemoryDb
+from quarkchain.evm.messages import Receipt
+from quarkchain.evm.state import ReceiptTrie
+from quarkchain.utils import sha3_256
 from quarkchain.tests.test_utils import create_random_test_transaction
 
 SIZE_LIST = [(RootBlockHeader, 146), (MinorBlockHeader, 456), (MinorBlockMeta, 186)]
@@ -108,3 +114,119 @@ class TestOptional(unittest.TestCase):
         b = v.serialize()
         v1 = Uint32Optional.deserialize(b)
         self.assertEqual(v.value, v1.value)
+
+
+class TestStructCodec(unittest.TestCase):
+    def test_fixed_width_fields(self):
+        # all the fields including branch are packed with a single struct
+        self.assertEqual(len(MinorBlockHeader.CODEC), 1)
+        header = MinorBlockHeader(
+            height=2 ** 64 - 1, branch=Branch.create(8, 3), bloom=2 ** 2048 - 1
+        )
+        self.assertEqual(MinorBlockHeader.deserialize(header.serialize()), header)
+
+        # extra_data is not fixed-width
+        self.assertEqual(
+            [name for name, _ in RootBlockHeader.CODEC], [None, "extra_data"]
+        )
+        header = RootBlockHeader(height=3, extra_data=b"abc")
+        self.assertEqual(RootBlockHeader.deserialize(header.serialize()), header)
+
+    def test_invalid_fields(self):
+        with self.assertRaises(RuntimeError):
+            MinorBlockHeader(hash_meta=bytes(31)).serialize()
+        with self.assertRaises(OverflowError):
+            MinorBlockHeader(height=2 ** 64).serialize()
+        with self.assertRaises(RuntimeError):
+            MinorBlockHeader.deserialize(MinorBlockHeader().serialize()[:-1])
+
+    def test_byte_buffer_view(self):
+        bb = ByteBuffer(bytearray(b"\x01\x02abc"))
+        self.assertEqual(bb.get_uint16(), 258)
+        view = bb.get_view(2)
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(bytes(view), b"ab")
+        self.assertEqual(bb.get_bytes(1), b"c")
+        self.assertEqual(bb.remaining(), 0)
+
+
+class TestLazyTransactionList(unittest.TestCase):
+    def test_lazy_tx_list(self):
+        id1 = Identity.create_random_identity()
+        acc2 = Address.create_random_account()
+        tx_list = [create_random_test_transaction(id1, acc2) for i in range(5)]
+        block = MinorBlock(MinorBlockHeader(), MinorBlockMeta(), tx_list)
+        data = block.serialize()
+
+        block1 = MinorBlock.deserialize(data)
+        self.assertIsInstance(block1.tx_list, LazyTransactionList)
+        self.assertEqual(block1.header, block.header)
+        self.assertTrue(all(tx is None for tx in block1.tx_list.tx_list))
+        # untouched txs are copied as is
+        self.assertEqual(block1.serialize(), data)
+
+        self.assertEqual(block1.tx_list[3], tx_list[3])
+        self.assertEqual(block1.tx_list[-1], tx_list[4])
+        self.assertEqual(sum(tx is None for tx in block1.tx_list.tx_list), 3)
+        self.assertEqual(block1.tx_list[1:3], tx_list[1:3])
+        self.assertEqual(block1, block)
+
+        tx = create_random_test_transaction(id1, acc2)
+        block1.add_tx(tx)
+        self.assertEqual(len(block1.tx_list), 6)
+        self.assertEqual(MinorBlock.deserialize(block1.serialize()).tx_list[5], tx)
+
+
+class TestCachedHash(unittest.TestCase):
+    def test_hash_invalidated_by_field_update(self):
+        header = MinorBlockHeader(height=1)
+        h = header.get_hash()
+        self.assertIs(header.get_hash(), h)
+        header.nonce = 5
+        self.assertNotEqual(header.get_hash(), h)
+        header.nonce = 0
+        self.assertEqual(header.get_hash(), h)
+
+        id1 = Identity.create_random_identity()
+        tx = create_random_test_transaction(id1, Address.create_random_account())
+        h = tx.get_hash()
+        tx.sign([Identity.create_random_identity().get_key()])
+        self.assertNotEqual(tx.get_hash(), h)
+        self.assertEqual(tx.get_hash(), Transaction.deserialize(tx.serialize()).get_hash())
+
+
+class TestMerkle(unittest.TestCase):
+    def test_merkle_root(self):
+        id1 = Identity.create_random_identity()
+        acc2 = Address.create_random_account()
+        tx_list = [create_random_test_transaction(id1, acc2) for i in range(3)]
+        h = [tx.get_hash() for tx in tx_list]
+        self.assertEqual(calculate_merkle_root([]), bytes(32))
+        self.assertEqual(calculate_merkle_root(tx_list[:1]), h[0])
+        self.assertEqual(
+            calculate_merkle_root(tx_list),
+            sha3_256(sha3_256(h[0] + h[1]) + sha3_256(h[2] + h[2])),
+        )
+
+    def test_accumulator(self):
+        id1 = Identity.create_random_identity()
+        acc2 = Address.create_random_account()
+        tx_list = [create_random_test_transaction(id1, acc2) for i in range(13)]
+        acc = MerkleAccumulator()
+        self.assertEqual(acc.root(), bytes(32))
+        for i, tx in enumerate(tx_list):
+            acc.append(tx)
+            self.assertEqual(acc.root(), calculate_merkle_root(tx_list[: i + 1]))
+
+    def test_receipt_trie(self):
+        db = InMemoryDb()
+        receipts = [Receipt(b"", i * 21000, [], b"", 0) for i in range(1, 6)]
+        receipt_trie = ReceiptTrie(db)
+        self.assertEqual(
+            receipt_trie.sync(receipts).root_hash, mk_receipt_sha(receipts, db)
+        )
+        # the state replaced the last receipts after a revert
+        receipts = receipts[:3] + [Receipt(b"", 1, [], b"", 0)]
+        self.assertEqual(
+            receipt_trie.sync(receipts).root_hash, mk_receipt_sha(receipts, db)
+        )
@@ -0,0 +1,91 @@
+import unittest
+
+from quarkchain.db import InMemoryDb, WriteBatch
+
+
+class TestWriteBatch(unittest.TestCase):
+    def test_write_batch_commit(self):
+        db = InMemoryDb()
+        db.put(b"a", b"1")
+        db.put(b"b", b"2")
+        with db.write_batch():
+            db.put(b"c", b"3")
+            db.remove(b"a")
+            # pending writes are visible inside the batch
+            self.assertEqual(db.get(b"c"), b"3")
+            self.assertNotIn(b"a", db)
+            self.assertIsNone(db.get(b"a"))
+            # but not applied yet
+            self.assertNotIn(b"c", db.kv)
+            self.assertIn(b"a", db.kv)
+        self.assertEqual(db.kv, {b"b": b"2", b"c": b"3"})
+
+    def test_write_batch_discard_on_exception(self):
+        db = InMemoryDb()
+        db.put(b"a", b"1")
+        with self.assertRaises(RuntimeError):
+            with db.write_batch():
+                db.put(b"b", b"2")
+                db.remove(b"a")
+                raise RuntimeError()
+        self.assertEqual(db.kv, {b"a": b"1"})
+
+    def test_nested_write_batch(self):
+        db = InMemoryDb()
+        with db.write_batch() as outer:
+            with db.write_batch() as inner:
+                self.assertIs(inner, outer)
+                db.put(b"a", b"1")
+            self.assertEqual(db.kv, {})
+        self.assertEqual(db.kv, {b"a": b"1"})
+
+    def test_write_batch_callbacks(self):
+        db = InMemoryDb()
+        events = []
+        db.after_commit(lambda: events.append("committed outside"))
+        db.on_discard(lambda: events.append("discarded outside"))
+        self.assertEqual(events, ["committed outside"])
+
+        events.clear()
+        with db.write_batch():
+            db.after_commit(lambda: events.append("committed"))
+            db.on_discard(lambda: events.append("discarded"))
+            self.assertEqual(events, [])
+        self.assertEqual(events, ["committed"])
+
+        events.clear()
+        with self.assertRaises(RuntimeError):
+            with db.write_batch():
+                with db.write_batch():
+                    db.after_commit(lambda: events.append("committed"))
+                    db.on_discard(lambda: events.append("discarded 1"))
+                db.on_discard(lambda: events.append("discarded 2"))
+                raise RuntimeError()
+        self.assertEqual(events, ["discarded 2", "discarded 1"])
+
+    def test_range_iter_with_pending_writes(self):
+        db = InMemoryDb()
+        for k in [b"k1", b"k3", b"k5"]:
+            db.put(k, k)
+        with db.write_batch():
+            db.put(b"k2", b"x")
+            db.put(b"k3", b"y")
+            db.remove(b"k5")
+            db.put(b"k9", b"out of range")
+            self.assertEqual(
+                list(db.range_iter(b"k1", b"k6")),
+                [(b"k1", b"k1"), (b"k2", b"x"), (b"k3", b"y")],
+            )
+            self.assertEqual(
+                list(db.reversed_range_iter(b"k5", b"k1")),
+                [(b"k3", b"y"), (b"k2", b"x")],
+            )
+
+    def test_write(self):
+        db = InMemoryDb()
+        db.put(b"a", b"1")
+        batch = WriteBatch()
+        batch.put(b"b", bytearray(b"2"))
+        batch.delete(b"a")
+        db.write(batch)
+        self.assertEqual(db.kv, {b"b": b"2"})